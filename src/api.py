@@ -1,17 +1,152 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import asyncio
+import base64
+import hashlib
+import inspect
+import json
+import threading
+
+from .filters import tx_addresses
+from .indexer import ExplorerIndex
+from .rpc import (RPCError, PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND, INVALID_PARAMS,
+                  INTERNAL_ERROR)
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# Cache-Control for final blocks and for blocks still near the tip
+IMMUTABLE = "public, max-age=31536000, immutable"
+NEAR_TIP = "public, max-age=5"
+
 
 class RESTAPI:
-    """Basic REST API using Flask."""
-    def __init__(self, blockchain):
+    """
+    REST API using Flask. Blocks are served by height, hash or page, never by
+    serializing the whole chain. Blocks `finality` or more below the tip
+    are immutable: their encoded JSON is cached and their responses carry
+    long-lived Cache-Control plus the block hash as ETag. /chain returns
+    {"blocks": [...], "next_cursor": ...}; the whole chain as one JSON
+    array is no longer served, /chain/export streams it as NDJSON instead.
+    """
+    def __init__(self, blockchain, page_size=100, max_page_size=1000, finality=6, cache_size=10000):
         self.app = Flask(__name__)
         self.blockchain = blockchain
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.finality = finality
+        self.cache_size = cache_size
+        self.encoded = OrderedDict()
+        # Flask serves requests on several threads
+        self.cache_lock = threading.Lock()
         self.setup_routes()
 
+    def _is_final(self, height):
+        return height <= len(self.blockchain.chain) - 1 - self.finality
+
+    def encode_block(self, block, cache=True):
+        """Compact JSON for a block, cached by hash once the block is final."""
+        with self.cache_lock:
+            data = self.encoded.get(block.hash)
+            if data is not None:
+                self.encoded.move_to_end(block.hash)
+                return data
+        data = json.dumps(block.to_dict(), separators=(",", ":")).encode()
+        if cache and self._is_final(block.index):
+            with self.cache_lock:
+                self.encoded[block.hash] = data
+                while len(self.encoded) > self.cache_size:
+                    self.encoded.popitem(last=False)
+        return data
+
+    def _respond(self, body, etag, final):
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = IMMUTABLE if final else NEAR_TIP
+        return response.make_conditional(request)
+
+    def _cursor(self, height):
+        # Binds the position to the block before it, so a reorg invalidates the cursor
+        token = f"{height}:{self.blockchain.chain[height - 1].hash[:16]}"
+        return base64.urlsafe_b64encode(token.encode()).decode()
+
+    def _parse_cursor(self, cursor):
+        try:
+            height, prefix = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+            height = int(height)
+        except ValueError:
+            return None
+        chain = self.blockchain.chain
+        if not 0 < height <= len(chain) or chain[height - 1].hash[:16] != prefix:
+            return None
+        return height
+
+    def _error(self, message, status):
+        response = jsonify({"error": message})
+        response.status_code = status
+        return response
+
     def setup_routes(self):
         @self.app.route('/chain', methods=['GET'])
         def get_chain():
-            return jsonify([block.__dict__ for block in self.blockchain.chain])
+            """One page of blocks: ?start=<height> or ?cursor=<token>, and ?limit=."""
+            chain = self.blockchain.chain
+            try:
+                limit = min(int(request.args.get("limit", self.page_size)), self.max_page_size)
+                start = int(request.args.get("start", 0))
+            except ValueError:
+                return self._error("start and limit must be integers", 400)
+            if "cursor" in request.args:
+                start = self._parse_cursor(request.args["cursor"])
+                if start is None:
+                    return self._error("invalid or stale cursor", 410)
+            if start < 0 or limit < 1:
+                return self._error("start must be >= 0 and limit >= 1", 400)
+            blocks = chain[start:start + limit]
+            stop = start + len(blocks)
+            next_cursor = self._cursor(stop) if stop < len(chain) else None
+            body = (b'{"blocks":[' + b",".join(self.encode_block(block) for block in blocks) +
+                    b'],"next_cursor":' + json.dumps(next_cursor).encode() + b"}")
+            etag = hashlib.sha256(body).hexdigest()
+            return self._respond(body, etag, bool(blocks) and self._is_final(stop - 1) and next_cursor is not None)
+
+        @self.app.route('/blocks/<int:height>', methods=['GET'])
+        def get_block(height):
+            chain = self.blockchain.chain
+            if height >= len(chain):
+                return self._error("block not found", 404)
+            block = chain[height]
+            return self._respond(self.encode_block(block), block.hash, self._is_final(height))
+
+        @self.app.route('/blocks/hash/<block_hash>', methods=['GET'])
+        def get_block_by_hash(block_hash):
+            block = self.blockchain.chain.get_by_hash(block_hash)
+            if block is None:
+                return self._error("block not found", 404)
+            return self._respond(self.encode_block(block), block.hash, self._is_final(block.index))
+
+        @self.app.route('/chain/export', methods=['GET'])
+        def export_chain():
+            """Every block from ?start= as NDJSON, streamed one block at a time."""
+            chain = self.blockchain.chain
+            try:
+                start = int(request.args.get("start", 0))
+            except ValueError:
+                return self._error("start must be an integer", 400)
+            if start < 0:
+                return self._error("start must be >= 0", 400)
+            stop = len(chain)
+
+            def lines():
+                for height in range(start, stop):
+                    # A full export would only churn the cache
+                    yield self.encode_block(chain[height], cache=False) + b"\n"
+
+            return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
 
         @self.app.route('/transaction', methods=['POST'])
         def add_transaction():
@@ -29,12 +164,200 @@ class GraphQLAPI:
     def run(self):
         print("GraphQL API not implemented.")
 
+class Subscriber:
+    """One WebSocket client: its subscriptions and a bounded outbound queue."""
+    def __init__(self, websocket, queue_size=256, policy="drop"):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(queue_size)
+        self.policy = policy
+        self.topics = set()
+        self.addresses = set()
+        self.dropped = 0
+        self.closing = False
+
+    def offer(self, message):
+        """
+        Queue an encoded message. When the client has fallen behind, "drop"
+        discards its oldest queued message and "disconnect" returns False
+        so the caller can close the connection.
+        """
+        if self.queue.full():
+            if self.policy == "disconnect":
+                return False
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+        return True
+
+
 class WebSocketAPI:
-    """Stub for WebSocket API."""
-    def __init__(self, blockchain):
+    """
+    Push subscriptions over WebSocket (needs the `websockets` package).
+    Clients send {"subscribe": "newHeads"}, {"subscribe": "pendingTx"} or
+    {"subscribe": "address", "address": ...} (and "unsubscribe" likewise).
+    Events come from Blockchain listener hooks; each is serialized once and
+    the same message is queued for every subscriber, so a slow client only
+    costs its own bounded queue.
+    """
+    TOPICS = ("newHeads", "pendingTx", "address")
+
+    def __init__(self, blockchain, host="127.0.0.1", port=8546, queue_size=256, policy="drop"):
+        if policy not in ("drop", "disconnect"):
+            raise ValueError(f"Unknown slow-client policy: {policy}")
         self.blockchain = blockchain
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.policy = policy
+        self.loop = None
+        self.subscribers = set()
+        self.by_topic = {"newHeads": set(), "pendingTx": set()}
+        self.by_address = {}
+        self.stats = {"encoded": 0, "queued": 0, "dropped": 0, "disconnected": 0}
+        self._server = None
+        blockchain.add_listener(self)
+
+    # Blockchain listener hooks; these run on the chain's thread
+    def on_block_accepted(self, block):
+        if self.loop is None:
+            return
+        head = block.to_dict()
+        head["tx_count"] = len(head.pop("transactions"))
+        self._publish(self.by_topic["newHeads"], {"topic": "newHeads", "data": head})
+        touched = {}
+        for position, tx in enumerate(block.transactions):
+            for address in tx_addresses(tx):
+                if address in self.by_address:
+                    touched.setdefault(address, []).append(
+                        {"txid": tx.txid, "height": block.index, "position": position})
+        for address, txs in touched.items():
+            self._publish(self.by_address.get(address, ()),
+                          {"topic": "address", "address": address, "data": txs})
+
+    def on_transaction(self, tx):
+        if self.loop is None or not self.by_topic["pendingTx"]:
+            return
+        self._publish(self.by_topic["pendingTx"], {"topic": "pendingTx", "data": tx.to_dict()})
+
+    def _publish(self, subscribers, event):
+        if not subscribers:
+            return
+        message = json.dumps(event, separators=(",", ":"))
+        self.stats["encoded"] += 1
+        self.loop.call_soon_threadsafe(self._fan_out, subscribers, message)
+
+    def _fan_out(self, subscribers, message):
+        # Runs on the server loop, which owns the queues
+        for subscriber in list(subscribers):
+            if subscriber.closing:
+                continue
+            dropped = subscriber.dropped
+            if subscriber.offer(message):
+                self.stats["queued"] += 1
+                self.stats["dropped"] += subscriber.dropped - dropped
+            else:
+                subscriber.closing = True
+                self.stats["disconnected"] += 1
+                asyncio.ensure_future(subscriber.websocket.close(1008, "subscriber too slow"))
+
+    def _subscribe(self, subscriber, request, add):
+        topic = request.get("subscribe" if add else "unsubscribe")
+        if topic not in self.TOPICS:
+            return {"error": f"unknown topic {topic!r}"}
+        if topic == "address":
+            address = request.get("address")
+            if not isinstance(address, str):
+                return {"error": "address subscriptions need an address"}
+            if add:
+                subscriber.addresses.add(address)
+                self.by_address.setdefault(address, set()).add(subscriber)
+            else:
+                subscriber.addresses.discard(address)
+                self._forget_address(subscriber, address)
+            return {"subscribed" if add else "unsubscribed": topic, "address": address}
+        if add:
+            subscriber.topics.add(topic)
+            self.by_topic[topic].add(subscriber)
+        else:
+            subscriber.topics.discard(topic)
+            self.by_topic[topic].discard(subscriber)
+        return {"subscribed" if add else "unsubscribed": topic}
+
+    def _forget_address(self, subscriber, address):
+        watchers = self.by_address.get(address)
+        if watchers is not None:
+            watchers.discard(subscriber)
+            if not watchers:
+                del self.by_address[address]
+
+    def _drop(self, subscriber):
+        """Remove a subscriber from every topic; safe to call more than once."""
+        subscriber.closing = True
+        self.subscribers.discard(subscriber)
+        for topic in subscriber.topics:
+            self.by_topic[topic].discard(subscriber)
+        for address in subscriber.addresses:
+            self._forget_address(subscriber, address)
+
+    async def _writer(self, subscriber):
+        while True:
+            message = await subscriber.queue.get()
+            await subscriber.websocket.send(message)
+
+    def _writer_done(self, subscriber, task):
+        if task.cancelled():
+            return
+        error = task.exception()
+        if not isinstance(error, websockets.ConnectionClosed):
+            print(f"WebSocket writer failed: {error!r}")
+        # Nothing more can reach this client; stop queueing for it and hang up
+        self._drop(subscriber)
+        asyncio.ensure_future(subscriber.websocket.close(1011, "send failed"))
+
+    async def _serve(self, websocket):
+        subscriber = Subscriber(websocket, self.queue_size, self.policy)
+        self.subscribers.add(subscriber)
+        writer = asyncio.ensure_future(self._writer(subscriber))
+        writer.add_done_callback(lambda task: self._writer_done(subscriber, task))
+        try:
+            async for raw in websocket:
+                try:
+                    request = json.loads(raw)
+                    if "subscribe" in request:
+                        reply = self._subscribe(subscriber, request, True)
+                    elif "unsubscribe" in request:
+                        reply = self._subscribe(subscriber, request, False)
+                    else:
+                        reply = {"error": "expected subscribe or unsubscribe"}
+                except (ValueError, TypeError, AttributeError):
+                    reply = {"error": "invalid request"}
+                # Replies share the outbound queue so they stay ordered with events
+                self._fan_out((subscriber,), json.dumps(reply, separators=(",", ":")))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            writer.cancel()
+            self._drop(subscriber)
+
+    async def start_async(self):
+        if websockets is None:
+            raise ImportError("WebSocketAPI needs the websockets package")
+        self._server = await websockets.serve(self._serve, self.host, self.port)
+        # Port 0 asks the OS for a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.loop = asyncio.get_running_loop()
+
+    async def stop_async(self):
+        self.loop = None
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
     def run(self):
-        print("WebSocket API not implemented.")
+        async def serve():
+            await self.start_async()
+            await self._server.wait_closed()
+        asyncio.run(serve())
 
 class CLIAPI:
     """Basic CLI using argparse."""
@@ -53,18 +376,246 @@ class CLIAPI:
             self.blockchain.add_transaction(sender, recipient, float(amount))
 
 class RPCAPI:
-    """Stub for JSON-RPC API."""
-    def __init__(self, blockchain):
+    """
+    JSON-RPC 2.0 over HTTP POST. Batches are spread across a thread pool
+    and answered in one response. Results for immutable queries (blocks
+    `finality` or more below the tip) are cached already encoded, keyed by
+    method and params, and spliced into responses without re-serializing.
+    sendTransactions admits a list of transactions under one chain lock.
+    """
+    def __init__(self, blockchain, workers=8, finality=6, cache_size=10000, max_batch=10000):
+        self.app = Flask(__name__)
         self.blockchain = blockchain
+        self.finality = finality
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rpc")
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.methods = {}
+        self.stats = {"calls": 0, "cache_hits": 0, "errors": 0}
+        self.stats_lock = threading.Lock()
+        final_block = lambda block: block is not None and self._is_final(block["index"])
+        number = (int, float)
+        self.register("getBlockCount", lambda: len(self.blockchain.chain))
+        self.register("getBlockHash", self.get_block_hash, types={"height": int})
+        self.register("getBlock", self.get_block, immutable=final_block, types={"height": int})
+        self.register("getBlockByHash", self.get_block_by_hash, immutable=final_block, types={"block_hash": str})
+        self.register("getMempoolInfo", lambda: {"size": len(self.blockchain.mempool),
+                                                 "bytes": self.blockchain.mempool.bytes})
+        self.register("sendTransaction", self.send_transaction,
+                      types={"sender": str, "recipient": str, "amount": number, "fee": number, "nonce": int})
+        self.register("sendTransactions", self.send_transactions, types={"transactions": list})
+        self.setup_routes()
+
+    def register(self, name, handler, immutable=None, types=None):
+        """
+        Expose `handler` as method `name`. `immutable(result)` says whether
+        a result will never change, so it may be cached. `types` maps
+        parameter names to the type(s) they must have; None is always allowed
+        for parameters that default to it.
+        """
+        self.methods[name] = (handler, inspect.signature(handler), immutable, types or {})
+
+    def _count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def _check_params(self, method, params):
+        """Bind params to a method's signature and check their types, before anything runs."""
+        _, signature, _, types = self.methods[method]
+        try:
+            if isinstance(params, list):
+                bound = signature.bind(*params)
+            elif isinstance(params, dict):
+                bound = signature.bind(**params)
+            else:
+                raise TypeError("params must be an array or object")
+        except TypeError as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+        for name, value in bound.arguments.items():
+            expected = types.get(name)
+            if expected is None or (value is None and signature.parameters[name].default is None):
+                continue
+            # bool is an int subclass, but True is not a height or an amount
+            if isinstance(value, bool) or not isinstance(value, expected):
+                raise RPCError(INVALID_PARAMS, f"invalid value for {name}: {value!r}")
+
+    def _is_final(self, height):
+        return height <= len(self.blockchain.chain) - 1 - self.finality
+
+    def get_block_hash(self, height):
+        chain = self.blockchain.chain
+        return chain[height].hash if 0 <= height < len(chain) else None
+
+    def get_block(self, height):
+        chain = self.blockchain.chain
+        return chain[height].to_dict() if 0 <= height < len(chain) else None
+
+    def get_block_by_hash(self, block_hash):
+        block = self.blockchain.chain.get_by_hash(block_hash)
+        return block and block.to_dict()
+
+    def send_transaction(self, sender, recipient, amount, contract=None, fee=0, nonce=None):
+        """The new transaction's txid, or None if the mempool rejected it."""
+        return self.blockchain.add_transaction(sender, recipient, amount, contract, fee, nonce)
+
+    def send_transactions(self, transactions):
+        """Bulk submission: a txid (or None) per transaction, in order."""
+        if not isinstance(transactions, list) or not all(isinstance(tx, dict) for tx in transactions):
+            raise RPCError(INVALID_PARAMS, "expected a list of transaction objects")
+        results = []
+        # One lock acquisition for the whole batch instead of one per transaction
+        with self.blockchain.lock:
+            for tx in transactions:
+                try:
+                    self._check_params("sendTransaction", tx)
+                except RPCError:
+                    results.append(None)
+                    continue
+                results.append(self.send_transaction(**tx))
+        return results
+
+    def call(self, method, params=None):
+        """Run one method and return its result JSON-encoded (possibly from the cache)."""
+        entry = self.methods.get(method)
+        if entry is None:
+            raise RPCError(METHOD_NOT_FOUND, f"method not found: {method}")
+        handler, _, immutable, _ = entry
+        params = [] if params is None else params
+        self._check_params(method, params)
+        key = None
+        if immutable is not None:
+            key = (method, json.dumps(params, sort_keys=True))
+            with self.cache_lock:
+                encoded = self.cache.get(key)
+                if encoded is not None:
+                    self.cache.move_to_end(key)
+                    self._count("cache_hits")
+                    return encoded
+        result = handler(*params) if isinstance(params, list) else handler(**params)
+        encoded = json.dumps(result, separators=(",", ":"))
+        if key is not None and immutable(result):
+            with self.cache_lock:
+                self.cache[key] = encoded
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return encoded
+
+    def handle(self, message):
+        """One request object to an encoded response, or None for a notification."""
+        if not isinstance(message, dict) or message.get("jsonrpc") != "2.0" or \
+                not isinstance(message.get("method"), str):
+            return self._error_response(None, INVALID_REQUEST, "invalid request")
+        notification = "id" not in message
+        request_id = message.get("id")
+        self._count("calls")
+        try:
+            result = self.call(message["method"], message.get("params"))
+        except RPCError as e:
+            return None if notification else self._error_response(request_id, e.code, e.message)
+        except Exception as e:
+            print(f"RPC method {message['method']} failed: {e}")
+            return None if notification else self._error_response(request_id, INTERNAL_ERROR, "internal error")
+        if notification:
+            return None
+        return '{"jsonrpc":"2.0","result":%s,"id":%s}' % (result, json.dumps(request_id))
+
+    def handle_batch(self, messages):
+        """Encoded responses for a batch, in request order, notifications omitted."""
+        responses = self.pool.map(self.handle, messages) if len(messages) > 1 else map(self.handle, messages)
+        return [response for response in responses if response is not None]
+
+    def _error_response(self, request_id, code, message):
+        self._count("errors")
+        return json.dumps({"jsonrpc": "2.0", "error": {"code": code, "message": message}, "id": request_id},
+                          separators=(",", ":"))
+
+    def setup_routes(self):
+        @self.app.route('/', methods=['POST'])
+        def rpc():
+            try:
+                payload = json.loads(request.get_data())
+            except ValueError:
+                return Response(self._error_response(None, PARSE_ERROR, "parse error"), mimetype="application/json")
+            if isinstance(payload, list):
+                if not payload or len(payload) > self.max_batch:
+                    body = self._error_response(None, INVALID_REQUEST, "batch must hold 1 to %d requests"
+                                                % self.max_batch)
+                    return Response(body, mimetype="application/json")
+                responses = self.handle_batch(payload)
+                if not responses:
+                    return Response(status=204)
+                return Response("[" + ",".join(responses) + "]", mimetype="application/json")
+            response = self.handle(payload)
+            if response is None:
+                return Response(status=204)
+            return Response(response, mimetype="application/json")
+
     def run(self):
-        print("RPC API not implemented.")
+        self.app.run(port=8545, threaded=True)
 
 class ExplorerAPI:
-    """Block/tx explorer stub."""
-    def __init__(self, blockchain):
+    """
+    Block/tx explorer backed by an ExplorerIndex, so address histories and
+    transaction lookups are index queries instead of chain scans.
+    """
+    def __init__(self, blockchain, index=None, path=":memory:"):
         self.blockchain = blockchain
+        self.index = index or ExplorerIndex(path)
+        with blockchain.lock:
+            self.index.catch_up(blockchain.chain)
+            blockchain.add_listener(self.index)
+        self.app = Flask(__name__)
+        self.setup_routes()
+
+    def transaction(self, txid):
+        location = self.index.locate(txid)
+        if location is None:
+            return None
+        height, position = location
+        tx = self.blockchain.chain[height].transactions[position]
+        return {"txid": txid, "height": height, "position": position, "tx": tx.to_dict()}
+
+    def address_history(self, address, limit=50, before=None):
+        """One page of an address's history; `before` is the previous page's "<height>:<position>" cursor."""
+        if isinstance(before, str):
+            height, position = before.split(":")
+            before = (int(height), int(position))
+        rows = self.index.history(address, limit, before)
+        return {
+            "address": address,
+            "transactions": [{"height": h, "position": p, "txid": txid} for h, p, txid in rows],
+            "next": f"{rows[-1][0]}:{rows[-1][1]}" if len(rows) == limit else None,
+        }
+
+    def setup_routes(self):
+        @self.app.route('/tx/<txid>', methods=['GET'])
+        def get_transaction(txid):
+            result = self.transaction(txid)
+            if result is None:
+                response = jsonify({"error": "transaction not found"})
+                response.status_code = 404
+                return response
+            return jsonify(result)
+
+        @self.app.route('/address/<address>', methods=['GET'])
+        def get_address(address):
+            limit = min(request.args.get("limit", 50, type=int), 1000)
+            if limit < 1:
+                # SQLite treats a negative LIMIT as no limit at all
+                response = jsonify({"error": "limit must be >= 1"})
+                response.status_code = 400
+                return response
+            try:
+                return jsonify(self.address_history(address, limit, request.args.get("before") or None))
+            except ValueError:
+                response = jsonify({"error": "before must be <height>:<position>"})
+                response.status_code = 400
+                return response
+
     def run(self):
-        print("Explorer not implemented.")
+        self.app.run(port=5001)
 
 class WalletIntegration:
     """Basic wallet API stub."""
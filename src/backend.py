@@ -1,18 +1,12 @@
-import requests
+from .rpc import RPCClient
 
 class GethBackend:
-    def __init__(self, rpc_url="http://localhost:8545"):
+    def __init__(self, rpc_url="http://localhost:8545", client=None):
         self.rpc_url = rpc_url
+        self.client = client or RPCClient(rpc_url)
 
     def rpc_call(self, method, params=None):
-        payload = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "params": params or [],
-            "id": 1
-        }
-        response = requests.post(self.rpc_url, json=payload)
-        return response.json()
+        return self.client.request(method, params)
 
     def deploy_contract(self, bytecode, abi, sender):
         # Minimal stub: send raw transaction
@@ -25,5 +19,20 @@ class GethBackend:
     def send_transaction(self, tx):
         return self.rpc_call("eth_sendTransaction", [tx])
 
+    def send_transactions(self, txs):
+        """Submit many transactions in JSON-RPC batches; responses come back in order."""
+        return self.client.batch(("eth_sendTransaction", [tx]) for tx in txs)
+
     def get_block_number(self):
         return self.rpc_call("eth_blockNumber")
+
+    def get_block(self, number, full_transactions=False):
+        """Block by number, or a tag such as "latest"."""
+        tag = hex(number) if isinstance(number, int) else number
+        return self.rpc_call("eth_getBlockByNumber", [tag, full_transactions])
+
+    def get_block_by_hash(self, block_hash, full_transactions=False):
+        return self.rpc_call("eth_getBlockByHash", [block_hash, full_transactions])
+
+    def get_transaction_receipt(self, tx_hash):
+        return self.rpc_call("eth_getTransactionReceipt", [tx_hash])
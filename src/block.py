@@ -1,15 +1,154 @@
 import time
 import hashlib
+import struct
 
-class Block:
-    def __init__(self, index, previous_hash, transactions, timestamp=None, nonce=0):
+from .merkle import MerkleTree, verify_proof
+from .serialization import encode_txs, read_txs, tx_hash
+# Imported for their codec registrations, so Block.decode can rebuild any tx
+from . import transaction, transaction_types  # noqa: F401
+
+# version, index, previous_hash, merkle_root, timestamp, difficulty | nonce
+HEADER_PREFIX = struct.Struct(">IQ32s32sdI")
+NONCE = struct.Struct(">Q")
+HEADER_SIZE = HEADER_PREFIX.size + NONCE.size
+
+
+def encode_nonce(nonce):
+    return NONCE.pack(nonce)
+
+
+def _hash_bytes(hex_hash):
+    return bytes.fromhex(hex_hash.rjust(64, "0"))
+
+
+class BlockHeader:
+    """Fixed-size block header; its hash commits to the body via the Merkle root."""
+    __slots__ = ("version", "index", "previous_hash", "merkle_root", "timestamp", "difficulty", "nonce")
+
+    def __init__(self, index, previous_hash, merkle_root, timestamp, nonce=0, difficulty=0, version=1):
+        self.version = version
         self.index = index
         self.previous_hash = previous_hash
-        self.transactions = transactions
-        self.timestamp = timestamp or time.time()
+        self.merkle_root = merkle_root
+        self.timestamp = timestamp
+        self.difficulty = difficulty
         self.nonce = nonce
+
+    def prefix(self):
+        """Every header field but the nonce, so miners can hash it once per block."""
+        return HEADER_PREFIX.pack(
+            self.version, self.index, _hash_bytes(self.previous_hash),
+            _hash_bytes(self.merkle_root), self.timestamp, self.difficulty,
+        )
+
+    def encode(self):
+        return self.prefix() + encode_nonce(self.nonce)
+
+    def compute_hash(self):
+        h = hashlib.sha256(self.prefix())
+        h.update(encode_nonce(self.nonce))
+        return h.hexdigest()
+
+    @classmethod
+    def decode(cls, data):
+        if len(data) < HEADER_SIZE:
+            raise ValueError(f"Block header needs {HEADER_SIZE} bytes, got {len(data)}")
+        version, index, previous_hash, merkle_root, timestamp, difficulty = HEADER_PREFIX.unpack_from(data)
+        nonce, = NONCE.unpack_from(data, HEADER_PREFIX.size)
+        return cls(index, previous_hash.hex(), merkle_root.hex(), timestamp, nonce, difficulty, version)
+
+
+class Block:
+    def __init__(self, index, previous_hash, transactions, timestamp=None, nonce=0, difficulty=0, version=1):
+        self.transactions = []
+        self.merkle = MerkleTree()
+        self.header = BlockHeader(index, previous_hash, None, time.time() if timestamp is None else timestamp,
+                                  nonce, difficulty, version)
+        for tx in transactions:
+            self._append(tx)
+        self.header.merkle_root = self.merkle.root().hex()
         self.hash = self.compute_hash()
 
+    def _append(self, tx, digest=None):
+        self.transactions.append(tx)
+        self.merkle.append(digest or tx_hash(tx))
+
+    def add_transaction(self, tx):
+        """Append a transaction, updating the Merkle root and hash incrementally."""
+        self._append(tx)
+        self.header.merkle_root = self.merkle.root().hex()
+        self.hash = self.compute_hash()
+
+    @property
+    def index(self):
+        return self.header.index
+
+    @property
+    def previous_hash(self):
+        return self.header.previous_hash
+
+    @property
+    def merkle_root(self):
+        return self.header.merkle_root
+
+    @property
+    def timestamp(self):
+        return self.header.timestamp
+
+    @property
+    def difficulty(self):
+        return self.header.difficulty
+
+    @property
+    def nonce(self):
+        return self.header.nonce
+
+    @nonce.setter
+    def nonce(self, value):
+        self.header.nonce = value
+
+    def header_prefix(self):
+        return self.header.prefix()
+
     def compute_hash(self):
-        block_string = f"{self.index}{self.previous_hash}{self.transactions}{self.timestamp}{self.nonce}"
-        return hashlib.sha256(block_string.encode()).hexdigest()
+        return self.header.compute_hash()
+
+    def inclusion_proof(self, position):
+        """Merkle audit path for the transaction at `position`."""
+        return self.merkle.proof(position)
+
+    def verify_inclusion(self, tx, position, proof):
+        return verify_proof(tx_hash(tx), position, len(self.transactions), proof, bytes.fromhex(self.merkle_root))
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "hash": self.hash,
+            "previous_hash": self.previous_hash,
+            "merkle_root": self.merkle_root,
+            "timestamp": self.timestamp,
+            "difficulty": self.difficulty,
+            "nonce": self.nonce,
+            "transactions": [tx.to_dict() if hasattr(tx, "to_dict") else tx for tx in self.transactions],
+        }
+
+    def encode(self):
+        """Header followed by the length-prefixed transaction records."""
+        return self.header.encode() + encode_txs(self.transactions)
+
+    @classmethod
+    def decode(cls, data):
+        buf = memoryview(data)
+        header = BlockHeader.decode(buf)
+        # Hash the records straight from the buffer instead of re-encoding them
+        digests = []
+        transactions, _ = read_txs(buf, HEADER_SIZE, digests)
+        block = cls(header.index, header.previous_hash, [], header.timestamp,
+                    header.nonce, header.difficulty, header.version)
+        for tx, digest in zip(transactions, digests):
+            block._append(tx, digest)
+        block.header.merkle_root = block.merkle.root().hex()
+        if block.merkle_root != header.merkle_root:
+            raise ValueError(f"Block {header.index} body does not match its Merkle root")
+        block.hash = block.compute_hash()
+        return block
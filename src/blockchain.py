@@ -1,12 +1,20 @@
-
-
+import os
+import threading
 
 from .consensus import Consensus
-from .block import Block
+from .block import Block, HEADER_SIZE
 from .transaction import Transaction
 from .network import Node
 from .config import BlockConfig, ConsensusConfig, NetworkConfig, ContractConfig, StateConfig, GovernanceConfig
 from .backend import GethBackend
+from .storage import open_block_store
+from .mempool import Mempool
+from .filters import FilterIndex
+from .verify import verify_store
+from .serialization import varint_size, decode_tx
+
+# Block byte budget used when BlockConfig.size is "dynamic"
+DEFAULT_BLOCK_BYTES = 1024 * 1024
 
 class Blockchain:
     """
@@ -31,18 +39,108 @@ class Blockchain:
         else:
             self.consensus = Consensus(self.consensus_config.type)
         self.contracts = []
-        self.chain = []
-        self.transaction_pool = []
+        self.chain = open_block_store(self.state_config)
+        self.mempool = Mempool(self.state_config.mempool_bytes, self.state_config.mempool_count)
+        # Compact filters served to light clients, kept next to a persistent chain
+        filter_path = os.path.join(self.state_config.data_dir, "filters.dat") \
+            if self.state_config.storage == "file" else None
+        self.filters = FilterIndex(filter_path)
+        # Objects notified through on_block_accepted / on_block_disconnected / on_transaction
+        self.listeners = []
         self.backend = backend or None
-        self.create_genesis_block()
+        # Guards the chain tip; the node's network thread appends peer blocks
+        self.lock = threading.RLock()
+        self.node.on("block", lambda payload, peer: self.receive_block(Block.decode(payload), peer))
+        self.node.on("tx", lambda payload, peer: self.receive_transaction(decode_tx(payload), peer))
+        # A persistent store reopened after a restart already holds the chain
+        if not len(self.chain):
+            self.create_genesis_block()
+        self.filters.catch_up(self.chain)
 
     def create_genesis_block(self):
-        genesis_block = Block(0, "0", [], nonce=0)
+        # Fixed timestamp so every node derives the same genesis hash
+        genesis_block = Block(0, "0", [], timestamp=0, nonce=0)
         self.chain.append(genesis_block)
 
-    def add_transaction(self, sender, recipient, amount, contract=None):
-        tx = Transaction(sender, recipient, amount, contract)
-        self.transaction_pool.append(tx)
+    def add_transaction(self, sender, recipient, amount, contract=None, fee=0, nonce=None):
+        tx = Transaction(sender, recipient, amount, contract, fee, nonce)
+        return tx.txid if self.receive_transaction(tx) else None
+
+    def receive_transaction(self, tx, peer=None):
+        """
+        Admit a transaction to the mempool and relay it to peers. Duplicates
+        are rejected by the mempool, which also stops relay loops.
+        """
+        with self.lock:
+            accepted = self.mempool.add(tx)
+            if accepted:
+                self._notify("on_transaction", tx)
+        if accepted and self.node.running:
+            self.node.broadcast(tx.encode(), kind="tx", exclude=peer)
+        return accepted
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, event, *args):
+        for listener in self.listeners:
+            if hasattr(listener, event):
+                getattr(listener, event)(*args)
+
+    def connect_block(self, block):
+        """
+        Append an already validated block to the tip and drop its
+        transactions from the mempool.
+        """
+        with self.lock:
+            self.chain.append(block)
+            self.mempool.remove(tx.txid for tx in block.transactions)
+            self.filters.add(block)
+            self._notify("on_block_accepted", block)
+
+    def rollback(self, height):
+        """
+        Disconnect every block at `height` and above, newest first, returning
+        their transactions to the mempool. Used when switching to a fork.
+        """
+        with self.lock:
+            removed = [self.chain[h] for h in range(len(self.chain) - 1, height - 1, -1)]
+            self.chain.truncate(height)
+            self.filters.truncate(height)
+            for block in removed:
+                self._notify("on_block_disconnected", block)
+                for tx in block.transactions:
+                    self.mempool.add(tx)
+            return removed
+
+    def receive_block(self, block, peer=None):
+        """
+        Append a block from a peer if it extends our tip, cancelling our own
+        nonce search for that height, and relay it onwards.
+        """
+        with self.lock:
+            tip = self.chain[-1]
+            if block.index != len(self.chain) or block.previous_hash != tip.hash:
+                return False
+            if block.hash != block.compute_hash():
+                return False
+            if hasattr(self.consensus, "validate_block") and not self.consensus.validate_block(block, self.chain):
+                return False
+            self.cancel_mining()
+            self.connect_block(block)
+        print(f"Block {block.index} received from {peer}: {block.hash}")
+        if self.node.running:
+            self.node.broadcast(block.encode(), kind="block", exclude=peer)
+        return True
+
+    def block_budget(self):
+        """
+        Bytes available for transaction records in the next block.
+        """
+        size = self.block_config.size
+        size = size if isinstance(size, int) else DEFAULT_BLOCK_BYTES
+        # Leave room for the header and the transaction count prefix
+        return size - HEADER_SIZE - varint_size(size)
 
     def add_smart_contract(self, contract_cls):
         contract = contract_cls()
@@ -53,19 +151,64 @@ class Blockchain:
         block = Block(
             index=len(self.chain),
             previous_hash=previous_block.hash,
-            transactions=[str(tx.__dict__) for tx in self.transaction_pool],
-            nonce=0
+            transactions=self.mempool.select(self.block_budget()),
+            nonce=0,
+            difficulty=getattr(self.consensus, "difficulty", 0)
         )
+        # Let consensus seal the block (e.g. PoW nonce search) before validating it
+        if hasattr(self.consensus, "prepare_block"):
+            if not self.consensus.prepare_block(block, self.chain):
+                print("Block mining cancelled.")
+                return
         # Use consensus to validate or modify block before adding
         if hasattr(self.consensus, "validate_block"):
             if not self.consensus.validate_block(block, self.chain):
                 print("Block failed consensus validation.")
                 return
-        if hasattr(self.consensus, "on_block_mined"):
-            self.consensus.on_block_mined(block, self.chain)
-        self.chain.append(block)
-        self.transaction_pool = []
+        with self.lock:
+            # A peer's block may have claimed this height while we were mining
+            if self.chain[-1].hash != previous_block.hash:
+                print("Block mining cancelled.")
+                return
+            if hasattr(self.consensus, "on_block_mined"):
+                self.consensus.on_block_mined(block, self.chain)
+            self.connect_block(block)
         print(f"Block {block.index} mined: {block.hash}")
+        if self.node.running:
+            self.node.broadcast(block.encode(), kind="block")
+
+    def verify_chain(self, checkpoint=None, workers=None, full=False, span_size=50000):
+        """
+        Re-check the stored chain in parallel: hashes, height and parent
+        links, and proof of work (plus Merkle roots when `full`). Blocks up
+        to the `checkpoint` hash (default StateConfig.checkpoint) are trusted.
+        Returns the first bad height, or None if the chain is intact.
+        """
+        checkpoint = checkpoint or self.state_config.checkpoint
+        start = 0
+        if checkpoint:
+            height = self.chain.height_of(checkpoint)
+            if height is None:
+                print(f"Checkpoint {checkpoint} not in chain; verifying from genesis")
+            else:
+                start = height + 1
+        with self.lock:
+            return verify_store(self.chain, start, workers, getattr(self.consensus, "difficulty", 0), full, span_size)
+
+    def close(self):
+        """
+        Stop the node and flush and close the block store.
+        """
+        self.node.stop()
+        self.filters.close()
+        self.chain.close()
+
+    def cancel_mining(self):
+        """
+        Abort an in-progress nonce search, e.g. when a peer's block arrives.
+        """
+        if hasattr(self.consensus, "cancel"):
+            self.consensus.cancel()
 
     def run(self):
         print(f"Running blockchain '{self.name}'")
@@ -79,7 +222,7 @@ class Blockchain:
         print(f"Peers: {self.node.peers}")
         print(f"Smart contracts: {[c.name for c in self.contracts]}")
         print(f"Genesis block: {self.chain[0].hash}")
-        if self.transaction_pool:
+        if len(self.mempool):
             self.mine_block()
         print(f"Chain length: {len(self.chain)}")
 
@@ -95,114 +238,3 @@ class Blockchain:
         result = self.backend.deploy_contract(bytecode, abi, sender)
         print(f"Contract deployment result: {result}")
         return result
-    def __init__(self, name="MyChain", block=None, consensus=None, network=None, contract=None, state=None, governance=None, initial_nodes=None, backend=None):
-        self.name = name
-        self.block_config = block or BlockConfig()
-        self.consensus_config = consensus or ConsensusConfig()
-        self.network_config = network or NetworkConfig()
-        self.contract_config = contract or ContractConfig()
-        self.state_config = state or StateConfig()
-        self.governance_config = governance or GovernanceConfig()
-
-        self.node = Node(initial_nodes[0] if initial_nodes else "127.0.0.1:5000")
-        class Blockchain:
-            """
-            Modular Blockchain abstraction supporting configuration and deployment.
-            """
-
-            def __init__(self, name="MyChain", block=None, consensus=None, network=None, contract=None, state=None, governance=None, initial_nodes=None, backend=None):
-                """
-                Initialize the Blockchain with modular configs and optional backend.
-                """
-                self.name = name
-                self.block_config = block or BlockConfig()
-                self.consensus_config = consensus or ConsensusConfig()
-                self.network_config = network or NetworkConfig()
-                self.contract_config = contract or ContractConfig()
-                self.state_config = state or StateConfig()
-                self.governance_config = governance or GovernanceConfig()
-
-                self.node = Node(initial_nodes[0] if initial_nodes else "127.0.0.1:5000")
-                for peer in (initial_nodes or [])[1:]:
-                    self.node.add_peer(peer)
-                self.consensus = Consensus(self.consensus_config.type)
-                self.contracts = []
-                self.chain = []
-                self.transaction_pool = []
-                self.backend = backend or None
-                self.create_genesis_block()
-
-            def create_genesis_block(self):
-                """
-                Create the genesis block for the chain.
-                """
-                genesis_block = Block(0, "0", [], nonce=0)
-                self.chain.append(genesis_block)
-
-            def add_transaction(self, sender, recipient, amount, contract=None):
-                """
-                Add a transaction to the pool.
-                """
-                tx = Transaction(sender, recipient, amount, contract)
-                self.transaction_pool.append(tx)
-
-            def add_smart_contract(self, contract_cls):
-                """
-                Add a smart contract to the blockchain.
-                """
-                contract = contract_cls()
-                self.contracts.append(contract)
-
-            def mine_block(self):
-                """
-                Mine a block (stub for PoS/PoW).
-                """
-                previous_block = self.chain[-1]
-                block = Block(
-                    index=len(self.chain),
-                    previous_hash=previous_block.hash,
-                    transactions=[str(tx.__dict__) for tx in self.transaction_pool],
-                    nonce=0
-                )
-                self.chain.append(block)
-                self.transaction_pool = []
-                print(f"Block {block.index} mined: {block.hash}")
-
-            def run(self):
-                """
-                Run the blockchain node (prints config and mines if transactions exist).
-                """
-                print(f"Running blockchain '{self.name}'")
-                print(f"Block config: {self.block_config.__dict__}")
-                print(f"Consensus config: {self.consensus_config.__dict__}")
-                print(f"Network config: {self.network_config.__dict__}")
-                print(f"Contract config: {self.contract_config.__dict__}")
-                print(f"State config: {self.state_config.__dict__}")
-                print(f"Governance config: {self.governance_config.__dict__}")
-                print(f"Initial node: {self.node.address}")
-                print(f"Peers: {self.node.peers}")
-                print(f"Smart contracts: {[c.name for c in self.contracts]}")
-                print(f"Genesis block: {self.chain[0].hash}")
-                if self.transaction_pool:
-                    self.mine_block()
-                print(f"Chain length: {len(self.chain)}")
-
-            def deploy(self, backend=None):
-                """
-                Deploy the blockchain to a backend (e.g., Geth).
-                """
-                self.backend = backend or self.backend or GethBackend()
-                print(f"Deploying blockchain '{self.name}' to backend: {self.backend.rpc_url}")
-                # Real implementation would set up chain state, accounts, etc. on the backend
-                return True
-
-            def publish_contract(self, contract_cls, sender, bytecode, abi):
-                """
-                Publish a smart contract to the backend.
-                """
-                if not self.backend:
-                    raise Exception("No backend configured. Call deploy() first.")
-                print(f"Publishing contract '{contract_cls.name}' from {sender}")
-                result = self.backend.deploy_contract(bytecode, abi, sender)
-                print(f"Contract deployment result: {result}")
-                return result
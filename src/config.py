@@ -24,10 +24,20 @@ class ContractConfig:
         self.verification = verification
 
 class StateConfig:
-    def __init__(self, model="account", pruning="snapshot", channels=True):
+    def __init__(self, model="account", pruning="snapshot", channels=True, storage="memory", data_dir="chaindata",
+                 segment_size=64 * 1024 * 1024, sync_every=64, cache_blocks=256,
+                 mempool_bytes=32 * 1024 * 1024, mempool_count=50000, checkpoint=None):
         self.model = model
         self.pruning = pruning
         self.channels = channels
+        self.storage = storage
+        self.data_dir = data_dir
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.cache_blocks = cache_blocks
+        self.mempool_bytes = mempool_bytes
+        self.mempool_count = mempool_count
+        self.checkpoint = checkpoint
 
 class GovernanceConfig:
     def __init__(self, model="community", tokens="GOV", voting="liquid"):
@@ -1,3 +1,6 @@
+from .mining import Miner
+
+
 class Consensus:
     """
     Base Consensus class. Users can inherit and override methods for custom consensus.
@@ -14,6 +17,13 @@ class Consensus:
         """
         return True
 
+    def prepare_block(self, block, chain):
+        """
+        Optional hook to seal a block (e.g. search a PoW nonce) before validation.
+        Return False to abandon the block.
+        """
+        return True
+
     def on_block_mined(self, block, chain):
         """
         Optional hook called after a block is mined. Override for custom logic.
@@ -27,7 +37,15 @@ class PoWConsensus(Consensus):
     """
     def __init__(self, config_or_name):
         super().__init__(config_or_name)
-        self.difficulty = getattr(config_or_name, 'params', {}).get('difficulty', 2)
+        params = getattr(config_or_name, 'params', {})
+        self.difficulty = params.get('difficulty', 2)
+        self.miner = Miner(workers=params.get('workers'))
+
+    def prepare_block(self, block, chain):
+        return self.miner.mine(block, self.difficulty)
+
+    def cancel(self):
+        self.miner.cancel()
 
     def validate_block(self, block, chain):
         # Simple PoW: block hash must start with '0' * difficulty
@@ -1,6 +1,10 @@
-import requests
+import hashlib
+import os
+import threading
+
+from ..rpc import RPCClient
 try:
-    from wasmer import Instance
+    from wasmer import Store, Module, Instance, ImportObject, Function, FunctionType, Type
 except ImportError:
     Instance = None
 
@@ -15,36 +19,183 @@ class ContractEngine:
 
 class EVMEngine(ContractEngine):
     """Ethereum Virtual Machine engine using Geth RPC."""
-    def __init__(self, rpc_url="http://localhost:8545"):
+    def __init__(self, rpc_url="http://localhost:8545", client=None):
         self.rpc_url = rpc_url
+        self.client = client or RPCClient(rpc_url)
 
     def deploy(self, bytecode, abi, sender):
         tx = {"from": sender, "data": bytecode}
-        payload = {"jsonrpc": "2.0", "method": "eth_sendTransaction", "params": [tx], "id": 1}
-        response = requests.post(self.rpc_url, json=payload)
-        return response.json()
+        return self.client.request("eth_sendTransaction", [tx])
 
     def interact(self, contract_address, method, args, sender):
         # Minimal stub: just print interaction
         print(f"Interacting with {contract_address} method {method} args {args} from {sender}")
         return True
 
+class OutOfFuel(Exception):
+    pass
+
+
+class _Meter:
+    """Fuel left for the call currently running on one instance."""
+    def __init__(self):
+        self.remaining = None
+
+    def gas(self, cost):
+        if self.remaining is None:
+            return
+        self.remaining -= cost
+        if self.remaining < 0:
+            # Raising from a host function traps the WASM call
+            raise OutOfFuel("contract ran out of fuel")
+
+
+class _ModulePool:
+    """Idle instances of one contract's module, created on demand up to `size`."""
+    def __init__(self, engine, module, size):
+        self.engine = engine
+        self.module = module
+        self.size = size
+        self.idle = []
+        self.created = 0
+        self.available = threading.Condition()
+
+    def acquire(self):
+        with self.available:
+            while not self.idle and self.created >= self.size:
+                self.available.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return self.engine._instantiate(self.module)
+        except Exception:
+            self.discard()
+            raise
+
+    def release(self, pooled):
+        with self.available:
+            self.idle.append(pooled)
+            self.available.notify()
+
+    def discard(self):
+        """Forget an instance that trapped, so a fresh one can take its slot."""
+        with self.available:
+            self.created -= 1
+            self.available.notify()
+
+
 class WASMEngine(ContractEngine):
-    """WebAssembly contract engine using wasmer."""
-    def deploy(self, bytecode, abi, sender):
+    """
+    WebAssembly contract engine using wasmer. Compiled modules are cached
+    by bytecode hash in memory and, with `cache_dir`, serialized to disk so
+    a restart skips compilation; identical contracts share one module but
+    never an instance, so no contract sees another's memory. A contract's
+    linear memory is its state, so each contract runs on one instance and
+    its calls are serialized; contracts deployed with `stateless=True` keep
+    nothing between calls and get a pool of up to `pool_size` instances.
+    Contracts must be instrumented with an `env.gas` import by a
+    gas-injection tool; uninstrumented modules are rejected at deploy since
+    nothing could stop them. Each call gets `fuel` units and traps with
+    OutOfFuel when it exceeds them. deploy() returns a "wasm_<n>" contract
+    id for interact(). Only point `cache_dir` at a trusted directory:
+    artifacts there are loaded as native code.
+    """
+    def __init__(self, cache_dir=None, pool_size=4, fuel=10_000_000):
+        self.cache_dir = cache_dir
+        self.pool_size = pool_size
+        self.fuel = fuel
+        self.store = None
+        self.modules = {}      # bytecode hash -> compiled module
+        self.pools = {}        # contract address -> _ModulePool
+        self.lock = threading.Lock()
+        self.stats = {"compiled": 0, "loaded": 0, "reused": 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _metered(module):
+        return any(i.module == "env" and i.name == "gas" for i in module.imports)
+
+    def _module(self, bytecode):
+        """Compiled module for some bytecode, from memory, disk or a fresh compile."""
+        code_hash = hashlib.sha256(bytecode).hexdigest()
+        with self.lock:
+            module = self.modules.get(code_hash)
+            if module is not None:
+                self.stats["reused"] += 1
+                return module
+            if self.store is None:
+                self.store = Store()
+            path = self.cache_dir and os.path.join(self.cache_dir, code_hash + ".wasmu")
+            if path and os.path.exists(path):
+                try:
+                    with open(path, "rb") as f:
+                        module = Module.deserialize(self.store, f.read())
+                    self.stats["loaded"] += 1
+                except Exception as e:
+                    # Artifacts from another wasmer version or platform are recompiled
+                    print(f"Discarding cached WASM module {code_hash}: {e}")
+            compiled = module is None
+            if compiled:
+                module = Module(self.store, bytecode)
+            # Without the gas import nothing could stop a runaway call
+            if not self._metered(module):
+                raise ValueError("WASM contract does not import env.gas; instrument it for gas metering")
+            if compiled:
+                self.stats["compiled"] += 1
+                if path:
+                    tmp = path + ".tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(module.serialize())
+                    os.replace(tmp, path)
+            self.modules[code_hash] = module
+            return module
+
+    def _instantiate(self, module):
+        meter = _Meter()
+        imports = ImportObject()
+        imports.register("env", {"gas": Function(self.store, meter.gas, FunctionType([Type.I32], []))})
+        return Instance(module, imports), meter
+
+    def deploy(self, bytecode, abi, sender, stateless=False):
         if Instance is None:
             raise ImportError("wasmer not installed")
-        instance = Instance(bytecode)
-        print(f"WASM contract deployed by {sender}")
-        return instance
+        module = self._module(bytes(bytecode))
+        with self.lock:
+            contract_id = f"wasm_{len(self.pools)+1}"
+            self.pools[contract_id] = _ModulePool(self, module, self.pool_size if stateless else 1)
+        print(f"WASM contract deployed by {sender} as {contract_id}")
+        return contract_id
 
-    def interact(self, contract_address, method, args, sender):
-        # Minimal stub: call WASM function
-        if hasattr(contract_address, method):
-            fn = getattr(contract_address, method)
-            return fn(*args)
-        print(f"WASM contract interaction not implemented")
-        return None
+    def interact(self, contract_address, method, args, sender, fuel=None):
+        pool = self.pools.get(contract_address)
+        if pool is None:
+            print(f"WASM contract {contract_address} not found")
+            return None
+        instance, meter = pool.acquire()
+        fn = getattr(instance.exports, method, None)
+        if fn is None:
+            pool.release((instance, meter))
+            print(f"WASM contract {contract_address} has no export {method}")
+            return None
+        meter.remaining = self.fuel if fuel is None else fuel
+        try:
+            result = fn(*args)
+        except Exception as e:
+            meter.remaining, remaining = None, meter.remaining
+            if pool.size > 1:
+                # A trapped stateless instance may be left inconsistent; replace it
+                pool.discard()
+            else:
+                # The only instance holds the contract's state, so it is kept
+                pool.release((instance, meter))
+            if remaining is not None and remaining < 0:
+                raise OutOfFuel(f"{contract_address}.{method} ran out of fuel") from e
+            raise
+        meter.remaining = None
+        pool.release((instance, meter))
+        return result
 
 class NativeEngine(ContractEngine):
     """Native contract engine using Python functions."""
@@ -0,0 +1,137 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:
+    Ed25519PrivateKey = Ed25519PublicKey = None
+
+
+def _require_backend():
+    if Ed25519PublicKey is None:
+        raise ImportError("cryptography not installed")
+
+
+def _key_bytes(key):
+    # Keys and signatures may be given as hex; anything else simply fails to verify
+    if isinstance(key, str):
+        try:
+            return bytes.fromhex(key)
+        except ValueError:
+            return key.encode()
+    return bytes(key)
+
+
+def generate_keypair():
+    """New ed25519 key pair as raw (private, public) bytes."""
+    _require_backend()
+    private_key = Ed25519PrivateKey.generate()
+    public_key = private_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    return private_key.private_bytes_raw(), public_key
+
+
+def sign(private_key, message):
+    _require_backend()
+    return Ed25519PrivateKey.from_private_bytes(_key_bytes(private_key)).sign(message)
+
+
+def verify(public_key, message, signature):
+    """True if `signature` is a valid ed25519 signature of `message` by `public_key`."""
+    _require_backend()
+    try:
+        Ed25519PublicKey.from_public_bytes(_key_bytes(public_key)).verify(_key_bytes(signature), message)
+        return True
+    except (InvalidSignature, ValueError, TypeError):
+        return False
+
+
+def _verify_chunk(items):
+    return [verify(public_key, message, signature) for public_key, message, signature in items]
+
+
+class SignatureCache:
+    """LRU of (public key, message hash, signature) -> verification result."""
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class SignatureVerifier:
+    """
+    Verifies signatures through a shared cache, so a transaction checked on
+    mempool admission is not re-verified when it arrives again in a block.
+    Batches of uncached signatures are split across a process pool.
+    """
+    def __init__(self, workers=None, cache_size=100000, min_parallel=64):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel = min_parallel
+        self.cache = SignatureCache(cache_size)
+        self._pool = None
+
+    @staticmethod
+    def _key(public_key, message, signature):
+        return _key_bytes(public_key), bytes(message), _key_bytes(signature)
+
+    def verify(self, public_key, message, signature):
+        key = self._key(public_key, message, signature)
+        result = self.cache.get(key)
+        if result is None:
+            result = verify(*key)
+            self.cache.put(key, result)
+        return result
+
+    def verify_batch(self, items):
+        """Verify (public key, message, signature) triples; returns a list of bools."""
+        keys = [self._key(*item) for item in items]
+        results = [self.cache.get(key) for key in keys]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if len(pending) < self.min_parallel or self.workers == 1:
+            verified = _verify_chunk([keys[i] for i in pending])
+        else:
+            size = -(-len(pending) // self.workers)
+            chunks = [[keys[i] for i in pending[start:start + size]] for start in range(0, len(pending), size)]
+            verified = [result for chunk in self._get_pool().map(_verify_chunk, chunks) for result in chunk]
+        for i, result in zip(pending, verified):
+            results[i] = result
+            self.cache.put(keys[i], result)
+        return results
+
+    def prefetch(self, txs):
+        """Batch-verify every signature a block's transactions will check."""
+        items = [item for tx in txs if hasattr(tx, "signature_items") for item in tx.signature_items()]
+        if items:
+            self.verify_batch(items)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+# Shared by transaction validation, the mempool and block execution
+default_verifier = SignatureVerifier()
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import zlib
+from array import array
+from collections import OrderedDict
+
+from .serialization import write_varint, read_varint
+from .storage import RECORD_HEADER
+
+# Golomb-Rice parameters from BIP 158: false-positive rate about 1/M
+FILTER_P = 19
+FILTER_M = 784931
+
+
+def outpoint_item(txid, index):
+    return f"{txid}:{index}".encode()
+
+
+def tx_addresses(tx):
+    """Every address a transaction touches."""
+    addresses = set()
+    for field in ("sender", "recipient"):
+        value = getattr(tx, field, None)
+        if isinstance(value, str):
+            addresses.add(value)
+    for signer in getattr(tx, "signers", None) or ():
+        addresses.add(str(signer))
+    for output in getattr(tx, "outputs", None) or ():
+        addresses.add(str(output[0]))
+    return addresses
+
+
+def filter_items(block):
+    """
+    Byte strings a light client can test a block for: every address a
+    transaction touches, plus the outpoints it spends.
+    """
+    items = set()
+    for tx in block.transactions:
+        items.update(address.encode() for address in tx_addresses(tx))
+        for outpoint in getattr(tx, "inputs", None) or ():
+            items.add(outpoint_item(*outpoint))
+    return items
+
+
+def _hashed(items, block_hash, n):
+    # BIP 158 keys SipHash with the block hash; keyed BLAKE2b plays that role here
+    key = bytes.fromhex(block_hash.rjust(64, "0"))[:16]
+    bound = n * FILTER_M
+    return sorted({
+        int.from_bytes(hashlib.blake2b(item, digest_size=8, key=key).digest(), "big") * bound >> 64
+        for item in items
+    })
+
+
+def build_filter(block):
+    """Golomb-coded set of a block's filter items: varint count, then Rice-coded deltas."""
+    items = filter_items(block)
+    out = bytearray()
+    write_varint(out, len(items))
+    if not items:
+        return bytes(out)
+    acc = nbits = previous = 0
+    for value in _hashed(items, block.hash, len(items)):
+        delta = value - previous
+        previous = value
+        q = delta >> FILTER_P
+        # Quotient in unary (q ones and a zero), remainder in P bits
+        acc = (acc << (q + 1)) | ((1 << (q + 1)) - 2)
+        acc = (acc << FILTER_P) | (delta & ((1 << FILTER_P) - 1))
+        nbits += q + 1 + FILTER_P
+    pad = -nbits % 8
+    out += (acc << pad).to_bytes((nbits + pad) // 8, "big")
+    return bytes(out)
+
+
+class BlockFilter:
+    """A decoded compact filter; matches may be false positives, never false negatives."""
+    def __init__(self, data, block_hash):
+        self.block_hash = block_hash
+        self.n, pos = read_varint(data, 0)
+        self.values = self._decode(data[pos:], self.n)
+
+    @staticmethod
+    def _decode(data, n):
+        bits = bin(int.from_bytes(data, "big"))[2:].zfill(8 * len(data)) if data else ""
+        values = []
+        pos = value = 0
+        for _ in range(n):
+            end = bits.index("0", pos)
+            value += ((end - pos) << FILTER_P) | int(bits[end + 1:end + 1 + FILTER_P], 2)
+            values.append(value)
+            pos = end + 1 + FILTER_P
+        return values
+
+    def match_any(self, items):
+        if not self.n or not items:
+            return False
+        queries = _hashed(items, self.block_hash, self.n)
+        i = 0
+        for value in self.values:
+            while queries[i] < value:
+                i += 1
+                if i == len(queries):
+                    return False
+            if queries[i] == value:
+                return True
+        return False
+
+
+class FilterIndex:
+    """
+    A full node's compact filters, one per height. With a `path` they are
+    appended to a file in the block store's record format and only their
+    offsets stay in memory; without one, nothing is kept beyond the cache.
+    Either way, a bounded LRU holds recently served filters and a missing
+    or stale filter is rebuilt from its block.
+    """
+    def __init__(self, path=None, cache_size=1024):
+        self.path = path
+        self.cache_size = cache_size
+        self.recent = OrderedDict()   # block hash -> filter bytes
+        self._offset = array("Q")
+        self._size = array("I")
+        self._file = None
+        if path:
+            self._load()
+            self._file = open(path, "a+b")
+
+    def __len__(self):
+        return len(self._offset)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        end = os.path.getsize(self.path)
+        pos = 0
+        with open(self.path, "rb") as f:
+            while pos + RECORD_HEADER.size <= end:
+                size, _, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                if pos + RECORD_HEADER.size + size > end:
+                    break
+                self._offset.append(pos + RECORD_HEADER.size)
+                self._size.append(size)
+                pos += RECORD_HEADER.size + size
+                f.seek(pos)
+        if pos < end:
+            os.truncate(self.path, pos)
+
+    def _read(self, height):
+        """(block hash, filter) stored for a height, or None if the record is damaged."""
+        self._file.flush()
+        offset = self._offset[height]
+        self._file.seek(offset - RECORD_HEADER.size)
+        size, crc, block_hash = RECORD_HEADER.unpack(self._file.read(RECORD_HEADER.size))
+        data = self._file.read(size)
+        return (block_hash.hex(), data) if zlib.crc32(data) == crc else None
+
+    def _remember(self, block_hash, data):
+        self.recent[block_hash] = data
+        self.recent.move_to_end(block_hash)
+        while len(self.recent) > self.cache_size:
+            self.recent.popitem(last=False)
+
+    def add(self, block):
+        data = build_filter(block)
+        self._remember(block.hash, data)
+        if self._file is None or block.index > len(self):
+            return
+        # A block replacing one at this height (after a reorg) drops the stale tail
+        self.truncate(block.index)
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(RECORD_HEADER.pack(len(data), zlib.crc32(data), bytes.fromhex(block.hash.rjust(64, "0"))))
+        self._offset.append(self._file.tell())
+        self._size.append(len(data))
+        self._file.write(data)
+
+    def get(self, block):
+        data = self.recent.get(block.hash)
+        if data is not None:
+            self.recent.move_to_end(block.hash)
+            return data
+        if block.index < len(self):
+            record = self._read(block.index)
+            if record is not None and record[0] == block.hash.rjust(64, "0"):
+                self._remember(block.hash, record[1])
+                return record[1]
+        data = build_filter(block)
+        self._remember(block.hash, data)
+        return data
+
+    def truncate(self, height):
+        """Forget the filters of every height from `height` up (a rollback)."""
+        if self._file is None or height >= len(self):
+            return
+        self._file.flush()
+        os.truncate(self.path, self._offset[height] - RECORD_HEADER.size)
+        del self._offset[height:], self._size[height:]
+
+    def catch_up(self, chain):
+        """Line the file up with a block store: drop filters of replaced blocks, add missing ones."""
+        if self._file is None:
+            return
+        height = min(len(self), len(chain))
+        while height and (self._read(height - 1) or ("",))[0] != chain[height - 1].hash.rjust(64, "0"):
+            height -= 1
+        self.truncate(height)
+        for h in range(height, len(chain)):
+            self.add(chain[h])
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
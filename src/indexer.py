@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+
+from .filters import tx_addresses
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    previous_hash TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    tx_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tx_locations (
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    txid TEXT NOT NULL,
+    PRIMARY KEY (height, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tx_locations_txid ON tx_locations (txid);
+CREATE TABLE IF NOT EXISTS address_txs (
+    address TEXT NOT NULL,
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    txid TEXT NOT NULL,
+    PRIMARY KEY (address, height, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS address_txs_height ON address_txs (height);
+"""
+
+
+class ExplorerIndex:
+    """
+    Explorer indexes in SQLite (WAL mode): height -> block, txid -> location
+    and address -> history, all B-tree lookups. Register it with
+    Blockchain.add_listener; each accepted block is written in one
+    transaction, and disconnected blocks are deleted by height on reorgs.
+    """
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        # Indexes written before locations were keyed by (height, position) kept one row per txid
+        if self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'txs'").fetchone():
+            with self.db:
+                self.db.execute("INSERT OR IGNORE INTO tx_locations SELECT height, position, txid FROM txs")
+                self.db.execute("DROP TABLE txs")
+        self.lock = threading.Lock()
+
+    def on_block_accepted(self, block):
+        txs = []
+        addresses = []
+        for position, tx in enumerate(block.transactions):
+            txid = tx.txid
+            txs.append((block.index, position, txid))
+            addresses.extend((address, block.index, position, txid) for address in tx_addresses(tx))
+        with self.lock, self.db:
+            # A replaced block at this height (e.g. after a crash mid-reorg) is dropped first
+            self._delete_from(block.index)
+            self.db.execute("INSERT INTO blocks VALUES (?, ?, ?, ?, ?)",
+                            (block.index, block.hash, block.previous_hash, block.timestamp, len(block.transactions)))
+            # A transaction included twice (a replay) keeps both locations
+            self.db.executemany("INSERT INTO tx_locations VALUES (?, ?, ?)", txs)
+            self.db.executemany("INSERT OR REPLACE INTO address_txs VALUES (?, ?, ?, ?)", addresses)
+
+    def on_block_disconnected(self, block):
+        with self.lock, self.db:
+            self._delete_from(block.index)
+
+    def _delete_from(self, height):
+        for table in ("blocks", "tx_locations", "address_txs"):
+            self.db.execute(f"DELETE FROM {table} WHERE height >= ?", (height,))
+
+    @property
+    def height(self):
+        row = self.db.execute("SELECT MAX(height) FROM blocks").fetchone()
+        return -1 if row[0] is None else row[0]
+
+    def catch_up(self, chain):
+        """
+        Bring the index in line with a block store: roll back indexed
+        blocks that are no longer on the chain, then index the missing ones.
+        """
+        height = min(self.height, len(chain) - 1)
+        while height >= 0 and self.block_hash(height) != chain[height].hash:
+            height -= 1
+        with self.lock, self.db:
+            self._delete_from(height + 1)
+        for h in range(height + 1, len(chain)):
+            self.on_block_accepted(chain[h])
+
+    def block_hash(self, height):
+        row = self.db.execute("SELECT hash FROM blocks WHERE height = ?", (height,)).fetchone()
+        return row and row[0]
+
+    def block(self, height):
+        row = self.db.execute("SELECT height, hash, previous_hash, timestamp, tx_count FROM blocks WHERE height = ?",
+                              (height,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("height", "hash", "previous_hash", "timestamp", "tx_count"), row))
+
+    def locate(self, txid):
+        """(height, position) of a transaction's first inclusion, or None."""
+        return self.db.execute("SELECT height, position FROM tx_locations WHERE txid = ? "
+                               "ORDER BY height, position LIMIT 1", (txid,)).fetchone()
+
+    def history(self, address, limit=50, before=None):
+        """
+        Newest-first (height, position, txid) rows for an address. Pass the
+        last row's (height, position) as `before` to get the next page.
+        """
+        if before is None:
+            return self.db.execute(
+                "SELECT height, position, txid FROM address_txs WHERE address = ? "
+                "ORDER BY height DESC, position DESC LIMIT ?", (address, limit)).fetchall()
+        return self.db.execute(
+            "SELECT height, position, txid FROM address_txs WHERE address = ? AND (height, position) < (?, ?) "
+            "ORDER BY height DESC, position DESC LIMIT ?", (address, before[0], before[1], limit)).fetchall()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,114 @@
+from .block import Block, BlockHeader, HEADER_SIZE
+from .filters import BlockFilter, outpoint_item
+from .merkle import verify_proof
+from .networking import NodeRole
+from .serialization import decode_tx, tx_hash
+
+
+class LightClient:
+    """
+    SPV client for NodeRole.LIGHT. Keeps only the validated header chain,
+    packed at HEADER_SIZE bytes per block, and learns about its own
+    transactions from compact block filters and Merkle proofs served by a
+    full node peer (see sync.LocalPeer). Balance scans stream one filter
+    and at most one block at a time, so their memory does not grow with
+    the chain.
+    """
+    role = NodeRole.LIGHT
+
+    def __init__(self, peer, min_difficulty=0, filter_batch=500):
+        self.peer = peer
+        self.min_difficulty = min_difficulty
+        self.filter_batch = filter_batch
+        self.headers = bytearray()
+        self.hashes = bytearray()
+
+    def __len__(self):
+        return len(self.hashes) // 32
+
+    @property
+    def height(self):
+        return len(self) - 1
+
+    def header(self, height):
+        return BlockHeader.decode(memoryview(self.headers)[height * HEADER_SIZE:(height + 1) * HEADER_SIZE])
+
+    def block_hash(self, height):
+        return self.hashes[height * 32:(height + 1) * 32].hex()
+
+    async def sync_headers(self, batch=2000):
+        """Download and validate headers up to the peer's tip; returns how many were added."""
+        added = 0
+        peer_height = await self.peer.height()
+        while self.height < peer_height:
+            raws = await self.peer.get_headers(len(self), batch)
+            if not raws:
+                break
+            for raw in raws:
+                header = BlockHeader.decode(raw)
+                block_hash = header.compute_hash()
+                if len(self) and (header.index != len(self) or header.previous_hash != self.block_hash(self.height)):
+                    raise ValueError(f"Header {header.index} does not extend the chain")
+                # Genesis is exempt from proof of work
+                if len(self) and (header.difficulty < self.min_difficulty
+                                  or not block_hash.startswith("0" * header.difficulty)):
+                    raise ValueError(f"Header {header.index} fails proof of work")
+                self.headers += raw
+                self.hashes += bytes.fromhex(block_hash)
+                added += 1
+        return added
+
+    async def verify_transaction(self, height, position):
+        """Fetch a transaction with its Merkle proof and check it against our header."""
+        raw, size, proof = await self.peer.get_proof(height, position)
+        tx = decode_tx(raw)
+        root = bytes.fromhex(self.header(height).merkle_root)
+        if not verify_proof(tx_hash(tx), position, size, proof, root):
+            raise ValueError(f"Transaction {position} is not in block {height}")
+        return tx
+
+    async def scan(self, addresses, start=1, watched=None):
+        """
+        Yield (height, tx) for every transaction touching `addresses` or
+        spending an outpoint in `watched` (a set the caller may grow).
+        Only blocks whose filter matches are downloaded.
+        """
+        addresses = {address.encode() for address in addresses}
+        watched = watched if watched is not None else set()
+        height = start
+        while height <= self.height:
+            filters = await self.peer.get_filters(height, min(self.filter_batch, self.height - height + 1))
+            if not filters:
+                break
+            for offset, data in enumerate(filters):
+                block_hash = self.block_hash(height + offset)
+                items = addresses | {outpoint_item(*outpoint) for outpoint in watched}
+                if not BlockFilter(data, block_hash).match_any(items):
+                    continue
+                raws = await self.peer.get_blocks(height + offset, 1)
+                # Block.decode checks the body against its Merkle root; the hash ties it to our header
+                block = Block.decode(raws[0])
+                if block.hash != block_hash:
+                    raise ValueError(f"Block {height + offset} does not match its header")
+                for tx in block.transactions:
+                    yield height + offset, tx
+            height += len(filters)
+
+    async def balance(self, addresses):
+        """Net balance of a set of addresses across the chain (wallet-style)."""
+        addresses = set(addresses)
+        owned = {}
+        total = 0
+        async for _, tx in self.scan(addresses, watched=owned.keys()):
+            amount = getattr(tx, "amount", None) or 0
+            if getattr(tx, "recipient", None) in addresses:
+                total += amount
+            if getattr(tx, "sender", None) in addresses:
+                total -= amount + (getattr(tx, "fee", None) or 0)
+            for outpoint in getattr(tx, "inputs", None) or ():
+                total -= owned.pop(tuple(outpoint), 0)
+            for index, (address, value) in enumerate(getattr(tx, "outputs", None) or ()):
+                if address in addresses:
+                    owned[(tx.txid, index)] = value
+                    total += value
+        return total
@@ -0,0 +1,236 @@
+import hashlib
+import heapq
+import itertools
+
+from .serialization import varint_size
+
+
+class MempoolEntry:
+    __slots__ = ("tx", "txid", "size", "fee", "fee_rate", "sequence", "lane", "nonce")
+
+    def __init__(self, tx, txid, size, fee, sequence, lane, nonce):
+        self.tx = tx
+        self.txid = txid
+        self.size = size
+        self.fee = fee
+        self.fee_rate = fee / size
+        self.sequence = sequence
+        self.lane = lane
+        self.nonce = nonce
+
+
+class Mempool:
+    """
+    Pending transactions, deduplicated by txid. Transactions carrying a nonce
+    are queued per sender and only become minable in nonce order; the rest
+    each form their own queue. A byte and count budget is enforced by
+    evicting the lowest fee-rate transactions, together with the later
+    nonces that depend on them, and only for a newcomer paying more than
+    everything it displaces.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_count=50000):
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.bytes = 0
+        self.entries = {}
+        self.lanes = {}    # lane key -> {nonce: txid}
+        self.heads = {}    # lane key -> txid of its lowest pending nonce
+        self._nonces = {}  # lane key -> min-heap of its nonces, cleaned lazily
+        self._ready = []   # max-heap of lane heads: (-fee_rate, sequence, txid)
+        self._evict = []   # min-heap of all entries: (fee_rate, sequence, txid)
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, txid):
+        return txid in self.entries
+
+    def __iter__(self):
+        return (entry.tx for entry in self.entries.values())
+
+    def get(self, txid):
+        entry = self.entries.get(txid)
+        return entry.tx if entry else None
+
+    def add(self, tx):
+        """Admit a transaction; returns False if it is a duplicate, badly signed, underpriced or too big."""
+        payload = tx.encode()
+        txid = hashlib.sha256(payload).hexdigest()
+        if txid in self.entries or len(payload) > self.max_bytes:
+            return False
+        # Verified signatures are cached, so the block containing tx skips them
+        if hasattr(tx, "check_signatures") and not tx.check_signatures():
+            return False
+        fee = getattr(tx, "fee", 0) or 0
+        nonce = getattr(tx, "nonce", None)
+        lane = getattr(tx, "sender", None) if nonce is not None else txid
+        entry = MempoolEntry(tx, txid, len(payload), fee, next(self._sequence), lane, nonce)
+        replaced = self.entries.get(self.lanes.get(lane, {}).get(nonce)) if nonce is not None else None
+        if replaced is not None and fee <= replaced.fee:
+            return False
+        victims = self._displaced(entry, replaced)
+        if victims is None:
+            return False
+        if replaced is not None:
+            self._remove(replaced.txid)
+        # Later nonces go first so lane heads are not needlessly recomputed
+        for victim in reversed(victims):
+            self._remove(victim.txid)
+        self._insert(entry)
+        return True
+
+    def remove(self, txids):
+        """Drop transactions, e.g. once they are included in a block."""
+        for txid in txids:
+            if txid in self.entries:
+                self._remove(txid)
+
+    def select(self, max_bytes, max_count=None):
+        """
+        Best-paying transactions whose block records fit in `max_bytes`,
+        respecting per-sender nonce order. Lane heads are popped lazily and
+        pushed back afterwards, so only the transactions looked at pay
+        heap operations.
+        """
+        unlocked = []     # heap of successors whose predecessor was just selected
+        restore = []
+        taken = set()
+        selected = []
+        used = 0
+        while max_count is None or len(selected) < max_count:
+            self._prune_ready()
+            if unlocked and (not self._ready or unlocked[0] < self._ready[0]):
+                item = heapq.heappop(unlocked)
+            elif self._ready:
+                item = heapq.heappop(self._ready)
+                if item[2] in taken:
+                    continue
+                restore.append(item)
+            else:
+                break
+            entry = self.entries[item[2]]
+            record_size = entry.size + varint_size(entry.size)
+            if used + record_size > max_bytes:
+                # Later nonces from this sender cannot be included either
+                continue
+            taken.add(entry.txid)
+            selected.append(entry.tx)
+            used += record_size
+            if entry.nonce is not None:
+                successor = self.entries.get(self.lanes[entry.lane].get(entry.nonce + 1))
+                if successor is not None:
+                    heapq.heappush(unlocked, (-successor.fee_rate, successor.sequence, successor.txid))
+        for item in restore:
+            heapq.heappush(self._ready, item)
+        return selected
+
+    def _prune_ready(self):
+        # Items for removed transactions, or ones no longer heading their lane, are stale
+        while self._ready:
+            entry = self.entries.get(self._ready[0][2])
+            if entry is not None and self.heads.get(entry.lane) == entry.txid:
+                return
+            heapq.heappop(self._ready)
+
+    def _over_budget(self, extra_bytes, extra_count):
+        return self.bytes + extra_bytes > self.max_bytes or len(self.entries) + extra_count > self.max_count
+
+    def _descendants(self, entry):
+        """The run of later nonces that could never be mined without `entry`."""
+        if entry.nonce is None:
+            return []
+        lane = self.lanes[entry.lane]
+        found = []
+        nonce = entry.nonce + 1
+        while nonce in lane:
+            found.append(self.entries[lane[nonce]])
+            nonce += 1
+        return found
+
+    def _displaced(self, entry, replaced):
+        """
+        Entries that must be evicted to fit `entry`, lowest fee rate first,
+        each followed by its descendants; None if any of them pays at
+        least `entry`'s fee rate or is one of its own predecessors.
+        """
+        freed_bytes = replaced.size if replaced else 0
+        freed_count = 1 if replaced else 0
+        victims = []
+        chosen = set()
+        popped = []
+        try:
+            while self._over_budget(entry.size - freed_bytes, 1 - freed_count):
+                if not self._evict:
+                    return None
+                item = heapq.heappop(self._evict)
+                victim = self.entries.get(item[2])
+                if victim is None:
+                    continue
+                popped.append(item)
+                if victim is replaced or victim.txid in chosen:
+                    continue
+                for member in [victim] + self._descendants(victim):
+                    if member is replaced or member.txid in chosen:
+                        continue
+                    if member.fee_rate >= entry.fee_rate:
+                        return None
+                    if member.lane == entry.lane and entry.nonce is not None and member.nonce < entry.nonce:
+                        return None
+                    chosen.add(member.txid)
+                    victims.append(member)
+                    freed_bytes += member.size
+                    freed_count += 1
+            return victims
+        finally:
+            for item in popped:
+                heapq.heappush(self._evict, item)
+
+    def _insert(self, entry):
+        self.entries[entry.txid] = entry
+        self.bytes += entry.size
+        heapq.heappush(self._evict, (entry.fee_rate, entry.sequence, entry.txid))
+        if entry.nonce is None:
+            self.heads[entry.lane] = entry.txid
+            heapq.heappush(self._ready, (-entry.fee_rate, entry.sequence, entry.txid))
+            return
+        lane = self.lanes.setdefault(entry.lane, {})
+        lane[entry.nonce] = entry.txid
+        heapq.heappush(self._nonces.setdefault(entry.lane, []), entry.nonce)
+        head = self.entries.get(self.heads.get(entry.lane))
+        if head is None or entry.nonce < head.nonce:
+            self._set_head(entry.lane, entry)
+
+    def _set_head(self, lane, entry):
+        self.heads[lane] = entry.txid
+        heapq.heappush(self._ready, (-entry.fee_rate, entry.sequence, entry.txid))
+
+    def _remove(self, txid):
+        entry = self.entries.pop(txid)
+        self.bytes -= entry.size
+        if entry.nonce is None:
+            del self.heads[entry.lane]
+        else:
+            lane = self.lanes[entry.lane]
+            del lane[entry.nonce]
+            nonces = self._nonces[entry.lane]
+            if not lane:
+                del self.lanes[entry.lane]
+                del self.heads[entry.lane]
+                del self._nonces[entry.lane]
+            else:
+                if len(nonces) > 2 * len(lane) + 16:
+                    nonces[:] = lane
+                    heapq.heapify(nonces)
+                if self.heads[entry.lane] == txid:
+                    while nonces[0] not in lane:
+                        heapq.heappop(nonces)
+                    self._set_head(entry.lane, self.entries[lane[nonces[0]]])
+        # Heaps are cleaned lazily; rebuild them once stale items dominate
+        if len(self._evict) > 2 * len(self.entries) + 64:
+            self._evict = [(e.fee_rate, e.sequence, e.txid) for e in self.entries.values()]
+            heapq.heapify(self._evict)
+        if len(self._ready) > 2 * len(self.heads) + 64:
+            self._ready = [(-e.fee_rate, e.sequence, e.txid)
+                           for e in (self.entries[t] for t in self.heads.values())]
+            heapq.heapify(self._ready)
@@ -0,0 +1,96 @@
+import hashlib
+
+# Domain separation between leaf and interior hashes (RFC 6962 style)
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+EMPTY_ROOT = hashlib.sha256(b"").digest()
+
+
+def hash_leaf(data):
+    return hashlib.sha256(LEAF_PREFIX + data).digest()
+
+
+def hash_node(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def _largest_power_below(n):
+    k = 1
+    while k << 1 < n:
+        k <<= 1
+    return k
+
+
+class MerkleTree:
+    """
+    Append-only Merkle tree over transaction hashes. The root is maintained
+    from a frontier of perfect subtrees, so each append is O(log n).
+    """
+    def __init__(self, leaves=None):
+        self.leaves = []
+        self._frontier = []  # (size, hash) of perfect subtrees, largest first
+        for data in leaves or []:
+            self.append(data)
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def append(self, data):
+        leaf = hash_leaf(data)
+        self.leaves.append(leaf)
+        size = 1
+        while self._frontier and self._frontier[-1][0] == size:
+            _, left = self._frontier.pop()
+            leaf = hash_node(left, leaf)
+            size <<= 1
+        self._frontier.append((size, leaf))
+
+    def root(self):
+        if not self._frontier:
+            return EMPTY_ROOT
+        root = self._frontier[-1][1]
+        for _, left in reversed(self._frontier[:-1]):
+            root = hash_node(left, root)
+        return root
+
+    def proof(self, index):
+        """Audit path proving the leaf at `index` is in the tree."""
+        if not 0 <= index < len(self.leaves):
+            raise IndexError("leaf index out of range")
+        return self._path(index, self.leaves)
+
+    def _path(self, index, leaves):
+        if len(leaves) == 1:
+            return []
+        k = _largest_power_below(len(leaves))
+        if index < k:
+            return self._path(index, leaves[:k]) + [self._subtree_root(leaves[k:])]
+        return self._path(index - k, leaves[k:]) + [self._subtree_root(leaves[:k])]
+
+    def _subtree_root(self, leaves):
+        if len(leaves) == 1:
+            return leaves[0]
+        k = _largest_power_below(len(leaves))
+        return hash_node(self._subtree_root(leaves[:k]), self._subtree_root(leaves[k:]))
+
+
+def verify_proof(data, index, size, proof, root):
+    """Check an audit path from MerkleTree.proof against a known root."""
+    if index >= size:
+        return False
+    fn, sn = index, size - 1
+    node = hash_leaf(data)
+    for sibling in proof:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            node = hash_node(sibling, node)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            node = hash_node(node, sibling)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and node == root
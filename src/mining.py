@@ -0,0 +1,131 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from .block import encode_nonce
+
+# How many nonces a worker tries between checks of the cancel flag
+CHECK_INTERVAL = 4096
+
+_cancel_event = None
+
+
+def _init_worker(event):
+    global _cancel_event
+    _cancel_event = event
+
+
+def target_for(difficulty):
+    """Digest bound for `difficulty` leading hex zeros (None means any hash will do)."""
+    if difficulty <= 0:
+        return None
+    return (1 << (256 - 4 * difficulty)).to_bytes(32, "big")
+
+
+def search_nonces(prefix, start, stop, target, cancel=None):
+    """
+    Try nonces in [start, stop) against a precomputed header prefix.
+    Returns (nonce or None, hashes tried).
+    """
+    cancel = cancel or _cancel_event
+    base = hashlib.sha256(prefix)
+    for offset in range(start, stop, CHECK_INTERVAL):
+        if cancel is not None and cancel.is_set():
+            return None, offset - start
+        for nonce in range(offset, min(offset + CHECK_INTERVAL, stop)):
+            h = base.copy()
+            h.update(encode_nonce(nonce))
+            if target is None or h.digest() < target:
+                return nonce, nonce - start + 1
+    return None, stop - start
+
+
+class Miner:
+    """
+    Proof-of-Work nonce search engine. Low difficulties are mined in-process;
+    above `parallel_threshold` the nonce space is split across a process pool.
+    """
+    def __init__(self, workers=None, batch_size=100000, parallel_threshold=4, max_nonce=2**64):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.parallel_threshold = parallel_threshold
+        self.max_nonce = max_nonce
+        self.hashes = 0
+        self.elapsed = 0.0
+        self._cancel = multiprocessing.Event()
+        self._pool = None
+
+    @property
+    def hashrate(self):
+        """Hashes per second over all searches so far."""
+        return self.hashes / self.elapsed if self.elapsed else 0.0
+
+    def cancel(self):
+        """Abort the search in progress, e.g. because a peer's block arrived."""
+        self._cancel.set()
+
+    def mine(self, block, difficulty):
+        """
+        Find a nonce giving `block` a hash with `difficulty` leading zeros.
+        Sets block.nonce/block.hash and returns True, or False if cancelled.
+        """
+        self._cancel.clear()
+        prefix = block.header_prefix()
+        target = target_for(difficulty)
+        started = time.perf_counter()
+        try:
+            if self.workers > 1 and difficulty > self.parallel_threshold:
+                nonce = self._search_parallel(prefix, target)
+            else:
+                nonce, count = search_nonces(prefix, 0, self.max_nonce, target, self._cancel)
+                self.hashes += count
+        finally:
+            self.elapsed += time.perf_counter() - started
+        if nonce is None:
+            return False
+        block.nonce = nonce
+        block.hash = block.compute_hash()
+        return True
+
+    def _search_parallel(self, prefix, target):
+        pool = self._get_pool()
+        pending = set()
+        next_start = 0
+        found = None
+        while found is None and not self._cancel.is_set():
+            # Keep two batches queued per worker so no core waits on the parent
+            while len(pending) < self.workers * 2 and next_start < self.max_nonce:
+                stop = min(next_start + self.batch_size, self.max_nonce)
+                pending.add(pool.submit(search_nonces, prefix, next_start, stop, target))
+                next_start = stop
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                nonce, count = future.result()
+                self.hashes += count
+                if nonce is not None and (found is None or nonce < found):
+                    found = nonce
+        # Stop the batches still running and account for their work
+        self._cancel.set()
+        for future in pending:
+            nonce, count = future.result()
+            self.hashes += count
+        return found
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self._cancel,),
+            )
+        return self._pool
+
+    def close(self):
+        """Shut down the worker pool."""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
@@ -1,22 +1,218 @@
-import threading
-import socket
+import asyncio
 import json
+import struct
+import threading
+
+# Frame: body length, kind length | kind | payload
+FRAME = struct.Struct(">IB")
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def encode_frame(kind, payload):
+    kind = kind.encode()
+    return FRAME.pack(len(kind) + len(payload) + 1, len(kind)) + kind + payload
+
+
+async def read_frame(reader):
+    length, kind_length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if length > MAX_FRAME:
+        raise ConnectionError(f"Frame of {length} bytes exceeds limit")
+    # The body holds at least the kind-length byte, and the kind fits inside it
+    if length < 1 or kind_length > length - 1:
+        raise ConnectionError(f"Malformed frame header ({length}, {kind_length})")
+    body = await reader.readexactly(length - 1)
+    return body[:kind_length].decode(), body[kind_length:]
+
+
+class PeerLink:
+    """Persistent outbound connection to one peer, fed by a bounded send queue."""
+    def __init__(self, node, address):
+        self.node = node
+        self.address = address
+        self.queue = asyncio.Queue(node.queue_size)
+        self.connected = asyncio.Event()
+        self.dropped = 0
+        self.task = asyncio.ensure_future(self.run())
+
+    def send_nowait(self, frame):
+        # Slow peer: drop its oldest queued frame rather than block everyone else
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+    async def run(self):
+        host, port = self.address.rsplit(":", 1)
+        delay = self.node.initial_backoff
+        frame = None
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, int(port))
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.node.max_backoff)
+                continue
+            delay = self.node.initial_backoff
+            self.connected.set()
+            try:
+                writer.write(encode_frame("hello", self.node.address.encode()))
+                while True:
+                    if frame is None:
+                        frame = await self.queue.get()
+                    writer.write(frame)
+                    await writer.drain()
+                    frame = None
+            except (OSError, ConnectionError):
+                # Keep the unsent frame and retry it after reconnecting
+                self.connected.clear()
+            finally:
+                writer.close()
+
+    def close(self):
+        self.task.cancel()
+
 
 class Node:
-    def __init__(self, address):
+    """
+    Peer-to-peer node over asyncio TCP. Outbound messages go through one
+    persistent, auto-reconnecting connection per peer; inbound frames are
+    dispatched to handlers registered with on(kind, handler).
+    """
+    def __init__(self, address, queue_size=1024, initial_backoff=0.1, max_backoff=30.0):
         self.address = address
         self.peers = set()
+        self.queue_size = queue_size
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.handlers = {}
+        self.links = {}
+        self.loop = None
+        self._server = None
+        self._inbound = set()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def on(self, kind, handler):
+        """Register handler(payload, peer_address) for frames of `kind`."""
+        self.handlers[kind] = handler
 
     def add_peer(self, peer_address):
+        if peer_address == self.address:
+            return
         self.peers.add(peer_address)
+        if self.running and peer_address not in self.links:
+            self.loop.call_soon_threadsafe(self._link, peer_address)
+
+    def _link(self, peer_address):
+        if peer_address not in self.links:
+            self.links[peer_address] = PeerLink(self, peer_address)
+        return self.links[peer_address]
 
-    # Minimal stub for networking
-    def broadcast(self, message):
+    async def start_async(self):
+        host, port = self.address.rsplit(":", 1)
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._serve, host, int(port))
+        # Port 0 asks the OS for a free port; advertise the real one
+        self.address = f"{host}:{self._server.sockets[0].getsockname()[1]}"
         for peer in self.peers:
+            self._link(peer)
+
+    async def stop_async(self):
+        links = list(self.links.values())
+        for link in links:
+            link.close()
+        await asyncio.gather(*(link.task for link in links), return_exceptions=True)
+        self.links = {}
+        for writer in list(self._inbound):
+            writer.close()
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader, writer):
+        self._inbound.add(writer)
+        peer = None
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == "hello":
+                    # Learn the peer's listening address so we can talk back
+                    peer = payload.decode()
+                    self.add_peer(peer)
+                    self._link(peer)
+                    continue
+                handler = self.handlers.get(kind)
+                if handler is not None:
+                    try:
+                        handler(payload, peer)
+                    except Exception as e:
+                        print(f"Handler for {kind!r} from {peer} failed: {e}")
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, UnicodeDecodeError):
+            pass
+        finally:
+            self._inbound.discard(writer)
+            writer.close()
+
+    async def send_async(self, peer, kind, payload):
+        """Queue a frame for one peer, waiting while its queue is full."""
+        await self._link(peer).queue.put(encode_frame(kind, payload))
+
+    def start(self):
+        """Run the node's event loop in a background thread."""
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
             try:
-                host, port = peer.split(":")
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((host, int(port)))
-                    s.sendall(json.dumps(message).encode())
+                loop.run_until_complete(self.start_async())
             except Exception as e:
-                print(f"Failed to send to {peer}: {e}")
+                errors.append(e)
+                started.set()
+                loop.close()
+                return
+            started.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name=f"node-{self.address}", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        if not self.running:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop_async(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def send(self, peer, kind, payload):
+        """Thread-safe: queue a frame for one peer."""
+        if not self.running:
+            raise RuntimeError(f"Node {self.address} is not running; call start() first")
+        frame = encode_frame(kind, payload)
+        self.loop.call_soon_threadsafe(lambda: self._link(peer).send_nowait(frame))
+
+    def broadcast(self, message, kind="json", exclude=None):
+        """
+        Thread-safe fan-out to every peer. `message` is JSON-encoded for the
+        default "json" kind, otherwise it must already be bytes.
+        """
+        if not self.running:
+            print("Node not started; dropping broadcast")
+            return
+        payload = json.dumps(message).encode() if kind == "json" else message
+        frame = encode_frame(kind, payload)
+
+        def fan_out():
+            for peer in self.peers:
+                if peer != exclude:
+                    self._link(peer).send_nowait(frame)
+
+        self.loop.call_soon_threadsafe(fan_out)
@@ -1,4 +1,14 @@
+import asyncio
+import bisect
+import hashlib
+import heapq
+import json
+import os
 import random
+import time
+from collections import OrderedDict
+
+from .executor import access_sets
 
 class NodeRole:
     FULL = "full"
@@ -10,38 +20,541 @@ class NodeRole:
 class NodeDiscovery:
     """Simple peer list management."""
     def __init__(self):
-        self.peers = set()
+        # A dict keeps insertion order, so peer lists don't depend on hash seeds
+        self.peers = {}
     def add_peer(self, address):
-        self.peers.add(address)
+        self.peers[address] = None
     def get_peers(self):
         return list(self.peers)
 
+class SeenCache:
+    """Bounded LRU of message ids, each forgotten `ttl` seconds after it was last seen."""
+    def __init__(self, maxsize=100000, ttl=600.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+
+    def _expire(self, now):
+        while self.entries:
+            msg_id, expiry = next(iter(self.entries.items()))
+            if expiry > now and len(self.entries) <= self.maxsize:
+                break
+            self.entries.popitem(last=False)
+
+    def add(self, msg_id):
+        """Mark `msg_id` seen; True if it was not already."""
+        now = self.clock()
+        new = msg_id not in self
+        self.entries[msg_id] = now + self.ttl
+        self.entries.move_to_end(msg_id)
+        self._expire(now)
+        return new
+
+    def __contains__(self, msg_id):
+        expiry = self.entries.get(msg_id)
+        return expiry is not None and expiry > self.clock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def recent(self, count):
+        """The `count` most recently seen ids."""
+        ids = []
+        for msg_id in reversed(self.entries):
+            if len(ids) == count:
+                break
+            ids.append(msg_id)
+        return ids
+
+
+def message_id(payload):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    elif not isinstance(payload, (bytes, bytearray)):
+        payload = repr(payload).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _size(payload):
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    return len(str(payload).encode())
+
+
 class GossipProtocol:
-    """Broadcast messages to random peers."""
-    def __init__(self, node_discovery):
+    """
+    Epidemic gossip that announces message ids before payloads. A node that
+    learns a new message pushes ("inv", ids) to `fanout` random peers; peers
+    fetch only what they have not seen with ("getdata", ids) and receive
+    ("data", id, payload). Periodic push and pull rounds repair messages
+    lost to an unlucky fanout. `send(peer, message)` is the transport and
+    `receive(peer, message)` its inbound side.
+    """
+    def __init__(self, node_discovery, send=None, fanout=3, seen_size=100000, seen_ttl=600.0,
+                 request_timeout=5.0, on_deliver=None, rng=None, clock=time.monotonic):
         self.node_discovery = node_discovery
+        self.send = send or (lambda peer, message: print(f"Gossiping to {peer}: {message}"))
+        self.fanout = fanout
+        self.seen = SeenCache(seen_size, seen_ttl, clock)
+        self.payloads = OrderedDict()
+        self.max_payloads = seen_size
+        # msg_id -> (peer, expiry) of outstanding getdata requests, oldest first
+        self.requested = OrderedDict()
+        self.max_requested = seen_size
+        self.request_timeout = request_timeout
+        self.on_deliver = on_deliver
+        self.rng = rng or random.Random()
+        self.clock = clock
+        self.stats = {"sent": 0, "bytes_sent": 0, "bytes_received": 0,
+                      "delivered": 0, "duplicates": 0, "duplicate_bytes": 0, "known_inv": 0}
+
+    def _peers(self, exclude=None, count=None):
+        # Sorted so a seeded rng picks the same peers in every process
+        peers = sorted(peer for peer in self.node_discovery.get_peers() if peer != exclude)
+        return self.rng.sample(peers, min(count or self.fanout, len(peers)))
+
+    def _send(self, peer, message):
+        kind = message[0]
+        size = _size(message[2]) if kind == "data" else 32 * len(message[1]) if kind in ("inv", "getdata") else 0
+        self.stats["sent"] += 1
+        self.stats["bytes_sent"] += size
+        self.send(peer, message)
+
+    def _accept(self, msg_id, payload):
+        self.seen.add(msg_id)
+        self.payloads[msg_id] = payload
+        if len(self.payloads) > self.max_payloads:
+            self.payloads.popitem(last=False)
+        self.requested.pop(msg_id, None)
+        self.stats["delivered"] += 1
+        if self.on_deliver is not None:
+            self.on_deliver(payload)
+
     def broadcast(self, message):
-        peers = self.node_discovery.get_peers()
-        for peer in random.sample(peers, min(3, len(peers))):
-            print(f"Gossiping to {peer}: {message}")
+        """Originate a message; returns its id."""
+        msg_id = message_id(message)
+        if msg_id not in self.seen:
+            self._accept(msg_id, message)
+            self.announce([msg_id])
+        return msg_id
+
+    def announce(self, ids, exclude=None):
+        for peer in self._peers(exclude):
+            self._send(peer, ("inv", ids))
+
+    def receive(self, peer, message):
+        kind = message[0]
+        if kind == "inv":
+            now = self.clock()
+            wanted = []
+            for msg_id in message[1]:
+                if msg_id in self.seen:
+                    self.stats["known_inv"] += 1
+                    continue
+                # One outstanding request per id, re-asked elsewhere if it times out
+                pending = self.requested.get(msg_id)
+                if pending is None or pending[1] <= now:
+                    self.requested[msg_id] = (peer, now + self.request_timeout)
+                    self.requested.move_to_end(msg_id)
+                    wanted.append(msg_id)
+            self._expire_requests(now)
+            if wanted:
+                self._send(peer, ("getdata", wanted))
+        elif kind == "getdata":
+            for msg_id in message[1]:
+                payload = self.payloads.get(msg_id)
+                if payload is not None:
+                    self._send(peer, ("data", msg_id, payload))
+        elif kind == "data":
+            _, msg_id, payload = message
+            self.stats["bytes_received"] += _size(payload)
+            if msg_id in self.seen:
+                self.stats["duplicates"] += 1
+                self.stats["duplicate_bytes"] += _size(payload)
+            elif message_id(payload) == msg_id:
+                self._accept(msg_id, payload)
+                self.announce([msg_id], exclude=peer)
+        elif kind == "getinv":
+            ids = [msg_id for msg_id in self.seen.recent(message[1]) if msg_id in self.payloads]
+            if ids:
+                self._send(peer, ("inv", ids))
+
+    def _expire_requests(self, now):
+        # Every request gets the same timeout, so the oldest entries expire first;
+        # the size bound stops a peer announcing endless ids from growing this
+        while self.requested:
+            msg_id, (_, expiry) = next(iter(self.requested.items()))
+            if expiry > now and len(self.requested) <= self.max_requested:
+                break
+            self.requested.popitem(last=False)
+
+    def push_round(self, count=64):
+        """Re-announce the most recent ids to random peers."""
+        ids = [msg_id for msg_id in self.seen.recent(count) if msg_id in self.payloads]
+        if ids:
+            self.announce(ids)
+
+    def pull_round(self, count=64, peers=None):
+        """Ask `peers` random peers (default: fanout) for their most recent ids."""
+        for peer in self._peers(count=peers):
+            self._send(peer, ("getinv", count))
+
+
+ID_BITS = 160
+
+
+def key_id(key):
+    """160-bit DHT id of a key or node name."""
+    if isinstance(key, str):
+        key = key.encode()
+    return int.from_bytes(hashlib.sha1(key).digest(), "big")
+
+
+class RoutingTable:
+    """Kademlia k-buckets: bucket i holds contacts at XOR distance [2**i, 2**(i+1))."""
+    def __init__(self, own_id, k=20):
+        self.own_id = own_id
+        self.k = k
+        self.buckets = [OrderedDict() for _ in range(ID_BITS)]
+
+    def _bucket(self, contact_id):
+        return self.buckets[(self.own_id ^ contact_id).bit_length() - 1]
+
+    def add(self, contact_id, address):
+        """Record a contact as recently seen; False if its bucket is full."""
+        if contact_id == self.own_id:
+            return False
+        bucket = self._bucket(contact_id)
+        if contact_id in bucket:
+            bucket[contact_id] = address
+            bucket.move_to_end(contact_id)
+            return True
+        # Full buckets keep their long-lived contacts; dead ones are removed on timeout
+        if len(bucket) >= self.k:
+            return False
+        bucket[contact_id] = address
+        return True
+
+    def remove(self, contact_id):
+        if contact_id != self.own_id:
+            self._bucket(contact_id).pop(contact_id, None)
+
+    def closest(self, target, count):
+        """Up to `count` (id, address) contacts nearest to `target`."""
+        contacts = (item for bucket in self.buckets for item in bucket.items())
+        return heapq.nsmallest(count, contacts, key=lambda item: item[0] ^ target)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+
+class _DHTDatagram(asyncio.DatagramProtocol):
+    def __init__(self, dht):
+        self.dht = dht
+
+    def connection_made(self, transport):
+        self.dht.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.dht._datagram(data, addr)
+
 
 class DHTProtocol:
-    """Simple key-value store."""
-    def __init__(self):
+    """
+    Kademlia DHT over asyncio UDP. Keys are stored on the `k` nodes whose ids
+    are XOR-closest to the key's id and found with iterative lookups that
+    query `alpha` nodes in parallel per hop, taking O(log n) hops.
+
+    put/get act on this node's local store; start(), bootstrap(), publish(),
+    find_value() and find_node() are the network operations.
+    """
+    def __init__(self, host="127.0.0.1", port=0, k=20, alpha=3, timeout=1.0,
+                 republish_interval=3600.0, node_id=None):
         self.store = {}
+        self.host = host
+        self.port = port
+        self.id = node_id if node_id is not None else int.from_bytes(os.urandom(ID_BITS // 8), "big")
+        self.routing = RoutingTable(self.id, k)
+        self.k = k
+        self.alpha = alpha
+        self.timeout = timeout
+        self.republish_interval = republish_interval
+        self.transport = None
+        self.pending = {}
+        self.last_hops = 0
+        self._republisher = None
+
     def put(self, key, value):
         self.store[key] = value
+
     def get(self, key):
         return self.store.get(key)
 
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: _DHTDatagram(self), local_addr=(self.host, self.port))
+        self.port = self.transport.get_extra_info("sockname")[1]
+        if self.republish_interval:
+            self._republisher = asyncio.ensure_future(self._republish_loop())
+
+    def stop(self):
+        if self._republisher is not None:
+            self._republisher.cancel()
+        # Outstanding RPCs return None, like a timeout; cancelling their futures
+        # would look like a cancellation of the tasks awaiting them
+        for future in self.pending.values():
+            if not future.done():
+                future.set_result(None)
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def bootstrap(self, addresses):
+        """Join the network through known nodes, then fill buckets with a self-lookup."""
+        await asyncio.gather(*(self.ping(address) for address in addresses))
+        await self.find_node(self.id)
+        await self.refresh()
+
+    async def refresh(self):
+        """
+        Look up a random id in every bucket farther than our nearest neighbour,
+        so far regions of the id space know about us and we about them.
+        """
+        nearest = next((i for i, bucket in enumerate(self.routing.buckets) if bucket), None)
+        if nearest is None:
+            return
+        for i in range(nearest + 1, ID_BITS):
+            if len(self.routing.buckets[i]) < self.k:
+                await self.find_node(self.id ^ (1 << i | random.getrandbits(i)))
+
+    async def ping(self, address):
+        return await self._rpc(tuple(address), {"t": "ping"}) is not None
+
+    async def find_node(self, target):
+        """The k closest (id, address) contacts to `target`."""
+        _, contacts = await self._lookup(target)
+        return contacts
+
+    async def find_value(self, key):
+        if key in self.store:
+            return self.store[key]
+        value, _ = await self._lookup(key_id(key), key)
+        return value
+
+    async def publish(self, key, value):
+        """Replicate a JSON-serializable value to the k closest nodes; returns how many stored it."""
+        target = key_id(key)
+        contacts = await self.find_node(target)
+        if len(contacts) < self.k or self.id ^ target < contacts[-1][0] ^ target:
+            self.store[key] = value
+        replies = await asyncio.gather(*(self._rpc(address, {"t": "store", "key": key, "value": value})
+                                         for _, address in contacts))
+        return sum(reply is not None for reply in replies) + (key in self.store)
+
+    async def republish(self):
+        for key, value in list(self.store.items()):
+            await self.publish(key, value)
+
+    async def _republish_loop(self):
+        while True:
+            await asyncio.sleep(self.republish_interval)
+            await self.republish()
+
+    async def _lookup(self, target, key=None):
+        if key is None:
+            request = {"t": "find_node", "target": format(target, "x")}
+        else:
+            request = {"t": "find_value", "key": key}
+        nearest = dict(self.routing.closest(target, self.k))
+        queried = set()
+        hops = 0
+        while True:
+            closest = heapq.nsmallest(self.k, nearest, key=lambda contact: contact ^ target)
+            batch = [contact for contact in closest if contact not in queried][:self.alpha]
+            if not batch:
+                break
+            hops += 1
+            queried.update(batch)
+            replies = await asyncio.gather(*(self._rpc(nearest[contact], dict(request)) for contact in batch))
+            for contact, reply in zip(batch, replies):
+                if reply is None:
+                    self.routing.remove(contact)
+                    del nearest[contact]
+                    continue
+                if "value" in reply:
+                    self.last_hops = hops
+                    return reply["value"], None
+                for id_hex, host, port in reply.get("nodes", ()):
+                    found = int(id_hex, 16)
+                    if found != self.id and found not in nearest:
+                        nearest[found] = (host, port)
+        self.last_hops = hops
+        closest = heapq.nsmallest(self.k, nearest, key=lambda contact: contact ^ target)
+        return None, [(contact, nearest[contact]) for contact in closest]
+
+    def _send(self, message, address):
+        if self.transport is not None:
+            self.transport.sendto(json.dumps(message).encode(), address)
+
+    async def _rpc(self, address, message):
+        """Send a request and wait for its reply; None on timeout or once the node stops."""
+        rid = os.urandom(8).hex()
+        message.update(rid=rid, id=format(self.id, "x"))
+        future = asyncio.get_running_loop().create_future()
+        self.pending[rid] = future
+        self._send(message, tuple(address))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(rid, None)
+
+    def _datagram(self, data, addr):
+        try:
+            message = json.loads(data)
+            sender = int(message["id"], 16)
+            kind = message["t"]
+        except (ValueError, KeyError, TypeError):
+            return
+        self.routing.add(sender, addr)
+        if kind == "reply":
+            future = self.pending.get(message.get("rid"))
+            if future is not None and not future.done():
+                future.set_result(message)
+            return
+        reply = {"t": "reply", "rid": message.get("rid"), "id": format(self.id, "x")}
+        if kind == "find_node":
+            reply["nodes"] = self._contacts(int(message["target"], 16))
+        elif kind == "find_value":
+            key = message["key"]
+            if key in self.store:
+                reply["value"] = self.store[key]
+            else:
+                reply["nodes"] = self._contacts(key_id(key))
+        elif kind == "store":
+            self.store[message["key"]] = message["value"]
+        self._send(reply, addr)
+
+    def _contacts(self, target):
+        return [[format(contact, "x"), host, port] for contact, (host, port) in self.routing.closest(target, self.k)]
+
+
+def ring_point(key):
+    """Stable 64-bit ring position; unlike hash() it is the same in every process."""
+    if isinstance(key, str):
+        key = key.encode()
+    elif not isinstance(key, (bytes, bytearray)):
+        key = repr(key).encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big")
+
+
 class Sharding:
-    """Partition chain state into shards."""
-    def __init__(self, num_shards=2):
-        self.num_shards = num_shards
-        self.shards = [{} for _ in range(num_shards)]
+    """
+    Partition chain state over a consistent-hash ring. Each shard owns
+    `vnodes` points on the ring and a key belongs to the shard owning the
+    first point at or after the key's position, so adding or removing a
+    shard only moves the keys in the ranges it gains or gives up.
+    """
+    def __init__(self, num_shards=2, vnodes=64):
+        self.vnodes = vnodes
+        self.shards = {}
+        self.points = []
+        self.owners = []
+        for shard_id in range(num_shards):
+            self.add_shard(shard_id)
+
+    @property
+    def num_shards(self):
+        return len(self.shards)
+
+    def _rebuild(self):
+        ring = sorted((ring_point(f"{shard_id}#{v}"), shard_id) for shard_id in self.shards for v in range(self.vnodes))
+        self.points = [point for point, _ in ring]
+        self.owners = [shard_id for _, shard_id in ring]
+
+    def shard_for(self, key):
+        i = bisect.bisect_left(self.points, ring_point(key))
+        return self.owners[i % len(self.points)]
+
     def get_shard(self, key):
-        idx = hash(key) % self.num_shards
-        return self.shards[idx]
+        return self.shards[self.shard_for(key)]
+
+    def put(self, key, value):
+        self.get_shard(key)[key] = value
+
+    def get(self, key, default=None):
+        return self.get_shard(key).get(key, default)
+
+    def _migrate(self, donors):
+        moves = []
+        for donor in donors:
+            shard = self.shards[donor]
+            for key in list(shard):
+                owner = self.shard_for(key)
+                if owner != donor:
+                    self.shards[owner][key] = shard.pop(key)
+                    moves.append((key, donor, owner))
+        return moves
+
+    def add_shard(self, shard_id=None):
+        """
+        Add a shard and move it the keys it now owns. Returns the moves as
+        (key, from_shard, to_shard) so other processes can mirror them.
+        """
+        if shard_id is None:
+            shard_id = max(self.shards, default=-1) + 1
+        if shard_id in self.shards:
+            raise ValueError(f"Shard {shard_id} already exists")
+        # Only the shards owning the successors of the new points give up keys
+        donors = set()
+        if self.points:
+            for v in range(self.vnodes):
+                donors.add(self.shard_for(f"{shard_id}#{v}"))
+        self.shards[shard_id] = {}
+        self._rebuild()
+        return self._migrate(donors)
+
+    def remove_shard(self, shard_id):
+        """Remove a shard, handing each of its keys to the next owner on the ring."""
+        if len(self.shards) == 1:
+            raise ValueError("Cannot remove the last shard")
+        leaving = self.shards[shard_id]
+        del self.shards[shard_id]
+        self._rebuild()
+        moves = []
+        for key, value in leaving.items():
+            owner = self.shard_for(key)
+            self.shards[owner][key] = value
+            moves.append((key, shard_id, owner))
+        return moves
+
+    def route(self, txs):
+        """
+        Split transactions by the shards owning the state they touch. Returns
+        ({shard: [tx, ...]} for single-shard transactions, [(tx, shards), ...]
+        for cross-shard ones, which need coordination between shards).
+        """
+        local = {}
+        cross = []
+        everywhere = sorted(self.shards)
+        for tx in txs:
+            sets = access_sets(tx)
+            if sets is None:
+                cross.append((tx, everywhere))
+                continue
+            shards = sorted({self.shard_for(key) for key in sets[0] | sets[1]})
+            if len(shards) == 1:
+                local.setdefault(shards[0], []).append(tx)
+            else:
+                cross.append((tx, shards))
+        return local, cross
+
 
 class MeshNetwork:
     """Peer-to-peer mesh connections."""
@@ -53,13 +566,217 @@ class MeshNetwork:
     def get_connections(self, node):
         return self.connections.get(node, set())
 
+class Channel:
+    """Payment channel with a spendable balance and a fee policy per direction."""
+    __slots__ = ("key", "balances", "fees")
+
+    def __init__(self, node_a, node_b, balance_a, balance_b=0):
+        self.key = frozenset((node_a, node_b))
+        self.balances = {node_a: balance_a, node_b: balance_b}
+        self.fees = {node_a: (0, 0), node_b: (0, 0)}
+
+    @property
+    def capacity(self):
+        return sum(self.balances.values())
+
+    def fee(self, sender, amount):
+        """Fee `sender` charges to forward `amount`: base plus parts per million."""
+        base, ppm = self.fees[sender]
+        return base + amount * ppm // 1000000
+
+
+class Route:
+    """A payment path; amounts[i] crosses the hop path[i] -> path[i + 1]."""
+    __slots__ = ("path", "amounts", "channels")
+
+    def __init__(self, path, amounts, channels):
+        self.path = path
+        self.amounts = amounts
+        self.channels = channels
+
+    @property
+    def amount(self):
+        return self.amounts[-1]
+
+    @property
+    def fee(self):
+        return self.amounts[0] - self.amounts[-1]
+
+    def __repr__(self):
+        return f"Route({' -> '.join(map(str, self.path))}, amount={self.amount}, fee={self.fee})"
+
+
 class LightningNetwork:
-    """Simple payment channel management."""
-    def __init__(self):
+    """
+    Payment channel graph. Routes are found with Dijkstra run backwards from
+    the recipient, so each hop's fee is added to the amount the previous hop
+    must carry and only channels with enough balance in the payment's
+    direction are used. Recent routes are cached; closing a channel drops
+    the routes over it, while anything that can make a better route appear
+    (a new channel, a fee change, a balance shift) clears the whole cache.
+    """
+    def __init__(self, cache_size=10000, max_hops=20):
         self.channels = {}
-    def open_channel(self, node_a, node_b, amount):
-        self.channels[(node_a, node_b)] = amount
+        self.max_hops = max_hops
+        self.graph = {}
+        self.cache_size = cache_size
+        self.route_cache = OrderedDict()
+        self._cached_by_channel = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def open_channel(self, node_a, node_b, amount, push_amount=0):
+        """Open a channel funded by node_a, optionally pushing some balance to node_b."""
+        channel = Channel(node_a, node_b, amount - push_amount, push_amount)
+        self.close_channel(node_a, node_b)
+        self.channels[channel.key] = channel
+        self.graph.setdefault(node_a, {})[node_b] = channel
+        self.graph.setdefault(node_b, {})[node_a] = channel
+        self._clear_cache()
+        return channel
+
     def close_channel(self, node_a, node_b):
-        self.channels.pop((node_a, node_b), None)
+        channel = self.channels.pop(frozenset((node_a, node_b)), None)
+        if channel is not None:
+            del self.graph[node_a][node_b]
+            del self.graph[node_b][node_a]
+            self._invalidate(channel.key)
+
     def get_channel(self, node_a, node_b):
-        return self.channels.get((node_a, node_b))
+        """Total capacity of the channel between two nodes, in either order."""
+        channel = self.channels.get(frozenset((node_a, node_b)))
+        return None if channel is None else channel.capacity
+
+    def set_fees(self, node, peer, base=0, ppm=0):
+        """Fee policy `node` charges for forwarding over its channel to `peer`."""
+        channel = self.channels[frozenset((node, peer))]
+        channel.fees[node] = (base, ppm)
+        self._clear_cache()
+
+    def _invalidate(self, key):
+        for cache_key in self._cached_by_channel.pop(key, ()):
+            self.route_cache.pop(cache_key, None)
+
+    def _clear_cache(self):
+        self.route_cache.clear()
+        self._cached_by_channel.clear()
+
+    def find_route(self, source, target, amount, reserved=None):
+        """
+        Cheapest route delivering `amount` to `target`, or None. `reserved`
+        maps (channel key, sender) to balance already promised to other parts
+        of the same payment.
+        """
+        cache_key = (source, target, amount)
+        if reserved is None:
+            route = self.route_cache.get(cache_key)
+            if route is not None:
+                self.route_cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return route
+            self.cache_misses += 1
+        route = self._dijkstra(source, target, amount, reserved or {})
+        if route is not None and reserved is None:
+            self.route_cache[cache_key] = route
+            for key in route.channels:
+                self._cached_by_channel.setdefault(key, set()).add(cache_key)
+            if len(self.route_cache) > self.cache_size:
+                self.route_cache.popitem(last=False)
+        return route
+
+    def _dijkstra(self, source, target, amount, reserved):
+        if source == target or source not in self.graph or target not in self.graph:
+            return None
+        # Label i: amount costs[i] must reach nodes[i], which is hops[i] from the
+        # target via label parents[i]. Each node keeps every label not beaten on
+        # both amount and hops, so a cheap path that runs out of hops cannot
+        # hide a dearer, shorter one.
+        nodes, costs, hops, parents, keys = [target], [amount], [0], [None], [None]
+        frontier = {target: [0]}
+        heap = [(amount, 0, 0)]
+        max_hops = self.max_hops
+        while heap:
+            cost, hop, label = heapq.heappop(heap)
+            node = nodes[label]
+            if node == source:
+                return self._route(nodes, costs, parents, keys, label)
+            if hop >= max_hops or label not in frontier[node]:
+                continue
+            hop += 1
+            for peer, channel in self.graph[node].items():
+                available = channel.balances[peer] - reserved.get((channel.key, peer), 0)
+                if available < cost:
+                    continue
+                # The sender forwards for free; everyone else charges its fee
+                need = cost if peer == source else cost + channel.fee(peer, cost)
+                kept = frontier.get(peer)
+                if kept is None:
+                    kept = frontier[peer] = []
+                else:
+                    for other in kept:
+                        if costs[other] <= need and hops[other] <= hop:
+                            break
+                    else:
+                        kept[:] = [other for other in kept if costs[other] < need or hops[other] < hop]
+                        other = None
+                    if other is not None:
+                        continue
+                label_id = len(nodes)
+                nodes.append(peer)
+                costs.append(need)
+                hops.append(hop)
+                parents.append(label)
+                keys.append(channel.key)
+                kept.append(label_id)
+                heapq.heappush(heap, (need, hop, label_id))
+        return None
+
+    @staticmethod
+    def _route(nodes, costs, parents, keys, label):
+        path = []
+        amounts = []
+        channels = []
+        while label is not None:
+            path.append(nodes[label])
+            amounts.append(costs[label])
+            if keys[label] is not None:
+                channels.append(keys[label])
+            label = parents[label]
+        return Route(path, amounts[1:], channels)
+
+    def find_routes(self, source, target, amount, max_parts=16, min_part=1):
+        """
+        Split a payment over several routes when no single route can carry
+        it, halving parts that fail until `max_parts` is reached. Returns the
+        routes or None.
+        """
+        pending = [amount]
+        routes = []
+        reserved = {}
+        while pending:
+            part = pending.pop()
+            route = self.find_route(source, target, part, reserved if routes else None)
+            if route is not None:
+                for sender, key, sent in zip(route.path, route.channels, route.amounts):
+                    reserved[(key, sender)] = reserved.get((key, sender), 0) + sent
+                routes.append(route)
+            elif part >= 2 * min_part and len(routes) + len(pending) + 2 <= max_parts:
+                half = part // 2
+                pending += [part - half, half]
+            else:
+                return None
+        return routes
+
+    def pay(self, source, target, amount, max_parts=16):
+        """Route and settle a (possibly multi-part) payment; returns the routes or None."""
+        routes = self.find_routes(source, target, amount, max_parts)
+        if routes is None:
+            return None
+        for route in routes:
+            for sender, receiver, key, sent in zip(route.path, route.path[1:], route.channels, route.amounts):
+                channel = self.channels[key]
+                channel.balances[sender] -= sent
+                channel.balances[receiver] += sent
+        # The receiving side of each channel gained balance, which can open better routes
+        self._clear_cache()
+        return routes
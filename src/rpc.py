@@ -0,0 +1,361 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# Gateway and overload statuses worth retrying
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Calls that must not run twice: after a read timeout or a gateway error the
+# server may already have acted, so they are only retried if the connection
+# was never made
+UNSAFE_METHODS = {"eth_sendTransaction", "eth_sendRawTransaction", "sendTransaction", "sendTransactions"}
+
+# How CachingRPCClient treats each method: results that never change, results
+# fixed once their block is deep enough, and results that follow the head
+STATIC_METHODS = {"eth_chainId", "net_version", "eth_getBlockByHash"}
+CONFIRMED_METHODS = {"eth_getBlockByNumber", "eth_getTransactionReceipt", "eth_getTransactionByHash"}
+HEAD_METHODS = {"eth_blockNumber", "eth_gasPrice", "eth_syncing", "net_peerCount"}
+HEAD_TAGS = {"latest", "pending", "safe", "finalized"}
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class RPCClient:
+    """
+    JSON-RPC 2.0 client over one pooled requests.Session, so calls reuse
+    keep-alive connections. Every request gets its own id and batch
+    responses are matched back by id. Connection failures, timeouts and
+    overload statuses are retried with exponential backoff, except that
+    UNSAFE_METHODS (and batches containing them) are only retried when the
+    connection could not be made. The *_async variants run calls on worker
+    threads, at most `max_concurrency` at a time.
+    """
+    def __init__(self, url, timeout=10.0, retries=3, backoff=0.1, pool_size=16, max_concurrency=16,
+                 max_batch=1000):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.max_batch = max_batch
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._ids = itertools.count(1)
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def payload(self, method, params=None):
+        return {"jsonrpc": "2.0", "method": method, "params": [] if params is None else params,
+                "id": next(self._ids)}
+
+    @staticmethod
+    def _connect_failed(error):
+        """True if the request never reached the server (connect timeout or refused)."""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0] if error.args else None, "reason", None)
+        return isinstance(reason, NewConnectionError)
+
+    def _post(self, body):
+        messages = body if isinstance(body, list) else [body]
+        safe = not any(message.get("method") in UNSAFE_METHODS for message in messages)
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, json=body, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json() if response.content else None
+                error = requests.HTTPError(f"HTTP {response.status_code} from {self.url}")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt == self.retries or not (safe or self._connect_failed(error)):
+                break
+            time.sleep(delay)
+            delay *= 2
+        raise error
+
+    def request(self, method, params=None):
+        """The full response object for one call."""
+        return self._post(self.payload(method, params))
+
+    def call(self, method, params=None):
+        """The result of one call; error responses raise RPCError."""
+        return self._result(self.request(method, params))
+
+    def batch(self, calls):
+        """
+        Send (method, params) pairs as JSON-RPC batches of up to `max_batch`
+        and return their response objects in call order.
+        """
+        responses = []
+        calls = list(calls)
+        for start in range(0, len(calls), self.max_batch):
+            payloads = [self.payload(method, params) for method, params in calls[start:start + self.max_batch]]
+            replies = self._post(payloads)
+            if isinstance(replies, dict):
+                # A whole-batch error (e.g. batch too large) comes back as one object
+                raise RPCError(replies.get("error", {}).get("code", INTERNAL_ERROR),
+                               replies.get("error", {}).get("message", "batch rejected"))
+            by_id = {reply.get("id"): reply for reply in replies or ()}
+            for payload in payloads:
+                responses.append(by_id.get(payload["id"]) or {
+                    "jsonrpc": "2.0", "id": payload["id"],
+                    "error": {"code": INTERNAL_ERROR, "message": "no response for request"}})
+        return responses
+
+    def call_batch(self, calls):
+        """Results of a batch in call order; the first error response raises RPCError."""
+        return [self._result(response) for response in self.batch(calls)]
+
+    @staticmethod
+    def _result(response):
+        if response is None:
+            return None
+        error = response.get("error")
+        if error is not None:
+            raise RPCError(error.get("code", INTERNAL_ERROR), error.get("message", ""))
+        return response.get("result")
+
+    def _semaphore(self):
+        # asyncio primitives belong to one event loop
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def request_async(self, method, params=None):
+        async with self._semaphore():
+            return await asyncio.to_thread(self.request, method, params)
+
+    async def call_async(self, method, params=None):
+        return self._result(await self.request_async(method, params))
+
+    async def batch_async(self, calls):
+        async with self._semaphore():
+            return await asyncio.to_thread(self.batch, calls)
+
+    def close(self):
+        self.session.close()
+
+
+class CachingRPCClient(RPCClient):
+    """
+    RPCClient with a response cache in front of the wire. Immutable
+    results (blocks by hash, and blocks, receipts and transactions at least
+    `confirmations` below the head) live in an LRU bounded by `max_bytes`
+    of encoded JSON. Head-dependent calls are cached for `head_ttl`
+    seconds. Concurrent identical requests share one in-flight call.
+    Cached responses are shared objects and must not be mutated.
+    """
+    def __init__(self, url, confirmations=12, max_bytes=64 * 1024 * 1024, head_ttl=1.0, clock=time.monotonic,
+                 **kwargs):
+        super().__init__(url, **kwargs)
+        self.confirmations = confirmations
+        self.max_bytes = max_bytes
+        self.head_ttl = head_ttl
+        self.clock = clock
+        self.entries = OrderedDict()   # key -> (expires or None, size, response)
+        self.bytes = 0
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    @staticmethod
+    def _key(method, params):
+        return method, json.dumps([] if params is None else params, sort_keys=True)
+
+    @staticmethod
+    def _policy(method, params):
+        if method in STATIC_METHODS:
+            return "static"
+        if method in HEAD_METHODS or any(param in HEAD_TAGS for param in params or () if isinstance(param, str)):
+            return "head"
+        # Blocks, receipts and transactions are named by a hex number or hash;
+        # anything else is left to the node to reject, uncached
+        if method in CONFIRMED_METHODS and params and isinstance(params[0], str):
+            return "confirmed"
+        return None
+
+    @staticmethod
+    def _block_number(value):
+        try:
+            return int(value, 16)
+        except (TypeError, ValueError):
+            return None
+
+    def _copy(self, response):
+        """A shared cached response under a fresh id, so callers matching on id see their own."""
+        return dict(response, id=next(self._ids))
+
+    def head(self):
+        """Current head block number, through the head TTL cache."""
+        return int(self.call("eth_blockNumber"), 16)
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= self.clock():
+            self._evict(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[2]
+
+    def _evict(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def _store(self, method, params, key, response):
+        if response is None or "error" in response:
+            return
+        policy = self._policy(method, params)
+        result = response.get("result")
+        expires = None
+        if policy == "confirmed" and isinstance(result, dict):
+            number = result.get("number") or result.get("blockNumber")
+            if number is not None and self._block_number(number) is None:
+                # Not a hex quantity, so its depth can't be judged
+                return
+            try:
+                head = self.head()
+            except (requests.RequestException, RPCError, TypeError, ValueError):
+                # Without a head the depth is unknown, so treat it as recent
+                head = None
+            # Pending transactions carry no block number yet
+            if number is None or head is None or self._block_number(number) > head - self.confirmations:
+                expires = self.clock() + self.head_ttl
+        elif policy == "head" or (policy is not None and result is None):
+            # Not-found results may appear later, so they only get the head TTL
+            expires = self.clock() + self.head_ttl
+        elif policy is None:
+            return
+        size = len(json.dumps(response))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._evict(key)
+            self.entries[key] = (expires, size, response)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._evict(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+
+    def _claim(self, key):
+        """Under the lock: (cached response, in-flight future, owned future), exactly one set."""
+        response = self._lookup(key)
+        if response is not None:
+            self.stats["hits"] += 1
+            return response, None, None
+        waiting = self.inflight.get(key)
+        if waiting is not None:
+            self.stats["coalesced"] += 1
+            return None, waiting, None
+        self.stats["misses"] += 1
+        future = self.inflight[key] = Future()
+        return None, None, future
+
+    def _settle(self, owned, responses=None, error=None):
+        """Release in-flight calls this thread owns; responses are already stored."""
+        with self.lock:
+            for key in owned:
+                del self.inflight[key]
+        for key, future in owned.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(responses[key])
+
+    def request(self, method, params=None):
+        if self._policy(method, params) is None:
+            return super().request(method, params)
+        key = self._key(method, params)
+        with self.lock:
+            response, waiting, future = self._claim(key)
+        if response is not None:
+            return self._copy(response)
+        if waiting is not None:
+            response = waiting.result()
+            return None if response is None else self._copy(response)
+        try:
+            response = super().request(method, params)
+            # Cached before the in-flight entry goes, so no caller in between misses both
+            self._store(method, params, key, response)
+        except Exception as e:
+            self._settle({key: future}, error=e)
+            raise
+        self._settle({key: future}, {key: response})
+        return response
+
+    def batch(self, calls):
+        """
+        Cached calls are answered locally and calls already in flight are
+        waited for; only the rest go out, as one batch.
+        """
+        calls = list(calls)
+        responses = [None] * len(calls)
+        missing = []
+        waiting = {}   # index -> future owned by another caller
+        owned = {}     # key -> future this batch must settle
+        shared = {}    # index -> key sent earlier in this batch
+        with self.lock:
+            for i, (method, params) in enumerate(calls):
+                if self._policy(method, params) is None:
+                    missing.append(i)
+                    continue
+                key = self._key(method, params)
+                if key in owned:
+                    shared[i] = key
+                    continue
+                response, future, mine = self._claim(key)
+                if response is not None:
+                    responses[i] = self._copy(response)
+                elif future is not None:
+                    waiting[i] = future
+                else:
+                    owned[key] = mine
+                    missing.append(i)
+        sent = {}
+        if missing:
+            try:
+                for i, response in zip(missing, super().batch([calls[i] for i in missing])):
+                    method, params = calls[i]
+                    key = self._key(method, params)
+                    if key in owned:
+                        self._store(method, params, key, response)
+                        sent[key] = response
+                    responses[i] = response
+            except Exception as e:
+                self._settle(owned, error=e)
+                raise
+        self._settle(owned, sent)
+        for i, key in shared.items():
+            responses[i] = self._copy(sent[key])
+        for i, future in waiting.items():
+            response = future.result()
+            responses[i] = None if response is None else self._copy(response)
+        return responses
@@ -0,0 +1,231 @@
+"""
+Canonical, length-prefixed binary encoding shared by transactions, blocks,
+storage and networking. Decoding works directly on a memoryview, so records
+can be parsed out of a larger buffer (e.g. an mmap) without copying it.
+"""
+import hashlib
+import struct
+
+# Lists and tuples share the LIST tag so equal content always encodes alike;
+# TUPLE is only read, from records written before that
+NONE, FALSE, TRUE, INT, FLOAT, STR, BYTES, LIST, TUPLE = range(9)
+DOUBLE = struct.Struct(">d")
+
+# Record type id for values that are not registered transaction types
+PLAIN = 0
+
+_TYPES = {}
+
+
+def register(type_id):
+    """Class decorator assigning a transaction type its wire id."""
+    def wrap(cls):
+        if type_id in _TYPES:
+            raise ValueError(f"Type id {type_id} already registered to {_TYPES[type_id].__name__}")
+        cls.TYPE_ID = type_id
+        _TYPES[type_id] = cls
+        return cls
+    return wrap
+
+
+def write_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def varint_size(n):
+    return max(1, (n.bit_length() + 6) // 7)
+
+
+def read_varint(buf, pos):
+    n = shift = 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError("Truncated varint")
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def write_value(out, value):
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    elif isinstance(value, str):
+        data = value.encode()
+        out.append(STR)
+        write_varint(out, len(data))
+        out += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(BYTES)
+        write_varint(out, len(value))
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        write_varint(out, len(value))
+        for item in value:
+            write_value(out, item)
+    else:
+        raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def read_value(buf, pos):
+    if pos >= len(buf):
+        raise ValueError("Truncated value")
+    tag = buf[pos]
+    pos += 1
+    if tag == NONE:
+        return None, pos
+    if tag == TRUE:
+        return True, pos
+    if tag == FALSE:
+        return False, pos
+    if tag == INT:
+        n, pos = read_varint(buf, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    if tag == FLOAT:
+        if pos + DOUBLE.size > len(buf):
+            raise ValueError("Truncated float")
+        return DOUBLE.unpack_from(buf, pos)[0], pos + DOUBLE.size
+    if tag in (STR, BYTES):
+        n, pos = read_varint(buf, pos)
+        if pos + n > len(buf):
+            raise ValueError("Truncated string")
+        chunk = buf[pos:pos + n]
+        return (str(chunk, "utf-8") if tag == STR else bytes(chunk)), pos + n
+    if tag in (LIST, TUPLE):
+        n, pos = read_varint(buf, pos)
+        items = []
+        for _ in range(n):
+            item, pos = read_value(buf, pos)
+            items.append(item)
+        return items, pos
+    raise ValueError(f"Unknown value tag {tag} at offset {pos - 1}")
+
+
+def encode_tx(tx):
+    """Canonical bytes for a transaction (or a plain value carried in a block)."""
+    out = bytearray()
+    if isinstance(tx, Serializable):
+        write_varint(out, tx.TYPE_ID)
+        for name in tx.FIELDS + tx.EXTRA_FIELDS:
+            write_value(out, getattr(tx, name))
+    else:
+        out.append(PLAIN)
+        write_value(out, tx)
+    return bytes(out)
+
+
+def read_tx(buf, pos=0):
+    """Decode one transaction record starting at `pos`; returns (tx, next_pos)."""
+    type_id, pos = read_varint(buf, pos)
+    if type_id == PLAIN:
+        return read_value(buf, pos)
+    cls = _TYPES.get(type_id)
+    if cls is None:
+        raise ValueError(f"Unknown transaction type id {type_id}")
+    values = []
+    for _ in range(len(cls.FIELDS) + len(cls.EXTRA_FIELDS)):
+        value, pos = read_value(buf, pos)
+        values.append(value)
+    tx = cls(*values[:len(cls.FIELDS)])
+    for name, value in zip(cls.EXTRA_FIELDS, values[len(cls.FIELDS):]):
+        setattr(tx, name, value)
+    return tx, pos
+
+
+def decode_tx(data):
+    tx, _ = read_tx(memoryview(data))
+    return tx
+
+
+def tx_hash(tx):
+    """Content hash (digest bytes) of a transaction's canonical encoding."""
+    return hashlib.sha256(encode_tx(tx)).digest()
+
+
+def encode_txs(txs):
+    """Count-prefixed sequence of length-prefixed transaction records."""
+    out = bytearray()
+    write_varint(out, len(txs))
+    for tx in txs:
+        record = tx if isinstance(tx, bytes) else encode_tx(tx)
+        write_varint(out, len(record))
+        out += record
+    return out
+
+
+def read_txs(buf, pos=0, digests=None):
+    """Decode a sequence from encode_txs; optionally collect each record's tx_hash."""
+    count, pos = read_varint(buf, pos)
+    txs = []
+    for _ in range(count):
+        size, pos = read_varint(buf, pos)
+        tx, end = read_tx(buf, pos)
+        if end != pos + size:
+            raise ValueError("Transaction record length mismatch")
+        if digests is not None:
+            digests.append(hashlib.sha256(buf[pos:end]).digest())
+        txs.append(tx)
+        pos = end
+    return txs, pos
+
+
+class Serializable:
+    """
+    Mixin for transaction classes. FIELDS are the constructor arguments, in
+    order; EXTRA_FIELDS are attributes set after construction (e.g. signatures).
+    """
+    __slots__ = ()
+    TYPE_ID = None
+    FIELDS = ()
+    EXTRA_FIELDS = ()
+
+    def encode(self):
+        return encode_tx(self)
+
+    @classmethod
+    def decode(cls, data):
+        return decode_tx(data)
+
+    def hash(self):
+        return tx_hash(self)
+
+    def signing_hash(self):
+        """Digest signers commit to: the encoding without EXTRA_FIELDS (signatures)."""
+        out = bytearray()
+        write_varint(out, self.TYPE_ID)
+        for name in self.FIELDS:
+            write_value(out, getattr(self, name))
+        return hashlib.sha256(out).digest()
+
+    @property
+    def txid(self):
+        return tx_hash(self).hex()
+
+    def to_dict(self):
+        fields = {name: getattr(self, name) for name in self.FIELDS + self.EXTRA_FIELDS}
+        for name, value in fields.items():
+            if isinstance(value, bytes):
+                fields[name] = value.hex()
+            elif isinstance(value, (list, tuple)):
+                fields[name] = [v.hex() if isinstance(v, bytes) else v for v in value]
+        return {"type": type(self).__name__, "txid": self.txid, **fields}
+
+    def __repr__(self):
+        args = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{type(self).__name__}({args})"
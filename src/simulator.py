@@ -0,0 +1,204 @@
+import heapq
+import random
+
+from .blockchain import Blockchain
+from .block import Block
+from .config import BlockConfig
+from .networking import NodeDiscovery, GossipProtocol
+from .serialization import encode_tx, decode_tx
+from .transaction import Transaction
+
+# Payload kind prefixes for gossiped data
+BLOCK, TX = b"b", b"t"
+# Per-message framing overhead and id size on the wire
+MESSAGE_OVERHEAD = 24
+ID_SIZE = 32
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class SimNode:
+    """One simulated peer: a Blockchain fed by a GossipProtocol, with the blocks it has seen."""
+    def __init__(self, address, simulator, block_config):
+        self.address = address
+        self.chain = Blockchain(name=f"sim-{address}", block=block_config, initial_nodes=[address])
+        self.discovery = NodeDiscovery()
+        self.gossip = GossipProtocol(self.discovery, send=lambda peer, message: simulator.send(self, peer, message),
+                                     fanout=simulator.fanout, on_deliver=lambda payload: simulator.deliver(self, payload),
+                                     rng=simulator.rng, clock=lambda: simulator.now)
+        genesis = self.chain.chain[0]
+        self.known = {genesis.hash: genesis}
+        self.waiting = {}
+        self.uplink_free = 0.0
+
+    @property
+    def tip(self):
+        return self.chain.chain[-1]
+
+
+class Simulator:
+    """
+    Deterministic discrete-event simulation of block and transaction
+    propagation. Every address in a MeshNetwork becomes a SimNode whose
+    gossip messages are delivered after the link latency plus the time to
+    push the message through the sender's uplink at `bandwidth` bytes/s.
+    Blocks are found as a Poisson process with mean `block_interval` by a
+    miner drawn by hashpower, built from that miner's mempool and tip, so
+    slow propagation shows up as forks and orphans. No sockets are opened.
+    """
+    def __init__(self, mesh, latency=0.05, bandwidth=1000000, block_interval=None, tx_rate=0.0,
+                 fanout=8, block=None, hashpower=None, pull_interval=5.0, seed=0):
+        self.mesh = mesh
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.block_config = block or BlockConfig()
+        self.block_interval = block_interval or self.block_config.interval
+        self.tx_rate = tx_rate
+        self.fanout = fanout
+        self.pull_interval = pull_interval
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.events = []
+        self._seq = 0
+        addresses = sorted(mesh.connections)
+        self.nodes = {address: SimNode(address, self, self.block_config) for address in addresses}
+        for address, node in self.nodes.items():
+            for peer in sorted(mesh.get_connections(address)):
+                node.discovery.add_peer(peer)
+        self.hashpower = hashpower or {address: 1 for address in addresses}
+        self.mined = {}
+        self.nonces = {}
+        self.first_seen = {}
+        self.messages = 0
+
+    def schedule(self, delay, callback, *args):
+        heapq.heappush(self.events, (self.now + delay, self._seq, callback, args))
+        self._seq += 1
+
+    def link_latency(self, a, b):
+        return self.latency(a, b) if callable(self.latency) else self.latency
+
+    def send(self, node, peer, message):
+        kind = message[0]
+        if kind == "data":
+            size = len(message[2])
+        elif kind in ("inv", "getdata"):
+            size = ID_SIZE * len(message[1])
+        else:
+            size = 0
+        size += MESSAGE_OVERHEAD
+        # Messages queue behind each other on the sender's uplink
+        start = max(self.now, node.uplink_free)
+        node.uplink_free = start + size / self.bandwidth
+        arrival = node.uplink_free + self.link_latency(node.address, peer) - self.now
+        self.messages += 1
+        self.schedule(arrival, self.nodes[peer].gossip.receive, node.address, message)
+
+    def deliver(self, node, payload):
+        kind, body = payload[:1], payload[1:]
+        if kind == TX:
+            node.chain.mempool.add(decode_tx(body))
+        elif kind == BLOCK:
+            self.accept_block(node, Block.decode(body))
+
+    def accept_block(self, node, block):
+        if block.hash in node.known:
+            return
+        if block.previous_hash not in node.known:
+            node.waiting.setdefault(block.previous_hash, []).append(block)
+            return
+        node.known[block.hash] = block
+        self.first_seen.setdefault(block.hash, {}).setdefault(node.address, self.now)
+        if block.index > node.tip.index:
+            self.reorg(node, block)
+        for child in node.waiting.pop(block.hash, ()):
+            self.accept_block(node, child)
+
+    def reorg(self, node, block):
+        """Switch `node` to the branch ending in `block` (longest chain wins)."""
+        branch = [block]
+        while branch[-1].index > 0:
+            parent = node.known[branch[-1].previous_hash]
+            if parent.index < len(node.chain.chain) and node.chain.chain[parent.index].hash == parent.hash:
+                break
+            branch.append(parent)
+        node.chain.rollback(branch[-1].index)
+        for connected in reversed(branch):
+            node.chain.connect_block(connected)
+
+    def mine(self):
+        addresses = list(self.hashpower)
+        miner = self.nodes[self.rng.choices(addresses, weights=[self.hashpower[a] for a in addresses])[0]]
+        tip = miner.tip
+        block = Block(tip.index + 1, tip.hash, miner.chain.mempool.select(miner.chain.block_budget()),
+                      timestamp=self.now, nonce=self.rng.getrandbits(64))
+        self.mined[block.hash] = (miner.address, self.now)
+        # Delivery to the miner itself connects the block to its chain
+        miner.gossip.broadcast(BLOCK + block.encode())
+        self.schedule(self.rng.expovariate(1 / self.block_interval), self.mine)
+
+    def new_transaction(self):
+        origin = self.nodes[self.rng.choice(list(self.nodes))]
+        # Sequential per-sender nonces, as a wallet would issue them; the mempool
+        # only releases a sender's next nonce once the previous one is mined
+        nonce = self.nonces.get(origin.address, 0)
+        self.nonces[origin.address] = nonce + 1
+        tx = Transaction(origin.address, self.rng.choice(list(self.nodes)), self.rng.randint(1, 1000),
+                         fee=self.rng.randint(1, 100), nonce=nonce)
+        origin.gossip.broadcast(TX + encode_tx(tx))
+        self.schedule(self.rng.expovariate(self.tx_rate), self.new_transaction)
+
+    def pull(self, node):
+        node.gossip.pull_round(peers=1)
+        self.schedule(self.pull_interval, self.pull, node)
+
+    def run(self, duration):
+        """Simulate `duration` seconds and return the report."""
+        self.schedule(self.rng.expovariate(1 / self.block_interval), self.mine)
+        if self.tx_rate:
+            self.schedule(self.rng.expovariate(self.tx_rate), self.new_transaction)
+        if self.pull_interval:
+            for node in self.nodes.values():
+                self.schedule(self.rng.uniform(0, self.pull_interval), self.pull, node)
+        end = self.now + duration
+        while self.events and self.events[0][0] <= end:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+        self.now = end
+        return self.report()
+
+    def report(self):
+        delays = []
+        coverage = []
+        others = len(self.nodes) - 1
+        for block_hash, (miner, mined_at) in self.mined.items():
+            seen = sorted(t - mined_at for address, t in self.first_seen.get(block_hash, {}).items() if address != miner)
+            delays.extend(seen)
+            # Time until 90% of the other nodes had the block
+            needed = max(1, int(0.9 * others))
+            if len(seen) >= needed:
+                coverage.append(seen[needed - 1])
+        # The best chain is the longest one any node holds
+        best = max(self.nodes.values(), key=lambda node: len(node.chain.chain)).chain.chain
+        main = {best[height].hash for height in range(1, len(best))}
+        sent = [node.gossip.stats["bytes_sent"] for node in self.nodes.values()]
+        mined = len(self.mined)
+        return {
+            "duration": self.now,
+            "blocks_mined": mined,
+            "height": len(best) - 1,
+            "orphan_rate": (mined - len(main & set(self.mined))) / mined if mined else 0.0,
+            "propagation_p50": percentile(delays, 50),
+            "propagation_p90": percentile(delays, 90),
+            "propagation_p99": percentile(delays, 99),
+            "coverage_90_p50": percentile(coverage, 50),
+            "bytes_per_node": sum(sent) / len(sent) if sent else 0,
+            "max_bytes_per_node": max(sent, default=0),
+            "duplicates": sum(node.gossip.stats["duplicates"] for node in self.nodes.values()),
+            "messages": self.messages,
+        }
@@ -0,0 +1,143 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .transaction_types import TransactionType, AccountTransaction, MultiSigTransaction, TimeLockedTransaction
+
+# Plain balance transfers the batch path knows how to validate and apply
+TRANSFER_TYPES = frozenset((AccountTransaction, MultiSigTransaction, TimeLockedTransaction))
+
+# How apply_block classifies each transaction
+SKIPPED, TRANSFER, REJECTED, OTHER = range(4)
+
+
+class AccountState:
+    """
+    Account balances kept in a NumPy array, with addresses interned to integer
+    slots. Supports the dict operations transaction types use (get, [], []=),
+    so any transaction can still be applied one at a time.
+    """
+    def __init__(self, balances=None, dtype="int64"):
+        if np is None:
+            raise ImportError("numpy not installed")
+        self.slots = {}
+        self.addresses = []
+        self.balances = np.zeros(1024, dtype=dtype)
+        for address, amount in (balances or {}).items():
+            self[address] = amount
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.slots
+
+    def intern(self, address):
+        slot = self.slots.get(address)
+        if slot is None:
+            slot = self.slots[address] = len(self.addresses)
+            self.addresses.append(address)
+            if slot >= len(self.balances):
+                self.balances = np.concatenate([self.balances, np.zeros_like(self.balances)])
+        return slot
+
+    def get(self, address, default=0):
+        slot = self.slots.get(address)
+        return default if slot is None else self.balances[slot].item()
+
+    def __getitem__(self, address):
+        return self.balances[self.slots[address]].item()
+
+    def __setitem__(self, address, amount):
+        if isinstance(amount, float):
+            self._promote()
+        slot = self.intern(address)
+        self.balances[slot] = amount
+
+    def to_dict(self):
+        return {address: self.balances[slot].item() for address, slot in self.slots.items()}
+
+    def _promote(self):
+        # Integer balances become floats once a fractional amount shows up
+        if self.balances.dtype.kind != "f":
+            self.balances = self.balances.astype("float64")
+
+    def _slots_for(self, addresses):
+        slots = list(map(self.slots.get, addresses))
+        for i, slot in enumerate(slots):
+            if slot is None:
+                slots[i] = self.intern(addresses[i])
+        return slots
+
+    @staticmethod
+    def _classify(cls):
+        if cls in TRANSFER_TYPES:
+            return TRANSFER
+        # Other account transactions that change balances (e.g. atomic swaps)
+        if hasattr(cls, "apply") and hasattr(cls, "sender") and hasattr(cls, "recipient"):
+            return OTHER
+        return SKIPPED
+
+    def apply_block(self, txs):
+        """
+        Validate and apply a block of transactions with the same result as
+        `if tx.validate(state): tx.apply(state)` run in order. Returns a list
+        of flags marking which transactions were applied.
+
+        Transfers are applied with vectorized scatter-adds unless one of their
+        accounts is in an ordering-sensitive position: receiving as well as
+        sending in this block, overdrawn by its total debits, or touched by a
+        non-transfer transaction. Those fall back to sequential application.
+        """
+        n = len(txs)
+        applied = np.zeros(n, dtype=bool)
+        if not n:
+            return applied.tolist()
+        kind_of = {cls: self._classify(cls) for cls in set(map(type, txs))}
+        kinds = np.fromiter((kind_of[type(tx)] for tx in txs), np.uint8, n)
+        # Stateless checks, only for types that define any
+        checked = [cls for cls, kind in kind_of.items() if kind == TRANSFER and cls.check is not TransactionType.check]
+        if checked:
+            for i in np.flatnonzero(kinds == TRANSFER).tolist():
+                if type(txs[i]) in checked and not txs[i].check():
+                    kinds[i] = REJECTED
+        touching = np.flatnonzero(kinds != SKIPPED)
+        touched = txs if len(touching) == n else [txs[i] for i in touching.tolist()]
+        senders = np.zeros(n, dtype=np.int64)
+        recipients = np.zeros(n, dtype=np.int64)
+        senders[touching] = self._slots_for([tx.sender for tx in touched])
+        recipients[touching] = self._slots_for([tx.recipient for tx in touched])
+        amounts = np.array([tx.amount if kind == TRANSFER else 0 for tx, kind in zip(txs, kinds.tolist())])
+        if amounts.dtype.kind == "f":
+            self._promote()
+        amounts = amounts.astype(self.balances.dtype)
+        ok = kinds == TRANSFER
+        other = kinds == OTHER
+
+        size = len(self.addresses)
+        balances = self.balances[:size]
+        conflicted = np.zeros(size, dtype=bool)
+        negative = ok & (amounts < 0)
+        conflicted[senders[other | negative]] = True
+        conflicted[recipients[other | negative]] = True
+        sending = np.zeros(size, dtype=bool)
+        receiving = np.zeros(size, dtype=bool)
+        sending[senders[ok]] = True
+        receiving[recipients[ok]] = True
+        conflicted |= sending & receiving
+        debits = np.zeros(size, dtype=balances.dtype)
+        np.add.at(debits, senders[ok], amounts[ok])
+        conflicted |= debits > balances
+
+        fast = ok & ~negative & ~conflicted[senders] & ~conflicted[recipients]
+        np.subtract.at(balances, senders[fast], amounts[fast])
+        np.add.at(balances, recipients[fast], amounts[fast])
+        applied[fast] = True
+
+        for i in np.flatnonzero((ok | other) & ~fast):
+            tx = txs[i]
+            if tx.validate(self):
+                tx.apply(self)
+                applied[i] = True
+        return applied.tolist()
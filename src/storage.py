@@ -0,0 +1,295 @@
+import bisect
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from collections import OrderedDict
+
+from .block import Block
+
+# payload length, crc32(payload), block hash
+RECORD_HEADER = struct.Struct(">II32s")
+
+
+class BlockStore:
+    """
+    Base class for block storage. Stores behave like the list `Blockchain.chain`
+    used to be: len(), indexing (including negative indices), slicing, iteration.
+    """
+    def __len__(self):
+        raise NotImplementedError
+
+    def get(self, height):
+        raise NotImplementedError
+
+    def get_by_hash(self, block_hash):
+        raise NotImplementedError
+
+    def append(self, block):
+        raise NotImplementedError
+
+    def truncate(self, height):
+        """Drop every block at `height` and above (used to roll back a fork)."""
+        raise NotImplementedError
+
+    def raw(self, height):
+        """Serialized bytes of the block at `height`."""
+        return self.get(height).encode()
+
+    def spans(self, start, stop, span_size):
+        """
+        Picklable descriptions of [start, stop) in chunks of `span_size`
+        blocks, for verification workers: ("records", first_height,
+        [(hash bytes, serialized block), ...]).
+        """
+        for first in range(start, stop, span_size):
+            blocks = [self.get(height) for height in range(first, min(first + span_size, stop))]
+            yield "records", first, [(bytes.fromhex(block.hash), block.encode()) for block in blocks]
+
+    def height_of(self, block_hash):
+        block = self.get_by_hash(block_hash)
+        return block.index if block else None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.get(h) for h in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("block height out of range")
+        return self.get(key)
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self.get(height)
+
+
+class MemoryBlockStore(BlockStore):
+    """Keeps every block in memory; nothing survives a restart."""
+    def __init__(self):
+        self.blocks = []
+        self.hashes = {}
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def get(self, height):
+        return self.blocks[height]
+
+    def get_by_hash(self, block_hash):
+        height = self.hashes.get(block_hash)
+        return None if height is None else self.blocks[height]
+
+    def height_of(self, block_hash):
+        return self.hashes.get(block_hash)
+
+    def append(self, block):
+        self.hashes[block.hash] = len(self.blocks)
+        self.blocks.append(block)
+
+    def truncate(self, height):
+        for block in self.blocks[height:]:
+            self.hashes.pop(block.hash, None)
+        del self.blocks[height:]
+
+
+class FileBlockStore(BlockStore):
+    """
+    Append-only block store. Serialized blocks are appended to segment files
+    and read back through memory maps; a height and hash index locate them.
+    Only the `cache_blocks` most recent blocks are kept decoded in memory.
+    """
+    def __init__(self, path, segment_size=64 * 1024 * 1024, sync_every=64, cache_blocks=256):
+        self.path = path
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.cache_blocks = cache_blocks
+        os.makedirs(path, exist_ok=True)
+        # Height index: segment number, payload offset and payload size per block
+        self._segment = array("I")
+        self._offset = array("Q")
+        self._size = array("I")
+        self._hashes = {}
+        self._maps = {}
+        self._recent = OrderedDict()
+        self._unsynced = 0
+        self._load()
+        self._active = self._segment_count - 1
+        self._file = open(self._segment_path(self._active), "ab")
+
+    def _segment_path(self, number):
+        return os.path.join(self.path, f"segment-{number:05d}.dat")
+
+    def _load(self):
+        numbers = sorted(int(name[8:13]) for name in os.listdir(self.path)
+                         if name.startswith("segment-") and name.endswith(".dat"))
+        self._segment_count = max(len(numbers), 1)
+        for number in range(self._segment_count):
+            self._scan(number, last=number == self._segment_count - 1)
+
+    def _scan(self, number, last):
+        path = self._segment_path(number)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+            return
+        with open(path, "rb") as f:
+            data = f.read() if last else None
+            end = os.fstat(f.fileno()).st_size
+            pos = 0
+            while pos + RECORD_HEADER.size <= end:
+                if data is None:
+                    f.seek(pos)
+                    header = f.read(RECORD_HEADER.size)
+                else:
+                    header = data[pos:pos + RECORD_HEADER.size]
+                size, crc, block_hash = RECORD_HEADER.unpack(header)
+                start = pos + RECORD_HEADER.size
+                if start + size > end:
+                    break
+                # Only the last segment can hold a torn write, so only it is checksummed
+                if data is not None and zlib.crc32(data[start:start + size]) != crc:
+                    break
+                self._index(number, start, size, block_hash.hex())
+                pos = start + size
+        if pos < end:
+            if not last:
+                raise ValueError(f"Corrupt block segment {path} at offset {pos}")
+            print(f"Truncating torn block record in {path} at offset {pos}")
+            os.truncate(path, pos)
+
+    def _index(self, number, offset, size, block_hash):
+        self._hashes[block_hash] = len(self._offset)
+        self._segment.append(number)
+        self._offset.append(offset)
+        self._size.append(size)
+
+    def __len__(self):
+        return len(self._offset)
+
+    def append(self, block):
+        payload = block.encode()
+        if self._file.tell() and self._file.tell() + RECORD_HEADER.size + len(payload) > self.segment_size:
+            self._roll_segment()
+        offset = self._file.tell() + RECORD_HEADER.size
+        self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload), bytes.fromhex(block.hash)))
+        self._file.write(payload)
+        self._index(self._active, offset, len(payload), block.hash)
+        self._remember(len(self) - 1, block)
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.flush()
+
+    def _roll_segment(self):
+        self.flush()
+        self._file.close()
+        self._active += 1
+        self._file = open(self._segment_path(self._active), "ab")
+
+    def _remember(self, height, block):
+        self._recent[height] = block
+        self._recent.move_to_end(height)
+        while len(self._recent) > self.cache_blocks:
+            self._recent.popitem(last=False)
+
+    def _map(self, number, end):
+        mapped = self._maps.get(number)
+        if mapped is None or len(mapped) < end:
+            if number == self._active:
+                self._file.flush()
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(number), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[number] = mapped
+        return mapped
+
+    def raw(self, height):
+        offset, size = self._offset[height], self._size[height]
+        mapped = self._map(self._segment[height], offset + size)
+        return mapped[offset:offset + size]
+
+    def spans(self, start, stop, span_size):
+        """
+        Byte ranges of segment files, ("file", first_height, path, begin,
+        end), so workers map the records themselves instead of receiving them.
+        """
+        self.flush()
+        first = start
+        while first < stop:
+            last = min(first + span_size, stop)
+            # A span never crosses a segment boundary
+            last = min(last, bisect.bisect_right(self._segment, self._segment[first], first, last))
+            yield ("file", first, self._segment_path(self._segment[first]),
+                   self._offset[first] - RECORD_HEADER.size, self._offset[last - 1] + self._size[last - 1])
+            first = last
+
+    def get(self, height):
+        block = self._recent.get(height)
+        if block is not None:
+            return block
+        offset, size = self._offset[height], self._size[height]
+        mapped = self._map(self._segment[height], offset + size)
+        with memoryview(mapped) as view:
+            return Block.decode(view[offset:offset + size])
+
+    def get_by_hash(self, block_hash):
+        height = self._hashes.get(block_hash)
+        return None if height is None else self.get(height)
+
+    def height_of(self, block_hash):
+        return self._hashes.get(block_hash)
+
+    def truncate(self, height):
+        if height >= len(self):
+            return
+        self.flush()
+        self._file.close()
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+        keep_segment = self._segment[height]
+        for number in range(keep_segment + 1, self._active + 1):
+            os.remove(self._segment_path(number))
+        os.truncate(self._segment_path(keep_segment), self._offset[height] - RECORD_HEADER.size)
+        for block_hash, h in list(self._hashes.items()):
+            if h >= height:
+                del self._hashes[block_hash]
+        del self._segment[height:], self._offset[height:], self._size[height:]
+        for h in [h for h in self._recent if h >= height]:
+            del self._recent[h]
+        self._active = keep_segment
+        self._file = open(self._segment_path(self._active), "ab")
+
+    def flush(self):
+        """Flush buffered appends and fsync them to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+
+def open_block_store(state_config):
+    """Build the block store selected by StateConfig.storage ("memory" or "file")."""
+    if state_config.storage == "file":
+        return FileBlockStore(
+            state_config.data_dir,
+            segment_size=state_config.segment_size,
+            sync_every=state_config.sync_every,
+            cache_blocks=state_config.cache_blocks,
+        )
+    if state_config.storage == "memory":
+        return MemoryBlockStore()
+    raise ValueError(f"Unknown storage backend: {state_config.storage}")
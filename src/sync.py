@@ -0,0 +1,312 @@
+import asyncio
+import time
+
+from .block import Block, BlockHeader, HEADER_SIZE
+from .serialization import encode_tx
+
+
+class LocalPeer:
+    """
+    Sync peer serving another in-process Blockchain. `latency` (seconds per
+    request) and `bandwidth` (bytes/s) simulate a remote link. Any object
+    with the same coroutines can be used as a peer.
+    """
+    def __init__(self, chain, latency=0.0, bandwidth=None, name=None):
+        self.chain = chain
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.name = name or chain.name
+
+    async def _transfer(self, size):
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def height(self):
+        await self._transfer(0)
+        return len(self.chain.chain) - 1
+
+    async def get_headers(self, start, count):
+        store = self.chain.chain
+        headers = [store[height].header.encode() for height in range(start, min(start + count, len(store)))]
+        await self._transfer(HEADER_SIZE * len(headers))
+        return headers
+
+    async def get_blocks(self, start, count):
+        store = self.chain.chain
+        raws = [store.raw(height) for height in range(start, min(start + count, len(store)))]
+        await self._transfer(sum(map(len, raws)))
+        return raws
+
+    async def get_filters(self, start, count):
+        store = self.chain.chain
+        filters = [self.chain.filters.get(store[height]) for height in range(start, min(start + count, len(store)))]
+        await self._transfer(sum(map(len, filters)))
+        return filters
+
+    async def get_proof(self, height, position):
+        """(encoded transaction, transactions in the block, Merkle audit path)."""
+        block = self.chain.chain[height]
+        tx = encode_tx(block.transactions[position])
+        proof = block.inclusion_proof(position)
+        await self._transfer(len(tx) + 32 * len(proof))
+        return tx, len(block.transactions), proof
+
+
+class PeerState:
+    """
+    Per-peer scoring: a throughput estimate (blocks per second), the window
+    it sizes, and a failure count. Windows grow by doubling until the first
+    measurement, then track what the peer delivers in `target` seconds.
+    """
+    __slots__ = ("peer", "window", "throughput", "failures", "blocks")
+
+    def __init__(self, peer, window):
+        self.peer = peer
+        self.window = window
+        self.throughput = 0.0
+        self.failures = 0
+        self.blocks = 0
+
+    def record(self, count, elapsed, min_window, max_window, target):
+        rate = count / max(elapsed, 1e-6)
+        self.throughput = rate if not self.throughput else 0.8 * self.throughput + 0.2 * rate
+        self.window = max(min_window, min(int(self.throughput * target), self.window * 2, max_window))
+
+    def penalize(self, min_window):
+        self.failures += 1
+        self.throughput /= 2
+        self.window = max(self.window // 2, min_window)
+
+
+class ChainSync:
+    """
+    Headers-first sync. The header chain is downloaded from the best peer
+    and checked (links, hashes, proof of work) before any body is fetched.
+    Bodies are then requested in windows from every peer at once, with
+    `in_flight` requests pipelined per peer so round-trips overlap. Each
+    peer's window is sized from its measured throughput, and the blocks
+    the chain is about to need go to peers that are not much slower than
+    the best one. A window that times out is re-queued for another peer;
+    when the block the chain is waiting on is slow, faster idle peers
+    request it again. Blocks are connected strictly in height order.
+
+    When the peer's branch forks below our tip, our blocks stay connected
+    until the replacement bodies have been downloaded past our old tip;
+    only then is our side rolled back, and it is restored if a replacement
+    fails validation before the new branch overtakes it.
+    """
+    def __init__(self, chain, peers, window=16, max_window=128, in_flight=2, timeout=5.0,
+                 header_batch=2000, max_ahead=1024, max_failures=3):
+        self.chain = chain
+        self.peers = [PeerState(peer, window) for peer in peers]
+        self.min_window = window
+        self.max_window = max_window
+        self.in_flight = in_flight
+        self.timeout = timeout
+        self.header_batch = header_batch
+        self.max_ahead = max_ahead
+        self.max_failures = max_failures
+
+    async def _call(self, state, request):
+        try:
+            return await asyncio.wait_for(request, self.timeout)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            state.penalize(self.min_window)
+            return None
+
+    async def sync(self):
+        """Catch up with the best peer; returns the number of blocks connected."""
+        heights = await asyncio.gather(*(self._call(state, state.peer.height()) for state in self.peers))
+        candidates = [(height, state) for height, state in zip(heights, self.peers) if height is not None]
+        if not candidates:
+            raise ConnectionError("No peer answered")
+        best_height, best = max(candidates, key=lambda item: item[0])
+        if best_height < len(self.chain.chain):
+            return 0
+        fork = await self._fork_point(best, best_height)
+        headers = await self._fetch_headers(best, fork, best_height)
+        if fork + len(headers) <= len(self.chain.chain) - 1:
+            return 0
+        return await self._fetch_blocks(fork, headers)
+
+    async def _fork_point(self, state, peer_height):
+        """Highest height whose block we share with the peer, stepping back exponentially."""
+        store = self.chain.chain
+        height = min(len(store) - 1, peer_height)
+        step = 1
+        while height > 0:
+            headers = await self._call(state, state.peer.get_headers(height, 1))
+            if headers:
+                try:
+                    if BlockHeader.decode(headers[0]).compute_hash() == store[height].hash:
+                        return height
+                except ValueError:
+                    state.penalize(self.min_window)
+            height = max(height - step, 0)
+            step *= 2
+        return 0
+
+    async def _fetch_headers(self, state, fork, peer_height):
+        headers = []
+        previous_hash = self.chain.chain[fork].hash
+        min_difficulty = getattr(self.chain.consensus, "difficulty", 0)
+        while fork + len(headers) < peer_height:
+            start = fork + len(headers) + 1
+            batch = await self._call(state, state.peer.get_headers(start, self.header_batch))
+            if not batch:
+                break
+            for height, raw in enumerate(batch[:self.header_batch], start):
+                try:
+                    header = BlockHeader.decode(raw)
+                except ValueError:
+                    # Garbage costs the peer; the headers checked so far still stand
+                    state.penalize(self.min_window)
+                    return headers
+                block_hash = header.compute_hash()
+                if header.index != height or header.previous_hash != previous_hash:
+                    raise ValueError(f"Header {height} does not extend the chain")
+                if header.difficulty < min_difficulty or not block_hash.startswith("0" * header.difficulty):
+                    raise ValueError(f"Header {height} fails proof of work")
+                headers.append(block_hash)
+                previous_hash = block_hash
+        return headers
+
+    async def _fetch_blocks(self, fork, hashes):
+        self._base = fork + 1
+        self._hashes = hashes
+        self._last = fork + len(hashes)
+        tip = len(self.chain.chain)
+        # Our blocks above the fork, kept until the new branch is longer than them
+        self._replaced = None
+        self._switch = tip if tip > self._base else None
+        self._height = self._base   # next height to connect
+        self._waiting = self._base  # lowest height not downloaded yet
+        self._next = self._base
+        self._retry = []
+        self._arrived = {}
+        self._requested = {}
+        self._connected = 0
+        self._changed = asyncio.Condition()
+        self._stopped = False
+        workers = [asyncio.ensure_future(self._worker(state))
+                   for state in self.peers for _ in range(self.in_flight)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # One worker failed (e.g. a block failed validation): stop the others polling.
+            # The flag covers a cancellation that wait_for swallows as it times out
+            self._stopped = True
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        if self._height <= self._last:
+            raise ConnectionError(f"Sync stalled at height {self._height}: no responsive peers")
+        return self._connected
+
+    def _slow(self, state):
+        """Much slower than the best live peer, so it should not hold up the next blocks."""
+        best = max((other.throughput for other in self.peers if other.failures < self.max_failures), default=0)
+        return state.throughput * 4 < best
+
+    def _pick(self, state):
+        urgent = self._waiting + self.max_window
+        for i, (start, count) in enumerate(self._retry):
+            if start >= urgent or not self._slow(state):
+                return self._retry.pop(i)
+        limit = max(self._height, self._switch or 0) + self.max_ahead
+        if self._next <= self._last and self._next < limit and (self._next >= urgent or not self._slow(state)):
+            start = self._next
+            count = min(state.window, self._last - start + 1)
+            self._next += count
+            return start, count
+        # Nothing new to ask for: a faster peer duplicates the request the chain is blocked on
+        blocked = self._waiting
+        if blocked <= self._last:
+            for (start, count), (owner, sent) in self._requested.items():
+                if start <= blocked < start + count and owner is not state \
+                        and state.throughput >= owner.throughput \
+                        and time.monotonic() - sent > self.timeout / 4:
+                    return start, count
+        return None
+
+    async def _worker(self, state):
+        while not self._stopped and self._height <= self._last and state.failures < self.max_failures:
+            chunk = self._pick(state)
+            if chunk is None:
+                async with self._changed:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), self.timeout / 4)
+                    except asyncio.TimeoutError:
+                        pass
+                continue
+            start, count = chunk
+            sent = time.monotonic()
+            self._requested[chunk] = (state, sent)
+            raws = await self._call(state, state.peer.get_blocks(start, count))
+            if raws:
+                raws = raws[:count]
+            if self._requested.get(chunk, (None,))[0] is state:
+                del self._requested[chunk]
+            if not raws or not self._accept(start, raws):
+                # None means _call already penalized a timeout; an empty or bad answer counts too
+                if raws is not None:
+                    state.penalize(self.min_window)
+                if any(height not in self._arrived and height >= self._height
+                       for height in range(start, start + count)):
+                    self._retry.append(chunk)
+                    self._retry.sort()
+            else:
+                state.record(len(raws), time.monotonic() - sent, self.min_window, self.max_window,
+                             self.timeout / 4)
+                state.blocks += len(raws)
+            self._connect()
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _accept(self, start, raws):
+        for height, raw in enumerate(raws, start):
+            if height < self._height or height in self._arrived:
+                continue
+            try:
+                block = Block.decode(raw)
+            except ValueError:
+                return False
+            # The body must belong to the header we already validated
+            if block.hash != self._hashes[height - self._base]:
+                return False
+            self._arrived[height] = block
+        return True
+
+    def _connect(self):
+        while self._waiting in self._arrived:
+            self._waiting += 1
+        if self._switch is not None:
+            # Only a downloaded branch longer than ours may replace it
+            if self._waiting <= self._switch:
+                return
+            self._replaced = [self.chain.chain[height] for height in range(self._base, self._switch)]
+            self._switch = None
+            self.chain.rollback(self._base)
+        while self._height in self._arrived:
+            block = self._arrived.pop(self._height)
+            consensus = self.chain.consensus
+            if hasattr(consensus, "validate_block") and not consensus.validate_block(block, self.chain.chain):
+                self._restore()
+                raise ValueError(f"Block {self._height} failed consensus validation")
+            self.chain.connect_block(block)
+            self._connected += 1
+            self._height += 1
+            if self._replaced is not None and self._height > self._base + len(self._replaced):
+                self._replaced = None
+
+    def _restore(self):
+        """Put back our own branch if the new one failed before overtaking it."""
+        if self._replaced is None:
+            return
+        self.chain.rollback(self._base)
+        for block in self._replaced:
+            self.chain.connect_block(block)
+        self._connected = 0
+        self._replaced = None
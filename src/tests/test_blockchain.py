@@ -1,18 +1,176 @@
-import unittest
+import asyncio
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
 import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import requests
 from pychain.blockchain import Blockchain
+from pychain.network import Node, encode_frame, read_frame
+from pychain.simulator import Simulator
+from pychain.sync import ChainSync, LocalPeer
+from pychain.light import LightClient
+from pychain.filters import BlockFilter, FilterIndex, build_filter
+from pychain.block import Block, BlockHeader
+from pychain.merkle import MerkleTree, verify_proof
+from pychain.serialization import decode_tx, read_tx
+from pychain.transaction import Transaction
+from pychain.config import BlockConfig, ConsensusConfig, StateConfig
+from pychain.storage import FileBlockStore
+from pychain.mempool import Mempool
+from pychain.state import AccountState
+from pychain.utxo import UTXOSet
+from pychain.executor import BlockExecutor
+from pychain import crypto
+from pychain.crypto import SignatureVerifier, generate_keypair
 from pychain.consensus import PoWConsensus, DPoSConsensus
-from pychain.contracts.engines import EVMEngine, NativeEngine
+from pychain.mining import Miner
+from pychain.contracts import engines
+from pychain.contracts.engines import EVMEngine, NativeEngine, WASMEngine, OutOfFuel
 from pychain.transaction_types import (
     UTXOTransaction, AccountTransaction, ConfidentialTransaction,
     MultiSigTransaction, AtomicSwapTransaction, TimeLockedTransaction
 )
-from pychain.networking import NodeDiscovery, GossipProtocol, DHTProtocol, Sharding, MeshNetwork, LightningNetwork
-from pychain.api import RESTAPI, CLIAPI
+from pychain.networking import NodeDiscovery, GossipProtocol, SeenCache, DHTProtocol, key_id, Sharding, MeshNetwork, LightningNetwork
+from pychain.api import RESTAPI, CLIAPI, ExplorerAPI, WebSocketAPI, Subscriber, RPCAPI
+from pychain import api
+from pychain.indexer import ExplorerIndex
+from pychain.rpc import RPCClient, CachingRPCClient, RPCError
+from pychain.backend import GethBackend
 from pychain.governance import OnChainVoting, GovernanceToken, LiquidDemocracy, Futarchy, HardFork, SoftFork
 
+requires_crypto = unittest.skipIf(crypto.Ed25519PublicKey is None, 'cryptography not installed')
+requires_wasmer = unittest.skipIf(engines.Instance is None, 'wasmer not installed')
+
+# Exports add(i32, i32) -> i32 and spin(), an endless loop; both charge fuel through env.gas
+METERED_WASM = bytes.fromhex(
+    "0061736d01000000"
+    "010e0360017f0060027f7f017f600000"
+    "020b0103656e76036761730000"
+    "0303020102"
+    "070e02036164640001047370696e0002"
+    "0a19020b0041011000200020016a0b0b000340410110000c000b0b")
+
+
+def fake_wasmer():
+    """
+    Stand-ins for the wasmer classes WASMEngine uses, so its cache, pool and
+    metering logic runs without wasmer. A fake module's bytecode names its
+    imports ("env.gas" makes it metered); instances export add, spin and
+    bump, which counts calls in instance memory.
+    """
+    class Import:
+        def __init__(self, name):
+            self.module, self.name = name.split('.')
+
+    class Module:
+        def __init__(self, store, bytecode):
+            self.bytecode = bytes(bytecode)
+            self.imports = [Import(name) for name in self.bytecode.decode().split(',') if name]
+
+        def serialize(self):
+            return b'fake:' + self.bytecode
+
+        @staticmethod
+        def deserialize(store, data):
+            if not data.startswith(b'fake:'):
+                raise RuntimeError('incompatible artifact')
+            return Module(store, data[5:])
+
+    class ImportObject:
+        def __init__(self):
+            self.namespaces = {}
+
+        def register(self, namespace, functions):
+            self.namespaces[namespace] = functions
+
+    class Exports:
+        def __init__(self, gas):
+            self.gas = gas
+            self.memory = 0
+
+        def add(self, a, b):
+            self.gas(1)
+            return a + b
+
+        def spin(self):
+            while True:
+                self.gas(1)
+
+        def bump(self):
+            self.gas(1)
+            self.memory += 1
+            return self.memory
+
+    class Instance:
+        def __init__(self, module, imports):
+            self.exports = Exports(imports.namespaces['env']['gas'])
+
+    return {'Store': object, 'Module': Module, 'Instance': Instance, 'ImportObject': ImportObject,
+            'Function': lambda store, fn, signature: fn, 'FunctionType': lambda params, results: None,
+            'Type': mock.Mock()}
+
+
+def build_sim_mesh():
+    rng = random.Random(5)
+    mesh = MeshNetwork()
+    names = [f'n{i}' for i in range(15)]
+    for i, name in enumerate(names):
+        mesh.connect(name, names[(i + 1) % len(names)])
+        mesh.connect(name, rng.choice(names[:i] + names[i + 1:]))
+    return mesh
+
+
+def serve_json_rpc(answer, fail=0, delay=0):
+    """
+    Stub JSON-RPC server on a free port: `answer(message)` builds each
+    reply, batches are answered in reverse order and the first `fail`
+    posts get a 503. Returns the server and a dict of what it saw.
+    """
+    seen = {'ports': set(), 'posts': 0, 'methods': [], 'fail': fail}
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            seen['ports'].add(self.client_address[1])
+            seen['posts'] += 1
+            if seen['fail']:
+                seen['fail'] -= 1
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(delay)
+            messages = body if isinstance(body, list) else [body]
+            seen['methods'].extend(m['method'] for m in messages)
+            reply = [answer(m) for m in reversed(body)] if isinstance(body, list) else answer(body)
+            data = json.dumps(reply).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, seen
+
+
 class TestBlockchainFramework(unittest.TestCase):
 
+    @requires_crypto
     def test_transaction_sequence(self):
         # Account-based transactions
         balances = {'Alice': 100, 'Bob': 50, 'Carol': 0}
@@ -37,9 +195,11 @@ class TestBlockchainFramework(unittest.TestCase):
 
         # Multi-sig transaction
         balances['Carol'] = 20
-        tx4 = MultiSigTransaction(['Carol', 'Bob'], 2, 'Carol', 'Alice', 10)
-        tx4.add_signature('sigCarol')
-        tx4.add_signature('sigBob')
+        carol_key, carol_pub = generate_keypair()
+        bob_key, bob_pub = generate_keypair()
+        tx4 = MultiSigTransaction([carol_pub, bob_pub], 2, 'Carol', 'Alice', 10)
+        tx4.sign(carol_key)
+        tx4.sign(bob_key)
         self.assertTrue(tx4.validate(balances))
         balances = tx4.apply(balances)
         self.assertEqual(balances['Carol'], 10)
@@ -71,6 +231,255 @@ class TestBlockchainFramework(unittest.TestCase):
         block2 = DummyBlock('abc')
         self.assertFalse(pow.validate_block(block2, []))
 
+    def test_pow_mining(self):
+        chain = Blockchain(consensus=ConsensusConfig(type='PoW', params={'difficulty': 2}), consensus_class=PoWConsensus)
+        chain.add_transaction('A', 'B', 5)
+        chain.mine_block()
+        self.assertEqual(len(chain.chain), 2)
+        block = chain.chain[-1]
+        self.assertTrue(block.hash.startswith('00'))
+        self.assertEqual(block.hash, block.compute_hash())
+
+    def test_parallel_miner(self):
+        miner = Miner(workers=2, batch_size=2000, parallel_threshold=0)
+        try:
+            block = Block(1, 'abc', ['tx'])
+            self.assertTrue(miner.mine(block, 3))
+        finally:
+            miner.close()
+        self.assertTrue(block.hash.startswith('000'))
+        self.assertEqual(block.hash, block.compute_hash())
+        self.assertGreater(miner.hashrate, 0)
+
+    def test_miner_cancel(self):
+        miner = Miner(workers=1)
+        block = Block(1, 'abc', ['tx'])
+        timer = threading.Timer(0.2, miner.cancel)
+        timer.start()
+        self.assertFalse(miner.mine(block, 64))
+        self.assertGreater(miner.hashes, 0)
+
+    def test_merkle_proofs(self):
+        for size in range(1, 12):
+            leaves = [f'tx{i}'.encode() for i in range(size)]
+            tree = MerkleTree(leaves)
+            for i, leaf in enumerate(leaves):
+                proof = tree.proof(i)
+                self.assertTrue(verify_proof(leaf, i, size, proof, tree.root()))
+                self.assertFalse(verify_proof(b'other', i, size, proof, tree.root()))
+
+    def test_block_header(self):
+        block = Block(1, 'ab' * 32, ['tx1', 'tx2'], difficulty=2)
+        root = block.merkle_root
+        block.add_transaction('tx3')
+        self.assertNotEqual(block.merkle_root, root)
+        self.assertEqual(block.merkle_root, Block(1, 'ab' * 32, ['tx1', 'tx2', 'tx3']).merkle_root)
+        self.assertTrue(block.verify_inclusion('tx3', 2, block.inclusion_proof(2)))
+        header = BlockHeader.decode(block.header.encode())
+        self.assertEqual(header.compute_hash(), block.hash)
+
+    def test_transaction_encoding(self):
+        multisig = MultiSigTransaction(['A', 'C'], 2, 'A', 'B', 5)
+        multisig.add_signature(b'sig')
+        txs = [
+            Transaction('A', 'B', 1.5),
+            UTXOTransaction([('tx0', 0)], [('B', 10)]),
+            AccountTransaction('A', 'B', -3),
+            ConfidentialTransaction('A', 'B', b'commitment'),
+            multisig,
+            AtomicSwapTransaction('A', 'B', 5, hash('secret'), 123.0),
+            TimeLockedTransaction('A', 'B', 5, 456.0),
+        ]
+        for tx in txs:
+            decoded = decode_tx(tx.encode())
+            self.assertIs(type(decoded), type(tx))
+            self.assertEqual(decoded.encode(), tx.encode())
+            self.assertEqual(decoded.txid, tx.txid)
+        self.assertEqual(decode_tx(multisig.encode()).signatures, [b'sig'])
+        self.assertEqual(decode_tx(txs[1].encode()).inputs, [['tx0', 0]])
+        # Tuples and lists are one canonical encoding, so a JSON round trip keeps the txid
+        self.assertEqual(UTXOTransaction([['tx0', 0]], [['B', 10]]).txid, txs[1].txid)
+        for data in (txs[0].encode()[:-1], txs[1].encode()[:5], b''):
+            with self.assertRaises(ValueError):
+                decode_tx(data)
+        self.assertFalse(hasattr(txs[0], '__dict__'))
+        # Records decode in place from a larger buffer
+        buf = memoryview(b'xx' + txs[0].encode() + txs[2].encode())
+        tx, pos = read_tx(buf, 2)
+        self.assertEqual(tx.amount, 1.5)
+        self.assertEqual(read_tx(buf, pos)[0].amount, -3)
+
+    def test_block_encoding(self):
+        block = Block(1, 'ab' * 32, [Transaction('A', 'B', 1), AccountTransaction('B', 'C', 2)], nonce=7)
+        decoded = Block.decode(block.encode())
+        self.assertEqual(decoded.hash, block.hash)
+        self.assertEqual([tx.txid for tx in decoded.transactions], [tx.txid for tx in block.transactions])
+        tampered = bytearray(block.encode())
+        tampered[-1] ^= 1
+        with self.assertRaises(ValueError):
+            Block.decode(tampered)
+
+    def test_file_block_store(self):
+        with tempfile.TemporaryDirectory() as path:
+            config = StateConfig(storage='file', data_dir=path, segment_size=400, cache_blocks=2)
+            chain = Blockchain(state=config)
+            for i in range(5):
+                chain.add_transaction('A', 'B', i)
+                chain.mine_block()
+            hashes = [block.hash for block in chain.chain]
+            self.assertLessEqual(len(chain.chain._recent), 2)
+            chain.close()
+            self.assertGreater(len(os.listdir(path)), 1)
+
+            chain = Blockchain(state=config)
+            self.assertEqual([block.hash for block in chain.chain], hashes)
+            self.assertEqual(chain.chain.get_by_hash(hashes[2]).transactions[0].amount, 1)
+            chain.add_transaction('A', 'B', 9)
+            chain.mine_block()
+            self.assertEqual(chain.chain[-2].hash, hashes[-1])
+            chain.close()
+
+    def test_file_block_store_recovery(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = FileBlockStore(path)
+            for i in range(3):
+                store.append(Block(i, 'ab' * 32, [Transaction('A', 'B', i)]))
+            store.close()
+            segment = os.path.join(path, 'segment-00000.dat')
+            size = os.path.getsize(segment)
+            with open(segment, 'ab') as f:
+                f.write(b'\x00\x00\x01\x00torn')
+            store = FileBlockStore(path)
+            self.assertEqual(len(store), 3)
+            self.assertEqual(os.path.getsize(segment), size)
+            store.truncate(1)
+            self.assertEqual(len(store), 1)
+            store.append(Block(1, 'cd' * 32, []))
+            store.close()
+            store = FileBlockStore(path)
+            self.assertEqual(store[-1].previous_hash, 'cd' * 32)
+            store.close()
+
+    def test_filter_index_persists(self):
+        with tempfile.TemporaryDirectory() as path:
+            config = StateConfig(storage='file', data_dir=path)
+            chain = Blockchain(state=config)
+            for i in range(4):
+                chain.add_transaction('A', 'B', i)
+                chain.mine_block()
+            chain.close()
+
+            filters = FilterIndex(os.path.join(path, 'filters.dat'), cache_size=2)
+            chain = Blockchain(state=config)
+            self.assertEqual(len(filters), len(chain.chain))
+            for block in chain.chain:
+                self.assertEqual(filters.get(block), build_filter(block))
+            self.assertEqual(len(filters.recent), 2)
+            filters.close()
+
+            chain.rollback(2)
+            self.assertEqual(len(chain.filters), 2)
+            chain.add_transaction('A', 'C', 7)
+            chain.mine_block()
+            chain.close()
+            # A store that lost its filter file rebuilds it on open
+            os.remove(os.path.join(path, 'filters.dat'))
+            chain = Blockchain(state=config)
+            self.assertEqual(len(chain.filters), 3)
+            self.assertEqual(chain.filters.get(chain.chain[-1]), build_filter(chain.chain[-1]))
+            chain.close()
+
+    def test_mempool_ordering(self):
+        pool = Mempool()
+        low = Transaction('A', 'B', 1, fee=1, nonce=0)
+        self.assertTrue(pool.add(low))
+        self.assertFalse(pool.add(Transaction('A', 'B', 1, fee=1, nonce=0)))
+        self.assertTrue(pool.add(Transaction('A', 'B', 2, fee=50, nonce=1)))
+        self.assertTrue(pool.add(Transaction('C', 'B', 3, fee=10)))
+        self.assertEqual([tx.amount for tx in pool.select(10 ** 6)], [3, 1, 2])
+        # A higher fee replaces the pending transaction with the same nonce
+        self.assertFalse(pool.add(Transaction('A', 'B', 5, fee=1, nonce=0)))
+        self.assertTrue(pool.add(Transaction('A', 'B', 5, fee=20, nonce=0)))
+        self.assertNotIn(low.txid, pool)
+        self.assertEqual([tx.amount for tx in pool.select(10 ** 6)], [5, 2, 3])
+        self.assertEqual(len(pool.select(len(low.encode()) + 1)), 1)
+
+    def test_mempool_eviction(self):
+        pool = Mempool(max_count=3)
+        for fee in (5, 1, 7):
+            pool.add(Transaction('A', 'B', fee, fee=fee))
+        self.assertFalse(pool.add(Transaction('C', 'D', 1, fee=0)))
+        self.assertTrue(pool.add(Transaction('C', 'D', 1, fee=9)))
+        self.assertEqual(sorted(tx.fee for tx in pool), [5, 7, 9])
+        # A newcomer must outbid every transaction it would displace, descendants included
+        pool = Mempool(max_count=3)
+        pool.add(Transaction('S', 'B', 1, fee=1, nonce=0))
+        pool.add(Transaction('S', 'B', 1, fee=1000, nonce=1))
+        pool.add(Transaction('S', 'B', 1, fee=1000, nonce=2))
+        self.assertFalse(pool.add(Transaction('X', 'B', 1, fee=500)))
+        self.assertTrue(pool.add(Transaction('X', 'B', 1, fee=5000)))
+        self.assertEqual([tx.fee for tx in pool], [5000])
+        # Nonce floods from one sender stay cheap to admit, select and clear
+        pool = Mempool()
+        for i in range(5000):
+            self.assertTrue(pool.add(Transaction('F', 'B', 1, fee=1, nonce=i)))
+        selected = pool.select(10 ** 9)
+        self.assertEqual([tx.nonce for tx in selected], list(range(5000)))
+        pool.remove(tx.txid for tx in selected[:2500])
+        self.assertEqual(pool.select(10 ** 9)[0].nonce, 2500)
+
+    def test_block_assembly_budget(self):
+        chain = Blockchain(block=BlockConfig(size=2000), state=StateConfig(mempool_count=500))
+        for i in range(1000):
+            chain.add_transaction('A', 'B', i, fee=i % 10)
+        self.assertEqual(len(chain.mempool), 500)
+        chain.mine_block()
+        block = chain.chain[-1]
+        self.assertLessEqual(len(block.encode()), 2000)
+        self.assertEqual(block.transactions[0].fee, 9)
+        self.assertEqual(len(chain.mempool), 500 - len(block.transactions))
+
+    def test_account_state_batch(self):
+        rng = random.Random(7)
+        accounts = [f'acct{i}' for i in range(40)]
+        balances = {a: rng.randint(0, 50) for a in accounts}
+        state = AccountState(balances)
+        txs = []
+        for _ in range(500):
+            sender, recipient = rng.sample(accounts, 2)
+            tx = rng.choice([AccountTransaction, TimeLockedTransaction, MultiSigTransaction])
+            if tx is TimeLockedTransaction:
+                tx = tx(sender, recipient, rng.randint(0, 30), time.time() + rng.choice([-10, 10]))
+            elif tx is MultiSigTransaction:
+                tx = tx([sender], 1, sender, recipient, rng.randint(0, 30))
+                tx.add_signature('sig')
+            else:
+                tx = tx(sender, recipient, rng.randint(0, 30))
+            txs.append(tx)
+        expected = []
+        for tx in txs:
+            valid = tx.validate(balances)
+            if valid:
+                tx.apply(balances)
+            expected.append(valid)
+        self.assertEqual(state.apply_block(txs), expected)
+        self.assertEqual(state.to_dict(), balances)
+
+    def test_account_state_vectorized(self):
+        state = AccountState({'A': 10, 'B': 5})
+        txs = [AccountTransaction('A', 'C', 4), AccountTransaction('A', 'D', 6), AccountTransaction('B', 'C', 2.5)]
+        scalar_apply = AccountTransaction.apply
+        with mock.patch.object(AccountTransaction, 'apply', autospec=True, side_effect=scalar_apply) as applied:
+            self.assertEqual(state.apply_block(txs), [True, True, True])
+            # No account conflicts, so every transfer takes the batch path
+            self.assertEqual(applied.call_count, 0)
+            self.assertEqual(state.to_dict(), {'A': 0, 'B': 2.5, 'C': 6.5, 'D': 6})
+            # C both receives and sends here, so its transfers fall back to one at a time
+            txs = [AccountTransaction('D', 'C', 1), AccountTransaction('C', 'A', 7), AccountTransaction('B', 'E', 1)]
+            self.assertEqual(state.apply_block(txs), [True, True, True])
+            self.assertEqual(applied.call_count, 2)
+        self.assertEqual(state.to_dict(), {'A': 7, 'B': 1.5, 'C': 0.5, 'D': 5, 'E': 1})
+
     def test_dpos_consensus(self):
         dpos = DPoSConsensus({'type': 'DPoS', 'params': {'validators': ['A', 'B']}})
         class DummyBlock: pass
@@ -92,6 +501,83 @@ class TestBlockchainFramework(unittest.TestCase):
         utxo_set = tx.apply(utxo_set)
         self.assertIn('B', [v[0] for v in utxo_set.values()])
 
+    def test_parallel_executor(self):
+        rng = random.Random(3)
+        accounts = [f'acct{i}' for i in range(200)]
+        txs = [AccountTransaction(*rng.sample(accounts, 2), rng.randint(0, 20)) for _ in range(2000)]
+        balances = {a: rng.randint(0, 40) for a in accounts}
+        expected_state = dict(balances)
+        expected = []
+        for tx in txs:
+            valid = tx.validate(expected_state)
+            if valid:
+                tx.apply(expected_state)
+            expected.append(valid)
+        for use_processes in (False, True):
+            executor = BlockExecutor(workers=2, use_processes=use_processes, min_parallel=8)
+            try:
+                state = dict(balances)
+                self.assertEqual(executor.execute(txs, state), expected)
+                self.assertEqual(state, expected_state)
+            finally:
+                executor.close()
+        waves = BlockExecutor().schedule([AccountTransaction('A', 'B', 1), AccountTransaction('C', 'D', 1),
+                                          AccountTransaction('B', 'E', 1)])
+        self.assertEqual(waves, [[0, 1], [2]])
+
+        class Airdrop:
+            # Unknown access sets make this a barrier in its own wave
+            def validate(self, state):
+                return True
+
+            def apply(self, state):
+                state['A'] = state.get('A', 0) + 10
+                return state
+
+        executor = BlockExecutor(workers=2, min_parallel=1)
+        # Pure-Python validation only scales across processes under the GIL
+        gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+        self.assertEqual(executor.use_processes, gil)
+        try:
+            state = {'A': 0}
+            self.assertEqual(executor.execute([Airdrop(), AccountTransaction('A', 'B', 5)], state), [True, True])
+            self.assertEqual(state, {'A': 5, 'B': 5})
+        finally:
+            executor.close()
+
+    def test_utxo_set(self):
+        utxos = UTXOSet({('tx0', 0): ('A', 10), ('tx0', 1): ('B', 5)})
+        pay = UTXOTransaction([('tx0', 0)], [('C', 7), ('A', 3)])
+        change = UTXOTransaction([(pay.txid, 1)], [('D', 3)])
+        self.assertTrue(utxos.connect_block([pay, change]))
+        self.assertEqual(utxos.balance('A'), 0)
+        self.assertEqual(utxos.balance('C'), 7)
+        self.assertEqual(utxos.balance('D'), 3)
+        self.assertEqual(utxos.unspent('C'), [((pay.txid, 0), 7)])
+        # Double spend inside one block, and a spend of an already spent output
+        respend = UTXOTransaction([('tx0', 1)], [('E', 5)])
+        twice = UTXOTransaction([('tx0', 1)], [('F', 5)])
+        self.assertFalse(utxos.validate_block([respend, twice]))
+        self.assertFalse(utxos.connect_block([UTXOTransaction([('tx0', 0)], [('E', 10)])]))
+        utxos.disconnect_block()
+        self.assertEqual(utxos.balance('A'), 10)
+        self.assertEqual(utxos.balance('C'), 0)
+        self.assertEqual(len(utxos), 2)
+        # Identical outputs in the same second no longer overwrite each other
+        first = UTXOTransaction([('tx0', 0)], [('C', 10)])
+        second = UTXOTransaction([('tx0', 1)], [('C', 5)])
+        self.assertTrue(utxos.connect_block([first, second]))
+        self.assertEqual(utxos.balance('C'), 15)
+        # An input-less tx repeated in a later block would overwrite its live output
+        mint = UTXOTransaction([], [('M', 50)])
+        self.assertTrue(utxos.connect_block([mint]))
+        self.assertFalse(utxos.connect_block([UTXOTransaction([], [('M', 50)])]))
+        self.assertFalse(utxos.validate_block([mint, UTXOTransaction([], [('M', 50)])]))
+        # Once spent, the same outpoint may be created again
+        self.assertTrue(utxos.connect_block([UTXOTransaction([(mint.txid, 0)], [('N', 50)]), mint]))
+        utxos.disconnect_block()
+        self.assertEqual(utxos.unspent('M'), [((mint.txid, 0), 50)])
+
     def test_account_transaction(self):
         balances = {'A': 10, 'B': 0}
         tx = AccountTransaction('A', 'B', 5)
@@ -100,16 +586,52 @@ class TestBlockchainFramework(unittest.TestCase):
         self.assertEqual(balances['A'], 5)
         self.assertEqual(balances['B'], 5)
 
+    @requires_crypto
     def test_multisig_transaction(self):
         balances = {'A': 10, 'B': 0}
-        tx = MultiSigTransaction(['A', 'C'], 2, 'A', 'B', 5)
-        tx.add_signature('sigA')
-        tx.add_signature('sigC')
+        key_a, pub_a = generate_keypair()
+        key_c, pub_c = generate_keypair()
+        tx = MultiSigTransaction([pub_a, pub_c], 2, 'A', 'B', 5)
+        tx.sign(key_a)
+        self.assertFalse(tx.validate(balances))
+        tx.add_signature(b'\x00' * 64)
+        self.assertFalse(tx.validate(balances))
+        tx.signatures.pop()
+        tx.sign(key_c)
         self.assertTrue(tx.validate(balances))
         balances = tx.apply(balances)
         self.assertEqual(balances['A'], 5)
         self.assertEqual(balances['B'], 5)
 
+    @requires_crypto
+    def test_signature_verifier(self):
+        verifier = SignatureVerifier(workers=2, min_parallel=4)
+        try:
+            txs = []
+            for i in range(6):
+                key, pub = generate_keypair()
+                tx = MultiSigTransaction([pub], 1, 'A', 'B', i)
+                tx.sign(key)
+                txs.append(tx)
+            txs[0].amount = 99  # invalidates its signature
+            items = [item for tx in txs for item in tx.signature_items()]
+            self.assertEqual(verifier.verify_batch(items), [False] + [True] * 5)
+            verifier.prefetch(txs)
+            self.assertEqual(verifier.cache.hits, 6)
+        finally:
+            verifier.close()
+        # Mempool admission warms the shared cache used again at block validation
+        key, pub = generate_keypair()
+        tx = MultiSigTransaction([pub], 1, 'A', 'B', 1)
+        tx.sign(key)
+        pool = Mempool()
+        self.assertTrue(pool.add(tx))
+        hits = crypto.default_verifier.cache.hits
+        self.assertTrue(tx.validate({'A': 5}))
+        self.assertEqual(crypto.default_verifier.cache.hits, hits + 1)
+        unsigned = MultiSigTransaction([pub], 1, 'A', 'B', 2)
+        self.assertFalse(pool.add(unsigned))
+
     def test_atomic_swap_transaction(self):
         balances = {'A': 10, 'B': 0}
         expiry = time.time() + 100
@@ -137,21 +659,175 @@ class TestBlockchainFramework(unittest.TestCase):
         gossip.broadcast('hello')
         self.assertIn('node1', nd.get_peers())
 
+    def test_gossip_requests_are_bounded(self):
+        now = [0.0]
+        sent = []
+        gossip = GossipProtocol(NodeDiscovery(), send=lambda peer, msg: sent.append(msg), seen_size=10,
+                                request_timeout=5.0, clock=lambda: now[0])
+        gossip.receive('spammer', ('inv', [f'id{i}' for i in range(100)]))
+        self.assertEqual(len(sent[0][1]), 100)
+        self.assertEqual(len(gossip.requested), 10)
+        now[0] = 6.0
+        gossip.receive('peer', ('inv', ['fresh']))
+        self.assertEqual(list(gossip.requested), ['fresh'])
+
+    def test_gossip_inventory_mesh(self):
+        rng = random.Random(7)
+        names = [f'n{i}' for i in range(40)]
+        queue = []
+        nodes = {}
+        for name in names:
+            nd = NodeDiscovery()
+            nodes[name] = GossipProtocol(nd, send=lambda peer, msg, src=name: queue.append((src, peer, msg)),
+                                         fanout=3, rng=rng)
+        for i, name in enumerate(names):
+            for other in rng.sample(names, 4) + [names[(i + 1) % len(names)]]:
+                if other != name:
+                    nodes[name].node_discovery.add_peer(other)
+                    nodes[other].node_discovery.add_peer(name)
+
+        def pump():
+            while queue:
+                src, dst, msg = queue.pop(0)
+                nodes[dst].receive(src, msg)
+
+        payload = b'block' * 1000
+        msg_id = nodes['n0'].broadcast(payload)
+        pump()
+        for _ in range(20):
+            if all(msg_id in node.seen for node in nodes.values()):
+                break
+            for node in nodes.values():
+                node.pull_round()
+            pump()
+        self.assertTrue(all(node.payloads.get(msg_id) == payload for node in nodes.values()))
+        # Payloads travel once per node; redundancy is confined to 32-byte announcements
+        self.assertEqual(sum(node.stats['delivered'] for node in nodes.values()), len(nodes))
+        self.assertEqual(sum(node.stats['duplicates'] for node in nodes.values()), 0)
+        self.assertGreater(sum(node.stats['known_inv'] for node in nodes.values()), 0)
+        self.assertFalse(nodes['n0'].seen.add(msg_id))
+
+    def test_seen_cache_bounds(self):
+        now = [0.0]
+        seen = SeenCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        self.assertTrue(seen.add('a'))
+        self.assertFalse(seen.add('a'))
+        seen.add('b')
+        seen.add('c')
+        self.assertNotIn('a', seen)
+        now[0] = 11
+        self.assertNotIn('c', seen)
+        self.assertTrue(seen.add('c'))
+
     def test_dht_protocol(self):
         dht = DHTProtocol()
         dht.put('key', 'value')
         self.assertEqual(dht.get('key'), 'value')
 
+    def test_dht_kademlia_lookups(self):
+        async def scenario():
+            nodes = [DHTProtocol(k=8, alpha=3, timeout=0.5, republish_interval=None) for _ in range(200)]
+            for node in nodes:
+                await node.start()
+            try:
+                for node in nodes[1:]:
+                    await node.bootstrap([nodes[0].address])
+                stored = await nodes[17].publish('block:42', {'hash': 'abc'})
+                self.assertGreaterEqual(stored, 8)
+                hops = []
+                for node in nodes[100:150]:
+                    self.assertEqual(await node.find_value('block:42'), {'hash': 'abc'})
+                    hops.append(node.last_hops)
+                self.assertLessEqual(max(hops), 8)
+                # The k closest ids found by lookup match a brute-force search
+                target = key_id('some-node')
+                found = [contact for contact, _ in await nodes[3].find_node(target)]
+                expected = sorted((node.id for node in nodes if node is not nodes[3]), key=lambda i: i ^ target)[:8]
+                self.assertEqual(found, expected)
+                self.assertIsNone(await nodes[60].find_value('missing'))
+            finally:
+                for node in nodes:
+                    node.stop()
+        asyncio.run(scenario())
+
+    def test_dht_rpc_cancellation(self):
+        async def scenario():
+            node = DHTProtocol(timeout=30, republish_interval=None)
+            await node.start()
+            silent = DHTProtocol(timeout=30, republish_interval=None)
+            await silent.start()
+            silent.stop()
+            # A cancelled caller stays cancelled instead of reading as a timeout
+            task = asyncio.ensure_future(node.ping(silent.address))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # Stopping the node releases RPCs still waiting for replies
+            task = asyncio.ensure_future(node.ping(silent.address))
+            await asyncio.sleep(0.05)
+            node.stop()
+            self.assertFalse(await asyncio.wait_for(task, 1))
+        asyncio.run(scenario())
+
     def test_sharding(self):
         sharding = Sharding(num_shards=2)
         shard = sharding.get_shard('key')
         self.assertIsInstance(shard, dict)
 
+    def test_consistent_hash_resharding(self):
+        sharding = Sharding(num_shards=8)
+        keys = [f'acct{i}' for i in range(5000)]
+        for key in keys:
+            sharding.put(key, key.upper())
+        # Placement is a pure function of the key and shard set
+        self.assertTrue(all(Sharding(num_shards=8).shard_for(key) == sharding.shard_for(key) for key in keys[:200]))
+        moves = sharding.add_shard()
+        self.assertTrue(all(dst == 8 for _, _, dst in moves))
+        self.assertLess(len(moves), len(keys) * 0.2)
+        self.assertEqual(len(sharding.shards[8]), len(moves))
+        self.assertTrue(all(sharding.get(key) == key.upper() for key in keys))
+        owned = set(sharding.shards[3])
+        moves = sharding.remove_shard(3)
+        self.assertEqual({key for key, _, _ in moves}, owned)
+        self.assertEqual(sum(len(shard) for shard in sharding.shards.values()), len(keys))
+        self.assertTrue(all(sharding.get(key) == key.upper() for key in keys))
+
+        txs = [AccountTransaction(f'acct{i}', f'acct{i + 1}', 1) for i in range(100)]
+        local, cross = sharding.route(txs)
+        self.assertEqual(sum(map(len, local.values())) + len(cross), 100)
+        for tx, shards in cross:
+            self.assertEqual(shards, sorted({sharding.shard_for(tx.sender), sharding.shard_for(tx.recipient)}))
+
     def test_mesh_network(self):
         mesh = MeshNetwork()
         mesh.connect('A', 'B')
         self.assertIn('B', mesh.get_connections('A'))
 
+    def test_propagation_simulator(self):
+        fast = Simulator(build_sim_mesh(), latency=0.05, block_interval=10, tx_rate=1, seed=1).run(200)
+        # Same seed, same report, whatever the process's string hash seed
+        script = ('import json, sys; from pychain.tests.test_blockchain import build_sim_mesh; '
+                  'from pychain.simulator import Simulator; '
+                  'report = Simulator(build_sim_mesh(), latency=0.05, block_interval=10, tx_rate=1, seed=1).run(200); '
+                  'sys.stdout.write("\\n" + json.dumps(report))')
+        for hash_seed in ('1', '2', '3'):
+            env = dict(os.environ, PYTHONHASHSEED=hash_seed, PYTHONPATH=os.pathsep.join(sys.path))
+            output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                    check=True).stdout
+            self.assertEqual(json.loads(output.splitlines()[-1]), fast)
+        self.assertGreater(fast['blocks_mined'], 5)
+        self.assertGreater(fast['propagation_p50'], 0)
+        self.assertLessEqual(fast['propagation_p50'], fast['propagation_p99'])
+        self.assertGreater(fast['bytes_per_node'], 0)
+        slow = Simulator(build_sim_mesh(), latency=2.0, block_interval=2, seed=1).run(200)
+        self.assertGreater(slow['orphan_rate'], fast['orphan_rate'])
+        # Sequential nonces let one sender fill a block with many transactions
+        busy = Simulator(build_sim_mesh(), block_interval=10, tx_rate=20, seed=1)
+        busy.run(60)
+        chain = busy.nodes['n0'].chain.chain
+        self.assertGreater(max(len(chain[h].transactions) for h in range(1, len(chain))), 15)
+
     def test_lightning_network(self):
         ln = LightningNetwork()
         ln.open_channel('A', 'B', 10)
@@ -159,6 +835,54 @@ class TestBlockchainFramework(unittest.TestCase):
         ln.close_channel('A', 'B')
         self.assertIsNone(ln.get_channel('A', 'B'))
 
+    def test_lightning_routing(self):
+        ln = LightningNetwork()
+        ln.open_channel('A', 'B', 100)
+        ln.open_channel('B', 'C', 100)
+        ln.open_channel('A', 'D', 100)
+        ln.open_channel('D', 'C', 100)
+        ln.set_fees('B', 'C', base=5)
+        ln.set_fees('D', 'C', base=1, ppm=10000)
+        self.assertEqual(ln.get_channel('C', 'B'), 100)
+        route = ln.find_route('A', 'C', 50)
+        self.assertEqual(route.path, ['A', 'D', 'C'])
+        self.assertEqual(route.fee, 1)
+        self.assertIs(ln.find_route('A', 'C', 50), route)
+        # Balances are directional: C has nothing to send back yet
+        self.assertIsNone(ln.find_route('C', 'A', 10))
+        ln.pay('A', 'C', 50)
+        self.assertEqual(ln.channels[frozenset('DC')].balances['C'], 50)
+        self.assertIsNotNone(ln.find_route('C', 'A', 10))
+        # Cache entry was invalidated by the payment; D-C now prefers B
+        self.assertEqual(ln.find_route('A', 'C', 50).path, ['A', 'B', 'C'])
+        # 120 exceeds any single route, so it is split across both
+        routes = ln.pay('A', 'C', 120)
+        self.assertGreater(len(routes), 1)
+        self.assertEqual(sum(route.amount for route in routes), 120)
+        self.assertIsNone(ln.pay('A', 'C', 500))
+
+    def test_lightning_cache_and_hop_limit(self):
+        ln = LightningNetwork(max_hops=3)
+        ln.open_channel('S', 'X', 100)
+        ln.open_channel('X', 'T', 100)
+        ln.set_fees('X', 'T', base=10)
+        self.assertEqual(ln.find_route('S', 'T', 10).path, ['S', 'X', 'T'])
+        # A new cheaper path replaces the cached one
+        ln.open_channel('S', 'Y', 100)
+        ln.open_channel('Y', 'T', 100)
+        self.assertEqual(ln.find_route('S', 'T', 10).path, ['S', 'Y', 'T'])
+        ln.set_fees('Y', 'T', base=20)
+        self.assertEqual(ln.find_route('S', 'T', 10).path, ['S', 'X', 'T'])
+        # From M the free four-hop path to P is cheapest; from S it is one hop
+        # too long, and the shorter paid path through R must still be found
+        ln = LightningNetwork(max_hops=4)
+        for a, b in (('M', 'N'), ('N', 'O'), ('O', 'Q'), ('Q', 'P'), ('M', 'R'), ('R', 'P'), ('S', 'M')):
+            ln.open_channel(a, b, 100)
+        ln.set_fees('R', 'P', base=5)
+        self.assertEqual(ln.find_route('M', 'P', 10).path, ['M', 'N', 'O', 'Q', 'P'])
+        route = ln.find_route('S', 'P', 10)
+        self.assertEqual((route.path, route.fee), (['S', 'M', 'R', 'P'], 5))
+
     def test_rest_api(self):
         # Only test instantiation, not actual server run
         class DummyChain:
@@ -167,6 +891,61 @@ class TestBlockchainFramework(unittest.TestCase):
         api = RESTAPI(DummyChain())
         self.assertIsNotNone(api)
 
+    def test_rest_api_pagination_and_caching(self):
+        chain = Blockchain()
+        for i in range(30):
+            chain.add_transaction('alice', 'bob', i + 1, nonce=i)
+            chain.mine_block()
+        api = RESTAPI(chain, page_size=10, finality=6)
+        client = api.app.test_client()
+        heights = []
+        response = client.get('/chain')
+        while True:
+            page = response.get_json()
+            heights += [block['index'] for block in page['blocks']]
+            if page['next_cursor'] is None:
+                break
+            response = client.get('/chain', query_string={'cursor': page['next_cursor']})
+        self.assertEqual(heights, list(range(31)))
+        self.assertEqual(client.get('/chain?start=5&limit=3').get_json()['blocks'][0]['index'], 5)
+        self.assertEqual(client.get('/chain?limit=x').status_code, 400)
+
+        old = client.get('/blocks/3')
+        self.assertEqual(old.get_json()['hash'], chain.chain[3].hash)
+        self.assertIn('immutable', old.headers['Cache-Control'])
+        self.assertIn(chain.chain[3].hash, api.encoded)
+        self.assertEqual(client.get('/blocks/3', headers={'If-None-Match': old.headers['ETag']}).status_code, 304)
+        tip = client.get(f'/blocks/hash/{chain.chain[-1].hash}')
+        self.assertEqual(tip.get_json()['index'], 30)
+        self.assertNotIn('immutable', tip.headers['Cache-Control'])
+        self.assertEqual(client.get('/blocks/99').status_code, 404)
+
+        cursor = client.get('/chain?start=20&limit=5').get_json()['next_cursor']
+        chain.chain.truncate(20)
+        chain.mine_block()
+        self.assertEqual(client.get('/chain', query_string={'cursor': cursor}).status_code, 410)
+        lines = client.get('/chain/export?start=10').data.splitlines()
+        self.assertEqual([json.loads(line)['index'] for line in lines], list(range(10, 21)))
+        self.assertEqual(client.get('/chain/export?start=-1').status_code, 400)
+
+        # Concurrent requests share the encoded-block cache
+        api = RESTAPI(chain, finality=6, cache_size=4)
+        errors = []
+
+        def fetch(offset):
+            try:
+                for height in range(50):
+                    api.encode_block(chain.chain[(height + offset) % 15])
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=fetch, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(api.encoded), 4)
+
     def test_cli_api(self):
         class DummyChain:
             def mine_block(self): pass
@@ -203,5 +982,680 @@ class TestBlockchainFramework(unittest.TestCase):
         softfork.add_restriction('rule')
         self.assertIn('rule', softfork.restrictions)
 
+    def _wait_for(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def test_node_transport_relays_blocks_and_transactions(self):
+        chains = [Blockchain(initial_nodes=['127.0.0.1:0']) for _ in range(3)]
+        try:
+            for chain in chains:
+                chain.node.start()
+            # Line topology a - b - c: c only hears about a's block through b
+            a, b, c = chains
+            b.node.add_peer(a.node.address)
+            c.node.add_peer(b.node.address)
+            self.assertTrue(self._wait_for(lambda: b.node.address in a.node.peers and c.node.address in b.node.peers))
+            txid = c.add_transaction('alice', 'bob', 5, fee=1)
+            self.assertTrue(self._wait_for(lambda: txid in a.mempool))
+            a.mine_block()
+            self.assertTrue(self._wait_for(lambda: len(c.chain) == 2))
+            self.assertEqual(c.chain[-1].hash, a.chain[-1].hash)
+            self.assertEqual(len(c.mempool), 0)
+        finally:
+            for chain in chains:
+                chain.close()
+
+    def test_node_rejects_malformed_frames(self):
+        async def parse(data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await read_frame(reader)
+
+        self.assertEqual(asyncio.run(parse(encode_frame('tx', b'abc'))), ('tx', b'abc'))
+        for data in (b'\x00\x00\x00\x00\x00', b'\x00\x00\x00\x02\x05ab'):
+            with self.assertRaises(ConnectionError):
+                asyncio.run(parse(data))
+
+        node = Node('127.0.0.1:0')
+        with self.assertRaises(RuntimeError):
+            node.send('127.0.0.1:1', 'json', b'{}')
+        node.add_peer('127.0.0.1:1')
+        node.start()
+        links = list(node.links.values())
+        node.stop()
+        self.assertTrue(all(link.task.done() for link in links))
+        with self.assertRaises(RuntimeError):
+            node.send('127.0.0.1:1', 'json', b'{}')
+
+    def test_node_reconnects_to_late_peer(self):
+        late = Node('127.0.0.1:0')
+        late.start()
+        address = late.address
+        late.stop()
+        received = []
+        sender = Node('127.0.0.1:0', initial_backoff=0.05)
+        sender.add_peer(address)
+        sender.start()
+        try:
+            sender.broadcast({'msg': 'hello'})
+            # Peer comes back on the same port; the queued frame is delivered
+            late = Node(address)
+            late.on('json', lambda payload, peer: received.append(payload))
+            late.start()
+            self.assertTrue(self._wait_for(lambda: received))
+            self.assertEqual(received[0], b'{"msg": "hello"}')
+        finally:
+            sender.stop()
+            late.stop()
+
+    def test_headers_first_sync(self):
+        source = Blockchain(name='source')
+        for i in range(300):
+            source.add_transaction(f'user{i % 7}', f'user{i % 11}', i + 1, fee=1)
+            source.mine_block()
+        target = Blockchain(name='target')
+        # A stale local fork that the longer peer chain must replace
+        target.add_transaction('mallory', 'mallory', 1)
+        target.mine_block()
+        slow_peer = LocalPeer(source, latency=0.01, bandwidth=200000)
+        fast_peer = LocalPeer(source, latency=0.002)
+        dead_peer = LocalPeer(source, latency=60)
+        sync = ChainSync(target, [slow_peer, fast_peer, dead_peer], window=8, timeout=0.3)
+        connected = asyncio.run(sync.sync())
+        self.assertEqual(connected, 300)
+        self.assertEqual([block.hash for block in target.chain], [block.hash for block in source.chain])
+        scores = {state.peer: state for state in sync.peers}
+        self.assertGreaterEqual(scores[dead_peer].failures, 1)
+        self.assertEqual(scores[dead_peer].blocks, 0)
+        self.assertGreater(scores[fast_peer].blocks, scores[slow_peer].blocks)
+        self.assertEqual(asyncio.run(ChainSync(target, [fast_peer]).sync()), 0)
+        self.assertGreater(scores[fast_peer].throughput, scores[slow_peer].throughput)
+
+    def test_sync_keeps_chain_when_peer_withholds_bodies(self):
+        local = Blockchain(name='local')
+        for i in range(5):
+            local.add_transaction('alice', 'bob', i + 1, nonce=i)
+            local.mine_block()
+        other = Blockchain(name='other')
+        for i in range(8):
+            other.add_transaction('carol', 'dave', i + 1, nonce=i)
+            other.mine_block()
+
+        class Withholding(LocalPeer):
+            async def get_blocks(self, start, count):
+                return []
+
+        before = [block.hash for block in local.chain]
+        with self.assertRaises(ConnectionError):
+            asyncio.run(ChainSync(local, [Withholding(other)], timeout=0.2).sync())
+        self.assertEqual([block.hash for block in local.chain], before)
+        # An honest peer with the same branch does replace ours
+        self.assertEqual(asyncio.run(ChainSync(local, [LocalPeer(other)]).sync()), 8)
+        self.assertEqual(local.chain[-1].hash, other.chain[-1].hash)
+
+    def test_sync_penalizes_malformed_data(self):
+        source = Blockchain(name='source')
+        for i in range(40):
+            source.add_transaction('alice', 'bob', i + 1, nonce=i)
+            source.mine_block()
+
+        class Garbage(LocalPeer):
+            async def get_blocks(self, start, count):
+                raws = await super().get_blocks(start, count)
+                # Truncated bodies, and more of them than were asked for
+                return [raw[:len(raw) // 2] for raw in raws] + [b'\x01\x02'] * 50
+
+        class Oversupply(LocalPeer):
+            async def get_blocks(self, start, count):
+                return await super().get_blocks(start, count + 100)
+
+        target = Blockchain(name='target')
+        garbage, extra = Garbage(source), Oversupply(source)
+        sync = ChainSync(target, [garbage, extra, LocalPeer(source)], window=4, timeout=0.5)
+        self.assertEqual(asyncio.run(sync.sync()), 40)
+        self.assertEqual(target.chain[-1].hash, source.chain[-1].hash)
+        scores = {state.peer: state for state in sync.peers}
+        self.assertGreaterEqual(scores[garbage].failures, 1)
+        self.assertEqual(scores[garbage].blocks, 0)
+
+        class BadHeaders(LocalPeer):
+            async def get_headers(self, start, count):
+                headers = await super().get_headers(start, count)
+                return headers[:10] + [b'\x01\x02'] if count > 1 else headers
+
+        # Headers up to the garbage are used; the rest of the chain is left for later
+        target = Blockchain(name='target')
+        sync = ChainSync(target, [BadHeaders(source)], window=4, timeout=0.5)
+        self.assertEqual(asyncio.run(sync.sync()), 10)
+        self.assertEqual(sync.peers[0].failures, 1)
+
+        class Rejecting:
+            def validate_block(self, block, chain):
+                return block.index != 5
+
+        # A block failing validation ends the sync without leaving workers running
+        async def failing_sync():
+            target = Blockchain(name='target')
+            target.consensus = Rejecting()
+            with self.assertRaises(ValueError):
+                await ChainSync(target, [LocalPeer(source, latency=0.01), LocalPeer(source)], window=2).sync()
+            return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        self.assertEqual(asyncio.run(failing_sync()), [])
+
+    def test_light_client_filters_and_proofs(self):
+        full = Blockchain(name='full')
+        users = [f'user{i}' for i in range(20)]
+        expected = 0
+        for height in range(60):
+            for j in range(5):
+                sender, recipient = users[(height + j) % 20], users[(height * 3 + j + 1) % 20]
+                amount, fee = height + j + 1, j
+                full.add_transaction(sender, recipient, amount, fee=fee, nonce=height * 5 + j)
+                expected += (amount if recipient == 'user7' else 0) - (amount + fee if sender == 'user7' else 0)
+            full.mine_block()
+        block = full.chain[10]
+        compact = BlockFilter(full.filters.get(block), block.hash)
+        self.assertTrue(compact.match_any({block.transactions[0].sender.encode()}))
+        self.assertFalse(compact.match_any({f'stranger{i}'.encode() for i in range(50)}))
+
+        client = LightClient(LocalPeer(full))
+        self.assertEqual(asyncio.run(client.sync_headers(batch=25)), 61)
+        self.assertEqual(client.block_hash(60), full.chain[60].hash)
+        self.assertEqual(len(client.headers), 61 * 96)
+        self.assertEqual(asyncio.run(client.balance({'user7'})), expected)
+        tx = asyncio.run(client.verify_transaction(30, 2))
+        self.assertEqual(tx.txid, full.chain[30].transactions[2].txid)
+
+        class LyingPeer(LocalPeer):
+            async def get_proof(self, height, position):
+                raw, size, proof = await super().get_proof(height, position)
+                return raw, size, proof[::-1]
+        liar = LightClient(LyingPeer(full))
+        asyncio.run(liar.sync_headers())
+        with self.assertRaises(ValueError):
+            asyncio.run(liar.verify_transaction(30, 2))
+
+    def test_verify_chain(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            chain = Blockchain(state=StateConfig(storage='file', data_dir=tmp, segment_size=16 * 1024))
+            for i in range(200):
+                chain.add_transaction('alice', 'bob', i + 1, nonce=i)
+                chain.mine_block()
+            self.assertIsNone(chain.verify_chain(workers=2, span_size=30))
+            self.assertIsNone(chain.verify_chain(workers=1, full=True))
+            # Flip a byte of block 120's header on disk
+            store = chain.chain
+            path = store._segment_path(store._segment[120])
+            with open(path, 'r+b') as f:
+                f.seek(store._offset[120] + 60)
+                byte = f.read(1)
+                f.seek(-1, os.SEEK_CUR)
+                f.write(bytes([byte[0] ^ 0xFF]))
+            self.assertEqual(chain.verify_chain(workers=2, span_size=30), 120)
+            self.assertIsNone(chain.verify_chain(checkpoint=chain.chain[150].hash, workers=2, span_size=30))
+            chain.close()
+
+        chain = Blockchain()
+        for i in range(50):
+            chain.mine_block()
+        chain.chain[30].header.previous_hash = '00' * 32
+        self.assertEqual(chain.verify_chain(span_size=16), 30)
+
+    def test_explorer_index_and_reorg(self):
+        chain = Blockchain()
+        for i in range(10):
+            chain.add_transaction('alice', f'shop{i % 3}', i + 1, nonce=i)
+            chain.mine_block()
+        with tempfile.TemporaryDirectory() as tmp:
+            explorer = ExplorerAPI(chain, path=os.path.join(tmp, 'index.db'))
+            mode = explorer.index.db.execute('PRAGMA journal_mode').fetchone()[0]
+            self.assertEqual(mode, 'wal')
+            for i in range(10, 20):
+                chain.add_transaction('alice', f'shop{i % 3}', i + 1, nonce=i)
+                chain.mine_block()
+            self.assertEqual(explorer.index.height, 20)
+            first = explorer.address_history('alice', limit=15)
+            self.assertEqual(len(first['transactions']), 15)
+            self.assertEqual(first['transactions'][0]['height'], 20)
+            rest = explorer.address_history('alice', limit=15, before=first['next'])
+            self.assertEqual(len(rest['transactions']), 5)
+            txid = chain.chain[12].transactions[0].txid
+            self.assertEqual(explorer.transaction(txid)['height'], 12)
+            client = explorer.app.test_client()
+            self.assertEqual(client.get(f'/tx/{txid}').get_json()['tx']['amount'], 12)
+            self.assertEqual(len(client.get('/address/shop1').get_json()['transactions']), 7)
+            for limit in (0, -1):
+                self.assertEqual(client.get(f'/address/alice?limit={limit}').status_code, 400)
+            # The cursor an HTTP client gets back is one it can pass on
+            page = client.get('/address/alice?limit=15').get_json()
+            page = client.get(f"/address/alice?limit=15&before={page['next']}").get_json()
+            self.assertEqual(page['transactions'], rest['transactions'])
+            self.assertEqual(client.get('/address/alice?before=12').status_code, 400)
+
+            chain.rollback(15)
+            self.assertEqual(explorer.index.height, 14)
+            self.assertIsNone(explorer.transaction(chain.mempool.select(10 ** 6)[0].txid))
+            self.assertEqual(len(explorer.address_history('alice', limit=100)['transactions']), 14)
+            chain.mine_block()
+            self.assertEqual(explorer.index.block(15)['hash'], chain.chain[15].hash)
+            explorer.index.close()
+            # A fresh index over the same file catches up without duplicating rows
+            reopened = ExplorerIndex(os.path.join(tmp, 'index.db'))
+            reopened.catch_up(chain.chain)
+            self.assertEqual(len(reopened.history('alice', limit=100)), len(chain.chain[15].transactions) + 14)
+            reopened.close()
+
+        # A replayed transaction keeps its first location when the replay is disconnected
+        index = ExplorerIndex()
+        replayed = Transaction('mallory', 'bob', 5)
+        first = Block(0, '00' * 32, [replayed])
+        second = Block(1, first.hash, [Transaction('carol', 'dave', 1), replayed])
+        index.on_block_accepted(first)
+        index.on_block_accepted(second)
+        self.assertEqual(index.locate(replayed.txid), (0, 0))
+        self.assertEqual(len(index.history('mallory')), 2)
+        index.on_block_disconnected(second)
+        self.assertEqual(index.locate(replayed.txid), (0, 0))
+        index.close()
+
+    @unittest.skipIf(api.websockets is None, 'websockets not installed')
+    def test_websocket_subscriptions(self):
+        chain = Blockchain()
+        ws_api = WebSocketAPI(chain, port=0)
+
+        async def scenario():
+            await ws_api.start_async()
+            url = f'ws://127.0.0.1:{ws_api.port}'
+            async with api.websockets.connect(url) as heads, api.websockets.connect(url) as wallet:
+                await heads.send(json.dumps({'subscribe': 'newHeads'}))
+                await wallet.send(json.dumps({'subscribe': 'address', 'address': 'alice'}))
+                await wallet.send(json.dumps({'subscribe': 'pendingTx'}))
+                await wallet.send(json.dumps({'subscribe': 'nope'}))
+                self.assertEqual(json.loads(await heads.recv()), {'subscribed': 'newHeads'})
+                for _ in range(2):
+                    self.assertIn('subscribed', json.loads(await wallet.recv()))
+                self.assertIn('error', json.loads(await wallet.recv()))
+                chain.add_transaction('alice', 'bob', 5)
+                chain.mine_block()
+                pending = json.loads(await asyncio.wait_for(wallet.recv(), 5))
+                self.assertEqual(pending['topic'], 'pendingTx')
+                self.assertEqual(pending['data']['amount'], 5)
+                head = json.loads(await asyncio.wait_for(heads.recv(), 5))
+                self.assertEqual((head['data']['index'], head['data']['tx_count']), (1, 1))
+                touched = json.loads(await asyncio.wait_for(wallet.recv(), 5))
+                self.assertEqual((touched['address'], touched['data'][0]['height']), ('alice', 1))
+            await ws_api.stop_async()
+
+        asyncio.run(scenario())
+        self.assertEqual(ws_api.stats['encoded'], 3)
+        self.assertEqual(ws_api.subscribers, set())
+
+    def test_websocket_slow_subscriber_policies(self):
+        async def scenario():
+            dropping = Subscriber(None, queue_size=2, policy='drop')
+            for message in ('a', 'b', 'c'):
+                self.assertTrue(dropping.offer(message))
+            self.assertEqual((dropping.dropped, dropping.queue.get_nowait()), (1, 'b'))
+            strict = Subscriber(None, queue_size=2, policy='disconnect')
+            self.assertTrue(strict.offer('a') and strict.offer('b'))
+            self.assertFalse(strict.offer('c'))
+
+        asyncio.run(scenario())
+
+    @unittest.skipIf(api.websockets is None, 'websockets not installed')
+    def test_websocket_failed_send_unsubscribes(self):
+        ws_api = WebSocketAPI(Blockchain(), port=0)
+
+        class BrokenSocket:
+            def __init__(self):
+                self.closed = asyncio.Event()
+                self.close_code = None
+
+            async def __aiter__(self):
+                yield json.dumps({'subscribe': 'newHeads'})
+                await self.closed.wait()
+
+            async def send(self, message):
+                raise OSError('connection reset')
+
+            async def close(self, code, reason):
+                self.close_code = code
+                self.closed.set()
+
+        async def scenario():
+            socket = BrokenSocket()
+            await asyncio.wait_for(ws_api._serve(socket), 5)
+            return socket.close_code
+
+        with mock.patch('builtins.print') as printed:
+            self.assertEqual(asyncio.run(scenario()), 1011)
+        self.assertIn('connection reset', printed.call_args[0][0])
+        self.assertEqual(ws_api.subscribers, set())
+        self.assertEqual(ws_api.by_topic['newHeads'], set())
+
+    def test_json_rpc_batches_and_cache(self):
+        chain = Blockchain()
+        for i in range(10):
+            chain.mine_block()
+        rpc = RPCAPI(chain, workers=4, finality=3)
+        client = rpc.app.test_client()
+
+        def call(payload):
+            return client.post('/', data=json.dumps(payload), content_type='application/json')
+
+        single = call({'jsonrpc': '2.0', 'method': 'getBlockCount', 'id': 1}).get_json()
+        self.assertEqual(single, {'jsonrpc': '2.0', 'result': 11, 'id': 1})
+        batch = [{'jsonrpc': '2.0', 'method': 'getBlock', 'params': [h], 'id': h} for h in range(11)]
+        batch += [
+            {'jsonrpc': '2.0', 'method': 'getBlockByHash', 'params': {'block_hash': chain.chain[4].hash}, 'id': 'h'},
+            {'jsonrpc': '2.0', 'method': 'nope', 'id': 'm'},
+            {'jsonrpc': '2.0', 'method': 'getBlock', 'params': [1, 2], 'id': 'p'},
+            {'jsonrpc': '2.0', 'method': 'getBlockCount'},
+            'junk',
+        ]
+        replies = call(batch).get_json()
+        self.assertEqual(len(replies), len(batch) - 1)
+        self.assertEqual([r['result']['index'] for r in replies[:11]], list(range(11)))
+        self.assertEqual(replies[11]['result']['hash'], chain.chain[4].hash)
+        self.assertEqual([r['error']['code'] for r in replies[12:]], [-32601, -32602, -32600])
+        # Blocks 0-7 (and block 4 by hash) are final and cached; the three near the tip are not
+        self.assertEqual(len(rpc.cache), 9)
+        call(batch[:11])
+        self.assertEqual(rpc.stats['cache_hits'], 8)
+        self.assertEqual(call({'jsonrpc': '2.0', 'method': 'getBlockCount'}).status_code, 204)
+        self.assertEqual(client.post('/', data='{').get_json()['error']['code'], -32700)
+        for params in (['3'], [1.5], [True], [None]):
+            reply = call({'jsonrpc': '2.0', 'method': 'getBlock', 'params': params, 'id': 9}).get_json()
+            self.assertEqual(reply['error']['code'], -32602)
+        reply = call({'jsonrpc': '2.0', 'method': 'sendTransaction', 'id': 9,
+                      'params': {'sender': 'a', 'recipient': 'b', 'amount': 'lots'}}).get_json()
+        self.assertEqual(reply['error']['code'], -32602)
+
+        txs = [{'sender': 'alice', 'recipient': 'bob', 'amount': i + 1, 'nonce': i} for i in range(50)]
+        txs.append({'sender': 'alice', 'bogus': 1})
+        txs.append({'sender': 'alice', 'recipient': 'bob', 'amount': [1]})
+        reply = call({'jsonrpc': '2.0', 'method': 'sendTransactions', 'params': [txs], 'id': 7}).get_json()
+        self.assertEqual(len(reply['result']), 52)
+        self.assertEqual(reply['result'][-2:], [None, None])
+        self.assertEqual(len(chain.mempool), 50)
+        info = call({'jsonrpc': '2.0', 'method': 'getMempoolInfo', 'id': 8}).get_json()
+        self.assertEqual(info['result']['size'], 50)
+
+    def test_rpc_client_pooling_batches_and_retries(self):
+        def answer(message):
+            if message['method'] == 'fail':
+                return {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'boom'}, 'id': message['id']}
+            return {'jsonrpc': '2.0', 'result': [message['method'], message['params']], 'id': message['id']}
+
+        server, seen = serve_json_rpc(answer, fail=1)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        client = RPCClient(url, backoff=0.01, max_batch=40)
+        try:
+            self.assertEqual(client.call('eth_blockNumber'), ['eth_blockNumber', []])
+            self.assertEqual(seen['posts'], 2)
+            for i in range(20):
+                client.call('ping', [i])
+            # Keep-alive: one pooled connection served every sequential call
+            self.assertEqual(len(seen['ports']), 1)
+            backend = GethBackend(url, client=client)
+            responses = backend.send_transactions([{'nonce': i} for i in range(100)])
+            self.assertEqual([r['result'][1][0]['nonce'] for r in responses], list(range(100)))
+            self.assertEqual(len({r['id'] for r in responses}), 100)
+            with self.assertRaises(RPCError):
+                client.call_batch([('ping', [1]), ('fail', [])])
+
+            async def many():
+                return await asyncio.gather(*(client.call_async('ping', [i]) for i in range(30)))
+
+            self.assertEqual([r[1][0] for r in asyncio.run(many())], list(range(30)))
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_rpc_client_does_not_resend_transactions(self):
+        server, seen = serve_json_rpc(lambda m: {'jsonrpc': '2.0', 'result': 1, 'id': m['id']}, delay=0.3)
+        client = RPCClient(f'http://127.0.0.1:{server.server_address[1]}', timeout=0.1, retries=2, backoff=0.01)
+        try:
+            with self.assertRaises(requests.Timeout):
+                client.call('eth_getBalance', ['0xabc'])
+            self.assertEqual(seen['posts'], 3)
+            # The server may have accepted the transaction before the read timed out
+            with self.assertRaises(requests.Timeout):
+                client.call('eth_sendTransaction', [{'nonce': 0}])
+            self.assertEqual(seen['posts'], 4)
+            with self.assertRaises(requests.Timeout):
+                client.batch([('eth_blockNumber', []), ('eth_sendTransaction', [{'nonce': 1}])])
+            self.assertEqual(seen['posts'], 5)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+        # A refused connection never reached the server, so it is safe to retry
+        refused = RPCClient('http://127.0.0.1:1', retries=0)
+        with self.assertRaises(requests.ConnectionError) as caught:
+            refused.call('eth_sendTransaction', [{}])
+        self.assertTrue(RPCClient._connect_failed(caught.exception))
+        refused.close()
+
+    def test_caching_rpc_client(self):
+        chain = {'head': 100}
+
+        def answer(message):
+            method, params = message['method'], message['params']
+            if method == 'eth_blockNumber':
+                result = hex(chain['head'])
+            elif method == 'eth_getBlockByNumber':
+                number = chain['head'] if params[0] == 'latest' else int(params[0], 16)
+                result = {'number': hex(number), 'hash': f'h{number}'} if number <= chain['head'] else None
+            elif method == 'eth_getBlockByHash':
+                result = {'number': '0x1', 'hash': params[0]}
+            elif method == 'eth_getTransactionReceipt':
+                result = {'blockNumber': hex(95), 'status': '0x1'}
+            else:
+                result = params
+            return {'jsonrpc': '2.0', 'result': result, 'id': message['id']}
+
+        server, seen = serve_json_rpc(answer, delay=0.05)
+        now = [0.0]
+        client = CachingRPCClient(f'http://127.0.0.1:{server.server_address[1]}', confirmations=10,
+                                  head_ttl=2.0, clock=lambda: now[0])
+        backend = GethBackend(client.url, client=client)
+        try:
+            self.assertEqual(backend.get_block(50)['result']['hash'], 'h50')
+            self.assertEqual(backend.get_block(50)['result']['hash'], 'h50')
+            self.assertEqual(seen['methods'].count('eth_getBlockByNumber'), 1)
+            # Block 95 is within 10 confirmations of head 100: cached only until the TTL
+            backend.get_transaction_receipt('0xabc')
+            backend.get_transaction_receipt('0xabc')
+            self.assertEqual(seen['methods'].count('eth_getTransactionReceipt'), 1)
+            now[0] = 3.0
+            chain['head'] = 110
+            backend.get_transaction_receipt('0xabc')
+            self.assertEqual(seen['methods'].count('eth_getTransactionReceipt'), 2)
+            self.assertEqual(backend.get_block_number()['result'], hex(110))
+            now[0] = 100.0
+            backend.get_transaction_receipt('0xabc')
+            self.assertEqual(seen['methods'].count('eth_getTransactionReceipt'), 2)
+            self.assertEqual(backend.get_block('latest')['result']['number'], hex(110))
+            self.assertIsNone(backend.get_block(500)['result'])
+            # Concurrent identical calls share one request
+            threads = [threading.Thread(target=backend.get_block_by_hash, args=('0xbeef',)) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(seen['methods'].count('eth_getBlockByHash'), 1)
+            self.assertGreaterEqual(client.stats['coalesced'] + client.stats['hits'], 7)
+            # Batches only send the misses; uncacheable methods always go out
+            posts = seen['posts']
+            responses = client.batch([('eth_getBlockByNumber', [hex(50), False]),
+                                      ('eth_getBlockByNumber', [hex(60), False]),
+                                      ('eth_sendTransaction', [{}])])
+            self.assertEqual([r['result'].get('hash') for r in responses[:2]], ['h50', 'h60'])
+            # One post for the misses, one to refresh the expired head before caching block 60
+            self.assertEqual(seen['posts'], posts + 2)
+            self.assertEqual(seen['methods'][-3:], ['eth_getBlockByNumber', 'eth_sendTransaction', 'eth_blockNumber'])
+            self.assertEqual(len(client.batch([('eth_getBlockByNumber', [hex(60), False])])), 1)
+            self.assertEqual(seen['posts'], posts + 2)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_caching_rpc_client_byte_budget(self):
+        client = CachingRPCClient('http://127.0.0.1:1', max_bytes=300)
+        for i in range(10):
+            response = {'jsonrpc': '2.0', 'result': {'hash': f'0x{i}'}, 'id': i}
+            client._store('eth_getBlockByHash', [f'0x{i}'], client._key('eth_getBlockByHash', [f'0x{i}']), response)
+        self.assertLessEqual(client.bytes, 300)
+        self.assertGreater(client.stats['evictions'], 0)
+        self.assertIsNotNone(client._lookup(client._key('eth_getBlockByHash', ['0x9'])))
+        self.assertIsNone(client._lookup(client._key('eth_getBlockByHash', ['0x0'])))
+        client.close()
+
+    def test_caching_rpc_client_ids_and_batch_coalescing(self):
+        def answer(message):
+            params = message['params']
+            if message['method'] == 'eth_blockNumber':
+                return {'jsonrpc': '2.0', 'result': hex(1000), 'id': message['id']}
+            number = params[0] if isinstance(params[0], str) else hex(params[0])
+            return {'jsonrpc': '2.0', 'result': {'number': number, 'hash': f'h{number}'}, 'id': message['id']}
+
+        server, seen = serve_json_rpc(answer, delay=0.2)
+        client = CachingRPCClient(f'http://127.0.0.1:{server.server_address[1]}')
+        try:
+            first = client.request('eth_getBlockByNumber', ['0x5', False])
+            again = client.request('eth_getBlockByNumber', ['0x5', False])
+            self.assertEqual(again['result'], first['result'])
+            self.assertNotEqual(again['id'], first['id'])
+            self.assertEqual(client.entries[client._key('eth_getBlockByNumber', ['0x5', False])][2]['id'],
+                             first['id'])
+            batch = client.batch([('eth_getBlockByNumber', ['0x5', False])] * 2)
+            self.assertEqual(len({r['id'] for r in batch} | {first['id']}), 3)
+            # An integer block number is not a hex quantity, so it is never cached
+            client.request('eth_getBlockByNumber', [6, False])
+            client.request('eth_getBlockByNumber', [6, False])
+            self.assertEqual(seen['methods'].count('eth_getBlockByNumber'), 3)
+
+            # A batch waits for a single call already in flight instead of repeating it
+            single = threading.Thread(target=client.request, args=('eth_getBlockByNumber', ['0x7', False]))
+            single.start()
+            time.sleep(0.05)
+            responses = client.batch([('eth_getBlockByNumber', ['0x7', False]),
+                                      ('eth_getBlockByNumber', ['0x8', False])])
+            single.join()
+            self.assertEqual([r['result']['hash'] for r in responses], ['h0x7', 'h0x8'])
+            self.assertEqual(seen['methods'].count('eth_getBlockByNumber'), 5)
+            self.assertEqual(client.inflight, {})
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_caching_rpc_client_without_head(self):
+        # The node is unreachable, so the depth of a receipt cannot be checked
+        client = CachingRPCClient('http://127.0.0.1:1', head_ttl=5.0, clock=lambda: 10.0, retries=0)
+        key = client._key('eth_getTransactionReceipt', ['0xabc'])
+        response = {'jsonrpc': '2.0', 'result': {'blockNumber': '0x1'}, 'id': 1}
+        client._store('eth_getTransactionReceipt', ['0xabc'], key, response)
+        self.assertEqual(client.entries[key][0], 15.0)
+        client.close()
+
+    @requires_wasmer
+    def test_wasm_module_cache_pool_and_fuel(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = WASMEngine(cache_dir=tmp, pool_size=2, fuel=1000)
+            first = engine.deploy(METERED_WASM, None, 'alice')
+            second = engine.deploy(METERED_WASM, None, 'bob', stateless=True)
+            self.assertNotEqual(first, second)
+            self.assertEqual((engine.stats['compiled'], engine.stats['reused']), (1, 1))
+            self.assertEqual(engine.interact(first, 'add', [2, 3], 'alice'), 5)
+
+            results = []
+            threads = [threading.Thread(target=lambda i=i: results.append(engine.interact(second, 'add', [i, i], 'bob')))
+                       for i in range(16)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(sorted(results), [2 * i for i in range(16)])
+            self.assertLessEqual(engine.pools[second].created, 2)
+
+            with self.assertRaises(OutOfFuel):
+                engine.interact(first, 'spin', [], 'alice')
+            self.assertEqual(engine.interact(first, 'add', [1, 1], 'alice', fuel=1), 2)
+            with self.assertRaises(OutOfFuel):
+                engine.interact(first, 'add', [1, 1], 'alice', fuel=0)
+
+            # A restarted engine loads the serialized module instead of compiling
+            restarted = WASMEngine(cache_dir=tmp)
+            contract = restarted.deploy(METERED_WASM, None, 'carol')
+            self.assertEqual((restarted.stats['compiled'], restarted.stats['loaded']), (0, 1))
+            self.assertEqual(restarted.interact(contract, 'add', [20, 22], 'carol'), 42)
+
+    def test_wasm_engine_with_fake_wasmer(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.multiple(engines, create=True, **fake_wasmer()):
+            engine = WASMEngine(cache_dir=tmp, pool_size=2, fuel=100)
+            with self.assertRaises(ValueError):
+                engine.deploy(b'', None, 'mallory')
+            self.assertEqual(engine.pools, {})
+            first = engine.deploy(b'env.gas', None, 'alice')
+            second = engine.deploy(b'env.gas', None, 'bob')
+            pure = engine.deploy(b'env.gas', None, 'erin', stateless=True)
+            self.assertEqual((first, second, pure), ('wasm_1', 'wasm_2', 'wasm_3'))
+            self.assertEqual((engine.stats['compiled'], engine.stats['reused']), (1, 2))
+            self.assertIs(engine.pools[first].module, engine.pools[second].module)
+            # Contracts sharing bytecode never share an instance's memory
+            self.assertEqual([engine.interact(first, 'bump', [], 'alice') for _ in range(3)], [1, 2, 3])
+            self.assertEqual(engine.interact(second, 'bump', [], 'bob'), 1)
+
+            def hammer(contract, method, args):
+                results = []
+                threads = [threading.Thread(target=lambda: results.append(engine.interact(contract, method, args, 'x')))
+                           for _ in range(16)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                return sorted(results)
+
+            # Every call to a stateful contract sees the same memory
+            self.assertEqual(hammer(first, 'bump', []), list(range(4, 20)))
+            self.assertEqual(engine.pools[first].created, 1)
+            self.assertEqual(hammer(pure, 'add', [2, 3]), [5] * 16)
+            self.assertLessEqual(engine.pools[pure].created, 2)
+
+            with self.assertRaises(OutOfFuel):
+                engine.interact(first, 'spin', [], 'alice')
+            self.assertEqual(engine.interact(first, 'bump', [], 'alice'), 20)
+            created = engine.pools[pure].created
+            with self.assertRaises(OutOfFuel):
+                engine.interact(pure, 'spin', [], 'erin')
+            self.assertEqual(engine.pools[pure].created, created - 1)
+            self.assertEqual(engine.interact(first, 'add', [2, 3], 'alice', fuel=1), 5)
+            with self.assertRaises(OutOfFuel):
+                engine.interact(first, 'add', [2, 3], 'alice', fuel=0)
+            self.assertIsNone(engine.interact(first, 'missing', [], 'alice'))
+            self.assertIsNone(engine.interact('wasm_9', 'add', [1, 2], 'alice'))
+
+            restarted = WASMEngine(cache_dir=tmp)
+            contract = restarted.deploy(b'env.gas', None, 'carol')
+            self.assertEqual((restarted.stats['compiled'], restarted.stats['loaded']), (0, 1))
+            self.assertEqual(restarted.interact(contract, 'add', [20, 22], 'carol'), 42)
+            # A damaged artifact is recompiled rather than trusted
+            artifact = os.path.join(tmp, hashlib.sha256(b'env.gas').hexdigest() + '.wasmu')
+            with open(artifact, 'wb') as f:
+                f.write(b'garbage')
+            again = WASMEngine(cache_dir=tmp)
+            again.deploy(b'env.gas', None, 'dave')
+            self.assertEqual((again.stats['compiled'], again.stats['loaded']), (1, 0))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,16 @@
-class Transaction:
-    def __init__(self, sender, recipient, amount, contract=None):
+from .serialization import Serializable, register
+
+
+@register(1)
+class Transaction(Serializable):
+    FIELDS = ("sender", "recipient", "amount", "contract", "fee", "nonce")
+    __slots__ = FIELDS
+
+    def __init__(self, sender, recipient, amount, contract=None, fee=0, nonce=None):
         self.sender = sender
         self.recipient = recipient
         self.amount = amount
         self.contract = contract
+        self.fee = fee
+        self.nonce = nonce  # per-sender sequence number; orders and replaces pending txs
         # Add more fields as needed
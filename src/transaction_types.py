@@ -1,12 +1,32 @@
 import time
 
-class TransactionType:
+from . import crypto
+from .serialization import Serializable, register
+
+class TransactionType(Serializable):
     """Base class for transaction types."""
+    __slots__ = ()
+
+    def check(self):
+        """Stateless checks (signatures, time locks) that don't depend on balances."""
+        return True
+
+    def check_signatures(self):
+        return True
+
+    def signature_items(self):
+        """(public key, message, signature) triples check_signatures may verify."""
+        return []
+
     def validate(self, *args, **kwargs):
         return True
 
+@register(2)
 class UTXOTransaction(TransactionType):
     """UTXO model transaction."""
+    FIELDS = ("inputs", "outputs")
+    __slots__ = FIELDS
+
     def __init__(self, inputs, outputs):
         self.inputs = inputs  # list of (txid, index)
         self.outputs = outputs  # list of (address, amount)
@@ -22,13 +42,18 @@ class UTXOTransaction(TransactionType):
         # Spend inputs, add outputs
         for txid, idx in self.inputs:
             utxo_set.pop((txid, idx), None)
-        new_txid = f"tx_{int(time.time())}"
+        # Content-hash txid, so two transactions never collide on output names
+        new_txid = self.txid
         for i, (address, amount) in enumerate(self.outputs):
             utxo_set[(new_txid, i)] = (address, amount)
         return utxo_set
 
+@register(3)
 class AccountTransaction(TransactionType):
     """Account-based transaction."""
+    FIELDS = ("sender", "recipient", "amount")
+    __slots__ = FIELDS
+
     def __init__(self, sender, recipient, amount):
         self.sender = sender
         self.recipient = recipient
@@ -42,8 +67,12 @@ class AccountTransaction(TransactionType):
         balances[self.recipient] = balances.get(self.recipient, 0) + self.amount
         return balances
 
+@register(4)
 class ConfidentialTransaction(TransactionType):
     """Confidential transaction (stub)."""
+    FIELDS = ("sender", "recipient", "commitment")
+    __slots__ = FIELDS
+
     def __init__(self, sender, recipient, commitment):
         self.sender = sender
         self.recipient = recipient
@@ -53,8 +82,13 @@ class ConfidentialTransaction(TransactionType):
         # Stub: always valid
         return True
 
+@register(5)
 class MultiSigTransaction(TransactionType):
     """Multi-signature transaction."""
+    FIELDS = ("signers", "required", "sender", "recipient", "amount")
+    EXTRA_FIELDS = ("signatures",)
+    __slots__ = FIELDS + EXTRA_FIELDS
+
     def __init__(self, signers, required, sender, recipient, amount):
         self.signers = signers  # list of public keys
         self.required = required  # number of required signatures
@@ -66,16 +100,45 @@ class MultiSigTransaction(TransactionType):
     def add_signature(self, signature):
         self.signatures.append(signature)
 
+    def sign(self, private_key):
+        """Add an ed25519 signature over signing_hash(); sign in `signers` order."""
+        self.add_signature(crypto.sign(private_key, self.signing_hash()))
+
+    def check_signatures(self):
+        # Like CHECKMULTISIG: signatures are matched to signers in order
+        message = self.signing_hash()
+        signers = iter(self.signers)
+        valid = 0
+        for signature in self.signatures:
+            for signer in signers:
+                if crypto.default_verifier.verify(signer, message, signature):
+                    valid += 1
+                    break
+        return valid >= self.required
+
+    def signature_items(self):
+        message = self.signing_hash()
+        return [(signer, message, signature)
+                for i, signature in enumerate(self.signatures) for signer in self.signers[i:]]
+
+    def check(self):
+        return self.check_signatures()
+
     def validate(self, balances):
-        return len(self.signatures) >= self.required and balances.get(self.sender, 0) >= self.amount
+        return self.check() and balances.get(self.sender, 0) >= self.amount
 
     def apply(self, balances):
         balances[self.sender] -= self.amount
         balances[self.recipient] = balances.get(self.recipient, 0) + self.amount
         return balances
 
+@register(6)
 class AtomicSwapTransaction(TransactionType):
     """Atomic swap transaction (cross-chain stub)."""
+    FIELDS = ("sender", "recipient", "amount", "secret_hash", "expiry")
+    # `redeemed` is local swap state, not part of the transaction's content
+    __slots__ = FIELDS + ("redeemed",)
+
     def __init__(self, sender, recipient, amount, secret_hash, expiry):
         self.sender = sender
         self.recipient = recipient
@@ -100,16 +163,23 @@ class AtomicSwapTransaction(TransactionType):
             balances[self.recipient] = balances.get(self.recipient, 0) + self.amount
         return balances
 
+@register(7)
 class TimeLockedTransaction(TransactionType):
     """Time-locked transaction."""
+    FIELDS = ("sender", "recipient", "amount", "unlock_time")
+    __slots__ = FIELDS
+
     def __init__(self, sender, recipient, amount, unlock_time):
         self.sender = sender
         self.recipient = recipient
         self.amount = amount
         self.unlock_time = unlock_time
 
+    def check(self):
+        return time.time() >= self.unlock_time
+
     def validate(self, balances):
-        return time.time() >= self.unlock_time and balances.get(self.sender, 0) >= self.amount
+        return self.check() and balances.get(self.sender, 0) >= self.amount
 
     def apply(self, balances):
         balances[self.sender] -= self.amount
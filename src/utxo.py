@@ -0,0 +1,115 @@
+class UTXOSet:
+    """
+    Unspent outputs keyed by (txid, index) -> (address, amount), with an
+    address index and running balances so owner queries never scan the set.
+    Each connected block records an undo entry so it can be disconnected.
+    """
+    def __init__(self, outputs=None):
+        self.outputs = {}
+        self.by_address = {}
+        self.balances = {}
+        self.undo = []
+        for outpoint, output in (outputs or {}).items():
+            self[outpoint] = output
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __contains__(self, outpoint):
+        return outpoint in self.outputs
+
+    def __getitem__(self, outpoint):
+        return self.outputs[outpoint]
+
+    def get(self, outpoint, default=None):
+        return self.outputs.get(outpoint, default)
+
+    def __setitem__(self, outpoint, output):
+        if outpoint in self.outputs:
+            self.pop(outpoint)
+        address, amount = output
+        self.outputs[outpoint] = output
+        self.by_address.setdefault(address, set()).add(outpoint)
+        self.balances[address] = self.balances.get(address, 0) + amount
+
+    def pop(self, outpoint, default=None):
+        output = self.outputs.pop(outpoint, None)
+        if output is None:
+            return default
+        address, amount = output
+        owned = self.by_address[address]
+        owned.discard(outpoint)
+        if not owned:
+            del self.by_address[address]
+            del self.balances[address]
+        else:
+            self.balances[address] -= amount
+        return output
+
+    def values(self):
+        return self.outputs.values()
+
+    def balance(self, address):
+        return self.balances.get(address, 0)
+
+    def unspent(self, address):
+        """Outpoints owned by `address`, with their amounts."""
+        return [(outpoint, self.outputs[outpoint][1]) for outpoint in self.by_address.get(address, ())]
+
+    def validate_block(self, txs):
+        """
+        Check a whole block: every input must be unspent (or created earlier in
+        the same block), no outpoint may be spent twice within the block, and
+        no output may overwrite an unspent one with the same txid (BIP 30).
+        """
+        return self._plan(txs) is not None
+
+    def _plan(self, txs):
+        created = set()
+        spent = set()
+        txids = []
+        for tx in txs:
+            for outpoint in tx.inputs:
+                outpoint = tuple(outpoint)
+                if outpoint in spent or (outpoint not in self.outputs and outpoint not in created):
+                    return None
+                spent.add(outpoint)
+            txid = tx.txid
+            txids.append(txid)
+            for i in range(len(tx.outputs)):
+                outpoint = (txid, i)
+                # Overwriting a live output would lose it on disconnect
+                if (outpoint in self.outputs or outpoint in created) and outpoint not in spent:
+                    return None
+                created.add(outpoint)
+        return txids
+
+    def connect_block(self, txs):
+        """Validate and apply a block; returns False and changes nothing if it is invalid."""
+        txids = self._plan(txs)
+        if txids is None:
+            return False
+        spent = []
+        created = set()
+        for tx, txid in zip(txs, txids):
+            for outpoint in tx.inputs:
+                outpoint = tuple(outpoint)
+                output = self.pop(outpoint)
+                # Outputs created and spent inside this block need no undo
+                if outpoint in created:
+                    created.discard(outpoint)
+                else:
+                    spent.append((outpoint, output))
+            for i, output in enumerate(tx.outputs):
+                self[(txid, i)] = tuple(output)
+                created.add((txid, i))
+        self.undo.append((spent, created))
+        return True
+
+    def disconnect_block(self):
+        """Undo the most recently connected block."""
+        spent, created = self.undo.pop()
+        for outpoint in created:
+            self.pop(outpoint)
+        for outpoint, output in spent:
+            self[outpoint] = output
@@ -0,0 +1,84 @@
+import hashlib
+import mmap
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .block import Block, HEADER_PREFIX, HEADER_SIZE
+from .storage import RECORD_HEADER
+
+
+def _file_records(path, begin, end):
+    """(stored hash, payload) pairs in a segment byte range; payload is None if its checksum fails."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        pos = begin
+        while pos < end:
+            size, crc, block_hash = RECORD_HEADER.unpack_from(mapped, pos)
+            pos += RECORD_HEADER.size
+            payload = mapped[pos:pos + size]
+            yield block_hash, payload if zlib.crc32(payload) == crc else None
+            pos += size
+
+
+def verify_span(span, min_difficulty=0, full=False):
+    """
+    Check one span from BlockStore.spans: each header hashes to its stored
+    hash, carries the expected height, links to the previous block in the
+    span and meets its proof of work; with `full`, bodies must also match
+    their Merkle roots. Returns (first bad height or None, previous hash of
+    the first block, hash of the last block) so spans can be joined.
+    """
+    kind, height = span[0], span[1]
+    records = _file_records(*span[2:]) if kind == "file" else span[2]
+    first_previous = previous = None
+    for block_hash, payload in records:
+        if payload is None or len(payload) < HEADER_SIZE:
+            return height, first_previous, None
+        header = payload[:HEADER_SIZE]
+        digest = hashlib.sha256(header).digest()
+        _, index, previous_hash, _, _, difficulty = HEADER_PREFIX.unpack_from(header)
+        if first_previous is None:
+            first_previous = previous_hash
+        elif previous_hash != previous:
+            return height, first_previous, None
+        if digest != block_hash or index != height:
+            return height, first_previous, None
+        # Genesis is exempt from proof of work
+        if height and (difficulty < min_difficulty or int.from_bytes(digest, "big") >> (256 - 4 * difficulty)):
+            return height, first_previous, None
+        if full:
+            try:
+                Block.decode(payload)
+            except ValueError:
+                return height, first_previous, None
+        previous = digest
+        height += 1
+    return None, first_previous, previous
+
+
+def verify_store(store, start=0, workers=None, min_difficulty=0, full=False, span_size=50000):
+    """
+    Verify blocks [start, len(store)) across a process pool; returns the
+    first bad height or None. Verification starting above 0 trusts the
+    block below `start` and checks the link to it.
+    """
+    spans = list(store.spans(start, len(store), span_size))
+    previous = bytes.fromhex(store[start - 1].hash.rjust(64, "0")) if start else None
+    workers = workers or os.cpu_count() or 1
+    if len(spans) < 2 or workers == 1:
+        return _join(spans, (verify_span(span, min_difficulty, full) for span in spans), previous)
+    with ProcessPoolExecutor(max_workers=min(workers, len(spans))) as pool:
+        results = pool.map(verify_span, spans, [min_difficulty] * len(spans), [full] * len(spans))
+        bad = _join(spans, results, previous)
+        pool.shutdown(cancel_futures=True)
+        return bad
+
+
+def _join(spans, results, previous):
+    for span, (bad, first_previous, last) in zip(spans, results):
+        if previous is not None and first_previous is not None and first_previous != previous:
+            return span[1]
+        if bad is not None:
+            return bad
+        previous = last
+    return None